@@ -10,7 +10,7 @@ from nn_components.layers import ConvLayer, ActivationLayer, PoolingLayer, Flatt
 
 class CNN(NeuralNetwork):
 
-    def __init__(self, epochs, batch_size, optimizer, cnn_structure):
+    def __init__(self, epochs, batch_size, optimizer, cnn_structure, dtype="float32"):
         """
         A Convolutional Neural Network.
 
@@ -20,8 +20,9 @@ class CNN(NeuralNetwork):
         batch_size: (integer) number of batch size to train at each iterations.
         optimizer: (object) optimizer class to use (gsd, gsd_momentum, rms_prop, adam)
         cnn_structure: (list) a list of dictionary of cnn architecture.
+        dtype: (string) dtype policy of the model, either `float32`, `float64` or `mixed_float16`.
         """
-        super().__init__(epochs, batch_size, optimizer, cnn_structure)
+        super().__init__(epochs, batch_size, optimizer, cnn_structure, dtype)
 
     def _structure(self, cnn_structure):
         """
@@ -38,6 +39,8 @@ class CNN(NeuralNetwork):
             + stride: (int) stride of conv filter.
             + weight_init: (str) choose which kind to initialize the filter, either `he` `xavier` or `std`.
             + padding: (str) padding type of input corresponding to the output, either `SAME` or `VALID`.
+            + backend (optional): (str) convolution backend, either `gemm` (default) or `einsum`.
+            + algorithm (optional): (str) convolution algorithm, either `direct` (default), `fft`, `winograd` or `auto`.
             + activation (optional): (str) apply activation to the output of the layer. LINEAR -> ACTIVATION.
             + batch_norm (optional): (any) apply batch norm to the output of the layer. LINEAR -> BATCH NORM -> ACTIVATION
         
@@ -65,12 +68,16 @@ class CNN(NeuralNetwork):
                 padding = struct["padding"]
                 stride = struct["stride"]
                 weight_init = struct["weight_init"]
-                conv_layer = ConvLayer(filter_size, filters, padding, stride, weight_init)
+                backend = struct.get("backend", "gemm")
+                algorithm = struct.get("algorithm", "direct")
+                conv_layer = ConvLayer(filter_size, filters, padding, stride, weight_init, backend, algorithm)
                 conv_layer.initialize_optimizer(self.optimizer)
+                conv_layer.initialize_policy(self.policy)
                 layers.append(conv_layer)
                 if "batch_norm" in struct:
                     bn_layer = BatchNormLayer()
                     bn_layer.initialize_optimizer(self.optimizer)
+                    bn_layer.initialize_policy(self.policy)
                     layers.append(bn_layer)
                 if "activation" in struct:
                     activation = struct["activation"]
@@ -87,10 +94,12 @@ class CNN(NeuralNetwork):
                 weight_init = struct["weight_init"]
                 fc_layer = FCLayer(num_neurons=num_neurons, weight_init=weight_init)
                 fc_layer.initialize_optimizer(self.optimizer)
+                fc_layer.initialize_policy(self.policy)
                 layers.append(fc_layer)
                 if "batch_norm" in struct: 
                     bn_layer = BatchNormLayer()
                     bn_layer.initialize_optimizer(self.optimizer)
+                    bn_layer.initialize_policy(self.policy)
                     layers.append(bn_layer)    
                 if "activation" in struct:
                     activation = struct["activation"]
@@ -98,9 +107,9 @@ class CNN(NeuralNetwork):
                     layers.append(act_layer)
         return layers
 
-    def _backward(self, Y, Y_hat, X):
+    def _backward(self, Y, Y_hat, X, scale=1.0):
         """
-        CNN backward propagation.
+        CNN backward propagation. Accumulate the gradients of the weights, `apply_gradients` updates them.
 
         Parameters
         ----------
@@ -110,8 +119,9 @@ class CNN(NeuralNetwork):
             shape = (m, C).
         X: training dataset.
             shape = (m, iW, iH, iC).
+        scale: (float) weight of this batch in the accumulated gradients.
         """
-        dA_prev = self._backward_last(Y, Y_hat)
+        dA_prev = self._backward_last(Y, Y_hat, scale)
         for i in range(len(self.layers)-3, 0, -1):
             if isinstance(self.layers[i], (FCLayer, ConvLayer, BatchNormLayer)):
                 dA_prev = self.layers[i].backward(dA_prev, self.layers[i-1])
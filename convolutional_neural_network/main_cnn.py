@@ -5,21 +5,23 @@ import os
 from libs.utils import one_hot_encoding
 from optimizations_algorithms.optimizers import SGD, SGDMomentum, RMSProp, Adam
 from convolutional_neural_network import CNN
-from keras.datasets.cifar10 import load_data as load_dataset_cifar10
-
-
-def main(use_keras=False):
-    arch = [{"type": "conv", "filter_size": (3, 3), "filters": 6, "padding": "SAME", "stride": 1, "activation": "relu", "weight_init": "he_normal"},
-            {"type": "pool", "filter_size": (2, 2), "stride": 2, "mode": "max"},
-            {"type": "conv", "filter_size": (3, 3), "filters": 16, "padding": "SAME", "stride": 1, "activation": "relu", "weight_init": "he_normal"},
-            {"type": "pool", "filter_size": (2, 2), "stride": 2, "mode": "max"},
-            {"type": "conv", "filter_size": (3, 3), "filters": 32, "padding": "SAME", "stride": 1, "activation": "relu", "weight_init": "he_normal"},
-            {"type": "pool", "filter_size": (2, 2), "stride": 2, "mode": "max"},
-            "flatten",
-            {"type": "fc", "num_neurons": 128, "weight_init": "he_normal", "activation": "relu"}, # use "batch_norm": None
-            {"type": "fc", "num_neurons": 64, "weight_init": "he_normal", "activation": "relu"},
-            {"type": "fc", "num_neurons": 10, "weight_init": "he_normal", "activation": "softmax"}
-            ]
+
+
+arch = [{"type": "conv", "filter_size": (3, 3), "filters": 6, "padding": "SAME", "stride": 1, "activation": "relu", "weight_init": "he_normal"},
+        {"type": "pool", "filter_size": (2, 2), "stride": 2, "mode": "max"},
+        {"type": "conv", "filter_size": (3, 3), "filters": 16, "padding": "SAME", "stride": 1, "activation": "relu", "weight_init": "he_normal"},
+        {"type": "pool", "filter_size": (2, 2), "stride": 2, "mode": "max"},
+        {"type": "conv", "filter_size": (3, 3), "filters": 32, "padding": "SAME", "stride": 1, "activation": "relu", "weight_init": "he_normal"},
+        {"type": "pool", "filter_size": (2, 2), "stride": 2, "mode": "max"},
+        "flatten",
+        {"type": "fc", "num_neurons": 128, "weight_init": "he_normal", "activation": "relu"}, # use "batch_norm": None
+        {"type": "fc", "num_neurons": 64, "weight_init": "he_normal", "activation": "relu"},
+        {"type": "fc", "num_neurons": 10, "weight_init": "he_normal", "activation": "softmax"}
+        ]
+
+
+def main(use_keras=False, workers=1, micro_batches=1):
+    from keras.datasets.cifar10 import load_data as load_dataset_cifar10
     epochs = 10
     batch_size = 64
     learning_rate = 0.006
@@ -38,11 +40,11 @@ def main(use_keras=False):
         training_phase = weight_path not in os.listdir(".")
     if training_phase:
         (images_train, labels_train), (_, _) = load_dataset_cifar10()
-        images_train = images_train / 255
-        labels_train = one_hot_encoding(labels_train)
+        images_train = images_train.astype(np.float32) / 255
+        labels_train = one_hot_encoding(labels_train, dtype=np.float32)
         
         if not use_keras:
-            cnn.train(images_train, labels_train)
+            cnn.train(images_train, labels_train, workers=workers, micro_batches=micro_batches)
             cnn.save(weight_path)
         else:
             cnn.train(images_train, labels_train)
@@ -50,7 +52,7 @@ def main(use_keras=False):
     if not training_phase:
         import pickle
         (_, _), (images_test, labels_test) = load_dataset_cifar10()
-        images_test = images_test / 255
+        images_test = images_test.astype(np.float32) / 255
         labels_test = np.squeeze(labels_test)
         if not use_keras:
             with open(weight_path, "rb") as f:
@@ -123,14 +125,166 @@ def test():
     print("====> " + pool_out)
 
 
+def test_backward():
+    """
+    Check the vectorized col2im of ConvLayer against the per-pixel loop and against a numerical gradient,
+    for every filter size/stride/padding combination, then check every convolution algorithm against `direct`.
+    Doesn't need Tensorflow.
+    """
+    from nn_components.layers import ConvLayer
+
+    def col2im_loop(d_cols, input_shape, stride):
+        _, oH, oW, fH, fW, _ = d_cols.shape
+        dA = np.zeros(shape=input_shape)
+        for h in range(oH):
+            for w in range(oW):
+                h_step = h*stride
+                w_step = w*stride
+                dA[:, h_step:h_step+fH, w_step:w_step+fW, :] += d_cols[:, h, w, :, :, :]
+        return dA
+
+    blank = "----------------------"
+    print(blank + "TEST BACKWARD CONVOLUTION (COL2IM)" + blank)
+    epsilon = 1e-6
+    for filter_size in [(1, 1), (2, 2), (3, 3), (5, 5)]:
+        for stride in [1, 2, 3]:
+            for padding in ["SAME", "VALID"]:
+                conv_layer = ConvLayer(filter_size=filter_size, filters=4, padding=padding, stride=stride)
+                conv_layer.debug = True
+                X = np.random.normal(size=(2, 7, 7, 3))
+                output = conv_layer.forward(X)
+                d_prev = np.random.normal(size=output.shape)
+                dA, dW = conv_layer.backward(d_prev, X)
+
+                X_pad = conv_layer._pad_input(X) if padding == "SAME" else X
+                d_cols = conv_layer._conv_op_backward(conv_layer.W, d_prev, update_params=False)
+                loop_result = np.allclose(conv_layer._col2im(d_cols, X_pad.shape),
+                                          col2im_loop(d_cols, X_pad.shape, stride))
+
+                # J = sum(output * d_prev) => dJ/dX = dA. Check a few random entries by central differences.
+                num_grad, ana_grad = [], []
+                for _ in range(10):
+                    idx = tuple(np.random.randint(s) for s in X.shape)
+                    X_plus, X_minus = X.copy(), X.copy()
+                    X_plus[idx] += epsilon
+                    X_minus[idx] -= epsilon
+                    J_plus = np.sum(conv_layer.forward(X_plus)*d_prev)
+                    J_minus = np.sum(conv_layer.forward(X_minus)*d_prev)
+                    num_grad.append((J_plus - J_minus)/(2*epsilon))
+                    ana_grad.append(dA[idx])
+                grad_result = dA.shape == X.shape and np.allclose(num_grad, ana_grad, atol=1e-5)
+                out = "PASS" if loop_result and grad_result else "FAIL"
+                print("====> filter %s, stride %d, %s: %s" % (str(filter_size), stride, padding, out))
+
+    print(blank + "TEST CONVOLUTION ALGORITHMS AGAINST DIRECT" + blank)
+    for filter_size in [(1, 1), (3, 3), (5, 5), (7, 7)]:
+        for stride in [1, 2]:
+            for padding in ["SAME", "VALID"]:
+                X = np.random.normal(size=(2, 11, 11, 3))
+                results = {}
+                for algorithm in ["direct", "fft", "winograd", "auto"]:
+                    if algorithm == "winograd" and (filter_size != (3, 3) or stride != 1):
+                        continue
+                    conv_layer = ConvLayer(filter_size=filter_size, filters=4, padding=padding, stride=stride,
+                                           algorithm=algorithm)
+                    conv_layer.debug = True
+                    if "direct" in results:
+                        conv_layer.W = W
+                    output = conv_layer.forward(X)
+                    if algorithm == "direct":
+                        W = conv_layer.W
+                        d_prev = np.random.normal(size=output.shape)
+                    dA, dW = conv_layer.backward(d_prev, X)
+                    results[algorithm] = (output, dA, dW)
+                for algorithm in list(results.keys())[1:]:
+                    result = all(np.allclose(a, b) for a, b in zip(results["direct"], results[algorithm]))
+                    out = "PASS" if result else "FAIL"
+                    print("====> %s, filter %s, stride %d, %s: %s" % (algorithm, str(filter_size), stride, padding, out))
+
+
+def benchmark(batch_size=64, repeats=5):
+    """
+    Compare the convolution algorithms and backends on the conv layers of `arch` with CIFAR-10 sized inputs.
+    """
+    import time
+    from nn_components.layers import ConvLayer
+
+    configs = [("direct", backend) for backend in ConvLayer._backends.keys()] + [("fft", "gemm"), ("winograd", "gemm")]
+    input_shape = (batch_size, 32, 32, 3)
+    blank = "----------------------"
+    for struct in arch:
+        if type(struct) is str or struct["type"] == "fc":
+            break
+        if struct["type"] == "pool":
+            m, iH, iW, iC = input_shape
+            fH, fW = struct["filter_size"]
+            input_shape = (m, (iH - fH)//struct["stride"] + 1, (iW - fW)//struct["stride"] + 1, iC)
+            continue
+        X = np.random.normal(size=input_shape)
+        W = np.random.normal(size=struct["filter_size"] + (input_shape[-1], struct["filters"]))
+        print(blank + "CONV %s -> %d filters" % (str(input_shape), struct["filters"]) + blank)
+        results = {}
+        for algorithm, backend in configs:
+            if algorithm == "winograd" and (tuple(struct["filter_size"]) != (3, 3) or struct["stride"] != 1):
+                continue
+            name = algorithm + "/" + backend if algorithm == "direct" else algorithm
+            conv_layer = ConvLayer(struct["filter_size"], struct["filters"], struct["padding"], struct["stride"],
+                                   struct["weight_init"], backend=backend, algorithm=algorithm)
+            conv_layer.W = W
+            conv_layer.debug = True
+            output = conv_layer.forward(X)
+            d_prev = np.ones(shape=output.shape)
+            start = time.time()
+            for _ in range(repeats):
+                conv_layer.forward(X)
+            forward_time = (time.time() - start)/repeats
+            start = time.time()
+            for _ in range(repeats):
+                dA, dW = conv_layer.backward(d_prev, X)
+            backward_time = (time.time() - start)/repeats
+            results[name] = (output, dA, dW)
+            print("%-15s forward: %.4fs | backward: %.4fs" % (name, forward_time, backward_time))
+        names = list(results.keys())
+        for name in names[1:]:
+            diff = max(np.max(np.abs(a - b)) for a, b in zip(results[names[0]], results[name]))
+            print("max |%s - %s|: %.3e" % (name, names[0], diff))
+        input_shape = output.shape
+
+
+def benchmark_workers(num_data=512, batch_size=128):
+    """
+    Training throughput (images/s) of one epoch of `arch` on random CIFAR-10 sized data with 1, 2, 4 and 8 worker processes.
+    """
+    import time
+
+    images = np.random.uniform(size=(num_data, 32, 32, 3)).astype(np.float32)
+    labels = one_hot_encoding(np.random.randint(0, 10, size=num_data), dtype=np.float32)
+    print("CPU count: %d" % os.cpu_count())
+    for workers in [1, 2, 4, 8]:
+        cnn = CNN(epochs=1, batch_size=batch_size, optimizer=Adam(alpha=0.006), cnn_structure=arch)
+        start = time.perf_counter()
+        cnn.train(images, labels, workers=workers, seed=0)
+        elapsed = time.perf_counter() - start
+        print("workers=%d: %.0f images/s" % (workers, num_data/elapsed))
+
+
 if __name__ == "__main__":
     import argparse
 
     parser = argparse.ArgumentParser(description="A CNN program.")
     parser.add_argument("--keras", action="store_true", help="Whether use keras or not.")
+    parser.add_argument("--workers", type=int, default=1, help="Number of data-parallel training processes.")
+    parser.add_argument("--micro_batches", type=int, default=1, help="Number of micro-batches to accumulate gradients over.")
     parser.add_argument("--test", action="store_true", help="Run the test cases.")
+    parser.add_argument("--benchmark", action="store_true", help="Benchmark the convolution algorithms and backends.")
+    parser.add_argument("--benchmark_workers", action="store_true", help="Benchmark data-parallel training throughput.")
     args = parser.parse_args()
     if args.test:
+        test_backward()
         test()
+    elif args.benchmark:
+        benchmark()
+    elif args.benchmark_workers:
+        benchmark_workers()
     else:
-        main(use_keras=args.keras)
\ No newline at end of file
+        main(use_keras=args.keras, workers=args.workers, micro_batches=args.micro_batches)
\ No newline at end of file
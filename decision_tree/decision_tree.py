@@ -5,32 +5,56 @@ Author: Giang Tran.
 import numpy as np
 from math import log2
 
+_math_log2 = np.frompyfunc(log2, 1, 1)
+
+
+def _log2(x):
+    """
+    Elementwise math.log2, 0 where x is 0. np.log2 doesn't always round like math.log2: this keeps the entropies
+    bit-identical to the former per-category loops (the count tables are small, the cost is in counting).
+    """
+    out = np.zeros(shape=x.shape)
+    positive = x > 0
+    out[positive] = _math_log2(x[positive]).astype(np.float64)
+    return out
+
 
 class NodeDT:
     """
     Class Node represents in Decision Tree
     """
 
-    def __init__(self, X, y, feature_name):
+    def __init__(self, start, end, class_counts, feature_name):
+        """
+        :param start, end: during training, the data points of the node are rows[start:end] of the tree's permuted
+            row indices.
+        :param class_counts: number of data points of each class in the node.
+        :param feature_name: name of the feature split by the parent.
+        """
         self.feature_name = feature_name
-        self.X = X
-        self.y = y
+        self.start = start
+        self.end = end
+        self.class_counts = class_counts
         self.is_leaf = False
         self.label = None
         self.used = []
+        # number of splits above the node: in `hist` mode a numerical feature can be used more than once.
+        self.depth = 0
+        # numerical split of the `hist` mode: children `feature_0` (value < threshold) and `feature_1`.
+        self.threshold = None
+        self._entropy = None
 
     def entropy(self):
         """
-        Compute entropy at a given node.
+        Compute entropy at a given node, once.
         E(X) = - sum_v(p(X_v) * log_2(p(X_v))) with X_v is a subset of X = (X_1, X_2, ..., X_n)
         :return: entropy coefficient.
         """
-        n = len(self.y)
-        sum_ = 0
-        for i in np.unique(self.y):
-            v = len(self.y[self.y == i])
-            sum_ += -((v/n) * log2(v/n))
-        return sum_
+        if self._entropy is None:
+            p = self.class_counts / (self.end - self.start)
+            # cumsum: sequential sum, in the order of the former loop.
+            self._entropy = np.cumsum(-(p * _log2(p)))[-1]
+        return self._entropy
 
     def classification_error(self):
         pass
@@ -42,104 +66,135 @@ class DecisionTree:
     """
 
     _metrics = {'ce': '_classification_error', 'ig': '_information_gain'}
+    _binnings = ('exact', 'hist')
 
-    def __init__(self, max_depth=None, criterion='ig'):
+    def __init__(self, max_depth=None, criterion='ig', max_thresholds=1, binning='exact', max_bins=256):
         """
         :param max_depth: define what depth of the tree should be.
         :param criterion: either 'ce' or 'ig'.
+        :param max_thresholds: maximum number of thresholds that turn a numerical feature into categories.
+        :param binning: `exact`: numerical features are turned into categories once with `max_thresholds` thresholds.
+            `hist`: every feature is quantized once into uint8 codes (numerical features into at most `max_bins`
+            quantile bins) and each node splits a numerical feature on the bin edge with the best information gain,
+            found from the node's class histograms.
+        :param max_bins: maximum number of bins of a numerical feature in `hist` mode, at most 256.
         """
+        assert binning in self._binnings, "binning must be one of: %s" % list(self._binnings)
+        assert 2 <= max_bins <= 256, "max_bins must be between 2 and 256 to fit uint8 codes."
         self.max_depth = max_depth
+        self.max_thresholds = max_thresholds
+        self.binning = binning
+        self.max_bins = max_bins
         self.criterion = criterion
         if self.criterion not in self._metrics.keys():
             self.criterion = 'ig'
         self.num_class = 0
         self.tree = None
         self.thresholds = {}
+        # `hist` mode: bin edges of the numerical features, category values of the others.
+        self.bin_edges = {}
+        self.categories = {}
 
     def _is_numerical(self, feature):
         return len(np.unique(feature)) >= 100
 
-    def _find_threshold(self, feature, y_train, num_class):
+    def _find_thresholds(self, feature, y_train):
         """
-        The main point is find a good threshold that is the optimal split label.
+        The main point is find good thresholds that are the optimal split labels.
         A good threshold is the threshold that minimize mis-classification error.
 
         The algorithm:
-            - If there are `n` data points in feature data => there are `n-1` available thresholds.
-            - For each available threshold, split feature data to 2 partitions.
-            - For each partition, we check and compute mis-classification error for each label.
+            - Sort the feature once. There is an available threshold between each pair of consecutive distinct values.
+            - Cumulative class counts along the sorted order give the class counts of both partitions of every
+                threshold at once.
+            - Each partition predicts a class, the 2 classes are distinct. The best threshold maximizes the number
+                of data points correctly classified.
+            - For more than 1 threshold, greedily split again the partition whose best split classifies the most
+                additional data points correctly, until `max_thresholds` or no improvement.
 
         :param feature: numerical value of `feature`.
         :param y_train: label.
-        :param num_class: number of class
-        :return: categorical value of `feature`.
+        :return: sorted thresholds. Data point goes to category i when thresholds[i-1] <= value < thresholds[i].
         """
-        assert len(num_class) == 2, "This function only assumes work with binary classification."
-        best_threshold = 0.0
-        max_exact_classification = 0.0
-        is_positive_negative = False
-        sorted_feature = sorted(np.unique(feature))
-        for i in range(len(sorted_feature)-1):
-            # assume the value less than threshold is negative (0), greater than threshold is positive (1)
-            threshold = (sorted_feature[i] + sorted_feature[i+1]) / 2
-            left_partition = y_train[feature < threshold]
-            right_partition = y_train[feature > threshold]
-            negative_positive = ((len(left_partition[left_partition == 0]) + len(right_partition[right_partition == 1]))
-                                 / len(feature))
-            # assume the value less than threshold is positive (1), greater than threshold is negative. (0)
-            positive_negative = ((len(left_partition[left_partition == 1]) + len(right_partition[right_partition == 0]))
-                                 / len(feature))
-            # make decision here
-            is_positive_negative = positive_negative > negative_positive
-            choose = positive_negative if is_positive_negative else negative_positive
-            if max_exact_classification < choose:
-                max_exact_classification = choose
-                best_threshold = threshold
-        return best_threshold, is_positive_negative
-
-    def _entropy(self, feature, node):
+        order = np.argsort(feature, kind='stable')
+        values = feature[order]
+        labels = np.searchsorted(self.num_class, y_train[order])
+        # counts[i, c]: number of data points of class c among the i smallest values.
+        counts = np.zeros(shape=(len(values) + 1, len(self.num_class)), dtype=np.int64)
+        np.cumsum(np.eye(len(self.num_class), dtype=np.int64)[labels], axis=0, out=counts[1:])
+
+        thresholds = []
+        # partitions that can still be split: (gain, split position, start, end) over the sorted values.
+        splits = [self._best_split(values, counts, 0, len(values))]
+        while splits and len(thresholds) < self.max_thresholds:
+            best = max(range(len(splits)), key=lambda i: splits[i][0])
+            gain, position, start, end = splits.pop(best)
+            if thresholds and gain <= 0:
+                break
+            thresholds.append((values[position - 1] + values[position]) / 2)
+            splits.extend([self._best_split(values, counts, start, position),
+                           self._best_split(values, counts, position, end)])
+            splits = [split for split in splits if split is not None]
+        return np.sort(np.array(thresholds, dtype=np.float64))
+
+    def _best_split(self, values, counts, start, end):
+        """
+        Best threshold of the sorted values[start:end].
+        :return: (gain, position, start, end): the threshold is between values[position-1] and values[position],
+            the gain is the number of data points correctly classified compared to predicting a single class.
+            None if all the values are equal.
         """
-        Compute entropy each partition of specific feature in a given node.
-        :param feature: specific feature in dataset of `node`.
-        :param node: a node we're checking on.
+        positions = start + 1 + np.flatnonzero(values[start + 1:end] > values[start:end - 1])
+        if positions.size == 0:
+            return None
+        left = counts[positions] - counts[start]
+        right = counts[end] - counts[positions]
+        rows = np.arange(positions.size)
+        left_top, right_top = np.argmax(left, axis=1), np.argmax(right, axis=1)
+        correct = left[rows, left_top] + right[rows, right_top]
+        if len(self.num_class) > 1:
+            # when both partitions have the same majority class, one of them predicts its second class.
+            left_second = np.partition(left, -2, axis=1)[:, -2]
+            right_second = np.partition(right, -2, axis=1)[:, -2]
+            correct = np.where(left_top != right_top, correct,
+                               np.maximum(left[rows, left_top] + right_second, left_second + right[rows, right_top]))
+        # first maximum: the smallest best threshold.
+        best = np.argmax(correct)
+        return correct[best] - np.max(counts[end] - counts[start]), positions[best], start, end
+
+    def _entropy(self, histogram):
+        """
+        Compute entropy each partition of specific feature in a given node, from the contingency table of the feature.
+        :param histogram: counts[category, class] of the data points of the node.
         :return: an entropy scalar that measure the uncertainty of a feature in data.
         """
-        entropy = 0
-        categories = np.unique(feature)
-        num_point = len(feature)
-        for category in categories:
-            # for each category in that feature
-            num_category = len(feature[feature == category])
-            for c in self.num_class:
-                # count the number of each class
-                num_category_class = len(feature[np.logical_and(feature == category, node.y == c)])
-                if num_category_class == 0:
-                    continue
-                # compute entropy/information gain or classification error
-                entropy += num_category / num_point * (
-                        -num_category_class / num_category * log2(num_category_class / num_category))
-        return entropy
+        sizes = np.sum(histogram, axis=1, keepdims=True)
+        ratio = histogram / np.maximum(sizes, 1)
+        # sum over categories then classes, in the order of the former loops.
+        return np.cumsum((sizes / np.sum(sizes) * (-ratio * _log2(ratio))).ravel())[-1]
 
-    def _information_gain(self, feature, node):
+    def _information_gain(self, histogram, node):
         """
         Compute information gain between a node with that feature.
-        :param feature:
+        :param histogram: contingency table of the feature in `node`.
         :param node:
         :return: information gain coefficient.
         """
-        return node.entropy() - self._entropy(feature, node)
+        return node.entropy() - self._entropy(histogram)
 
-    def _classification_error(self, feature, node):
+    def _classification_error(self, histogram, node):
         pass
 
     def _stop(self, node):
         """
         Stop condition:
-            - Reach max depth or already reach all features.
+            - Reach max depth or already reach all features (in `hist` mode, numerical features can always be split
+                again on another edge).
             - If entropy of that node is 0
         :return: True if the node meets stop condition. False otherwise.
         """
-        return len(node.used) == node.X.shape[1] or len(node.used) == self.max_depth or node.entropy() == 0
+        exhausted = len(set(node.used)) == self._codes.shape[1] and not (self.binning == 'hist' and self.bin_edges)
+        return exhausted or node.depth == self.max_depth or node.entropy() == 0
 
     def _build_dt(self, root, column_name):
         """
@@ -152,68 +207,342 @@ class DecisionTree:
         :param root: root node at current level
         :return:
         """
-        N, D = root.X.shape
+        D = self._codes.shape[1]
         best_coef = 0.0
         best_feature = 0
+        rows = self._rows[root.start:root.end]
+        histograms = self._histograms(self._codes[rows], self._labels[rows])
         for d in range(D):
             if column_name[d] in root.used:
                 continue
-            feature = root.X[:, d]
-            coef = getattr(self, self._metrics[self.criterion])(feature, root)
+            coef = getattr(self, self._metrics[self.criterion])(histograms[d], root)
             if best_coef < coef:
                 best_coef = coef
                 best_feature = d
         # after choose the best feature to split.
         # loop through all its categories to build subtree
-        feature = root.X[:, best_feature]
-        categories = np.unique(feature)
-        for category in categories:
-            node = NodeDT(root.X[feature == category], root.y[feature == category], column_name[best_feature])
-            node.used = root.used + [column_name[best_feature]]
-            setattr(root, 'feature_' + str(category), node)
+        children = self._partition(root, self._codes[rows, best_feature], histograms[best_feature],
+                                   column_name[best_feature])
+        for category, node in children.items():
+            setattr(root, 'feature_' + str(self.categories[best_feature][category]), node)
             setattr(root, 'feature_split', best_feature)
             if not self._stop(node):
                 self._build_dt(node, column_name)
             else:
-                node.is_leaf = True
-                node.label = 1 if len(node.y[node.y == 1]) >= len(node.y[node.y == 0]) else 0
+                self._make_leaf(node)
+
+    def _partition(self, root, keys, class_counts, feature_name):
+        """
+        Partition the rows of `root` in place by key, like quicksort: the rows of key 0 first, then key 1, ...
+        Each non-empty key becomes a child node owning its range of rows.
+        :param keys: child key of each data point of root, integers in [0, number of keys).
+        :param class_counts: class counts of each key, shape = (number of keys, number of classes).
+        :return: dict key -> child node, in key order.
+        """
+        rows = self._rows[root.start:root.end]
+        rows[...] = rows[np.argsort(keys, kind='stable')]
+        sizes = np.sum(class_counts, axis=1)
+        ends = root.start + np.cumsum(sizes)
+        children = {}
+        for key in np.flatnonzero(sizes):
+            node = NodeDT(ends[key] - sizes[key], ends[key], class_counts[key], feature_name)
+            node.used = root.used + [feature_name]
+            node.depth = root.depth + 1
+            children[key] = node
+        return children
+
+    def _majority(self, node):
+        """
+        Index of the majority class of a node, ties go to the largest class.
+        """
+        counts = node.class_counts
+        return len(counts) - 1 - np.argmax(counts[::-1])
+
+    def _make_leaf(self, node):
+        node.is_leaf = True
+        node.label = self.num_class[self._majority(node)]
+
+    def _encode(self, X_train):
+        """
+        Encode every feature once as integer codes: category index, or bin index for numerical features in `hist`
+        mode (uint8 codes). In `exact` mode, the numerical features with thresholds are first turned into their
+        interval index.
+        :return: codes, shape = X_train.shape.
+        """
+        hist = self.binning == 'hist'
+        codes = np.empty(shape=X_train.shape, dtype=np.uint8 if hist else np.intp)
+        self.bin_edges, self.categories = {}, {}
+        for d in range(X_train.shape[1]):
+            feature = X_train[:, d]
+            if d in self.thresholds:
+                feature = np.searchsorted(self.thresholds[d], feature.astype(np.float64), side='right')
+            if hist and self._is_numerical(feature):
+                feature = feature.astype(np.float64)
+                values = np.unique(feature)
+                if len(values) <= self.max_bins:
+                    edges = (values[:-1] + values[1:]) / 2
+                else:
+                    edges = np.unique(np.quantile(feature, np.linspace(0, 1, self.max_bins + 1)[1:-1]))
+                # bin i holds edges[i-1] <= value < edges[i].
+                codes[:, d] = np.searchsorted(edges, feature, side='right')
+                self.bin_edges[d] = edges
+            else:
+                categories, inverse = np.unique(feature, return_inverse=True)
+                assert not hist or len(categories) <= 256, "Categorical features must have at most 256 categories."
+                codes[:, d] = inverse
+                self.categories[d] = categories
+        return codes
+
+    def _histograms(self, codes, labels):
+        """
+        Class histogram (contingency table) of every feature: counts[bin, class] of the data points of a node.
+        One bincount counts all the features: each feature has its own range of bins.
+        :param codes: codes of the data points of the node.
+        :param labels: class indices of the data points of the node.
+        :return: list of arrays, shape = (number of bins/categories of the feature, number of classes).
+        """
+        num_class = len(self.num_class)
+        num_bins = [len(self.bin_edges[d]) + 1 if d in self.bin_edges else len(self.categories[d])
+                    for d in range(codes.shape[1])]
+        offsets = np.concatenate([[0], np.cumsum(num_bins)])
+        bins = (codes.astype(np.intp) + offsets[:-1]) * num_class + labels[:, None]
+        counts = np.bincount(bins.ravel(), minlength=offsets[-1] * num_class).reshape((offsets[-1], num_class))
+        return np.split(counts, offsets[1:-1])
+
+    def _counts_entropy(self, counts):
+        """
+        Entropy of class counts along the last axis. Empty counts have entropy 0.
+        """
+        total = np.sum(counts, axis=-1, keepdims=True)
+        p = counts / np.maximum(total, 1)
+        return -np.sum(p * np.log2(np.where(p > 0, p, 1)), axis=-1)
+
+    def _histogram_gain(self, d, histogram):
+        """
+        Information gain of the best split of feature `d` from the node's class histogram of that feature.
+        :return: (gain, bin): numerical features split between bins <= bin and > bin, categorical features split
+            on all their categories (bin is None).
+        """
+        class_counts = np.sum(histogram, axis=0)
+        n = np.sum(class_counts)
+        parent_entropy = self._counts_entropy(class_counts)
+        if d not in self.bin_edges:
+            return parent_entropy - self._entropy(histogram), None
+        # left partition of every bin edge.
+        left = np.cumsum(histogram, axis=0)[:-1]
+        right = class_counts - left
+        left_size, right_size = np.sum(left, axis=1), np.sum(right, axis=1)
+        valid = (left_size > 0) & (right_size > 0)
+        if not np.any(valid):
+            return 0.0, None
+        gain = parent_entropy - (left_size * self._counts_entropy(left) + right_size * self._counts_entropy(right)) / n
+        gain = np.where(valid, gain, -np.inf)
+        best = np.argmax(gain)
+        return gain[best], best
+
+    def _build_hist(self, root, column_name, histograms):
+        """
+        `hist` mode version of `_build_dt`: the split gains come from the class histograms of the node.
+        The histograms of all children but the largest are counted from their data points, the largest child gets
+        the parent histograms minus its siblings'.
+        :param root: root node at current level.
+        :param histograms: class histograms of root.
+        """
+        best_coef = 0.0
+        best_feature = None
+        best_bin = None
+        for d in range(self._codes.shape[1]):
+            # a numerical feature can be split again on another edge.
+            if d not in self.bin_edges and column_name[d] in root.used:
+                continue
+            coef, bin_ = self._histogram_gain(d, histograms[d])
+            if best_coef < coef:
+                best_coef, best_feature, best_bin = coef, d, bin_
+        if best_feature is None:
+            self._make_leaf(root)
+            return
+        histogram = histograms[best_feature]
+        feature = self._codes[self._rows[root.start:root.end], best_feature]
+        if best_bin is not None:
+            root.threshold = self.bin_edges[best_feature][best_bin]
+            names = np.array([0, 1])
+            keys = (feature > best_bin).astype(np.intp)
+            class_counts = np.array([np.sum(histogram[:best_bin + 1], axis=0), np.sum(histogram[best_bin + 1:], axis=0)])
+        else:
+            names = self.categories[best_feature]
+            keys = feature
+            class_counts = histogram
+        children = self._partition(root, keys, class_counts, column_name[best_feature])
+        for key, node in children.items():
+            setattr(root, 'feature_' + str(names[key]), node)
+        root.feature_split = best_feature
+        largest = max(children, key=lambda key: children[key].end - children[key].start)
+        stops = {key: self._stop(node) for key, node in children.items()}
+        child_histograms = {}
+        for key, node in children.items():
+            if key != largest and not (stops[key] and stops[largest]):
+                rows = self._rows[node.start:node.end]
+                child_histograms[key] = self._histograms(self._codes[rows], self._labels[rows])
+        if not stops[largest]:
+            # histogram subtraction: the largest child gets the parent histograms minus its siblings'.
+            child_histograms[largest] = [histogram.copy() for histogram in histograms]
+            for key in children:
+                if key != largest:
+                    for total, counts in zip(child_histograms[largest], child_histograms[key]):
+                        total -= counts
+        for key, node in children.items():
+            if stops[key]:
+                self._make_leaf(node)
+            else:
+                self._build_hist(node, column_name, child_histograms.pop(key))
 
     def _train(self, X_train, y_train, column_name):
-        self.tree = NodeDT(X_train, y_train, 'root')
-        self._build_dt(self.tree, column_name)
+        """
+        Grow the tree over index ranges of a single permuted array of row indices, then drop the training data:
+        the nodes only keep their splits and class counts.
+        """
+        self.num_class, self._labels = np.unique(y_train, return_inverse=True)
+        self._codes = self._encode(X_train)
+        self._rows = np.arange(X_train.shape[0])
+        self.tree = NodeDT(0, X_train.shape[0], np.bincount(self._labels, minlength=len(self.num_class)), 'root')
+        if self.binning == 'hist':
+            self._build_hist(self.tree, column_name, self._histograms(self._codes, self._labels))
+        else:
+            self._build_dt(self.tree, column_name)
+        self._codes = self._labels = self._rows = None
+        self._compile()
 
     def train(self, X_train, y_train, column_name):
         self.num_class = np.unique(y_train)
-        _, D = X_train.shape
-        for d in range(D):
-            feature = X_train[:, d]
-            if self._is_numerical(feature):
-                threshold, is_positive_negative = self._find_threshold(feature, y_train, self.num_class)
-                feature[feature < threshold] = int(is_positive_negative)
-                feature[feature > threshold] = int(not is_positive_negative)
-                X_train[:, d] = feature
-                self.thresholds[d] = (threshold, is_positive_negative)
+        self.thresholds = {}
+        if self.binning == 'exact':
+            _, D = X_train.shape
+            for d in range(D):
+                feature = X_train[:, d]
+                if self._is_numerical(feature):
+                    self.thresholds[d] = self._find_thresholds(feature.astype(np.float64), y_train)
         self._train(X_train, y_train, column_name)
 
-    def _predict(self, X_new, node):
-        if not node.is_leaf:
-            node = getattr(node, 'feature_' + str(X_new[node.feature_split]))
-            return self._predict(X_new, node)
-        return node.label
+    def _compile(self):
+        """
+        Flatten the tree into arrays indexed by node id (breadth first order, the root is 0):
+            - split_feature: feature split by the node.
+            - split_threshold: threshold of numerical splits, nan for categorical splits and leaves. Numerical splits
+                are the `hist` mode ones, and in `exact` mode the splits of a feature with a single threshold.
+            - split_numerical: whether the node compares the raw value to its threshold (leaves too), or routes on
+                the category code of the value.
+            - child_offset: the node's row in `children`: children[child_offset] is the node itself (rows with a
+                category unseen in training stay there), then the child of value < threshold and of
+                not value < threshold (value >= threshold or nan, like the searchsorted of the training codes), or
+                the child of each category code. A leaf loops on itself.
+            - node_label: class index of the majority class, also for internal nodes.
+        """
+        nodes = [self.tree]
+        split_feature, split_threshold, split_numerical, child_offset, node_label, children = [], [], [], [], [], []
+        depths = [0]
+        i = 0
+        while i < len(nodes):
+            node = nodes[i]
+            child_offset.append(len(children))
+            children.append(i)
+            node_label.append(self._majority(node))
+            if node.is_leaf:
+                split_feature.append(0)
+                split_threshold.append(np.nan)
+                split_numerical.append(True)
+                children.extend([i, i])
+                i += 1
+                continue
+            d = node.feature_split
+            split_feature.append(d)
+            if node.threshold is not None or len(self.thresholds.get(d, [])) == 1:
+                # children `feature_0` and `feature_1`, the 2 intervals of the threshold.
+                split_threshold.append(node.threshold if node.threshold is not None else self.thresholds[d][0])
+                split_numerical.append(True)
+                names = [0, 1]
+            else:
+                split_threshold.append(np.nan)
+                split_numerical.append(False)
+                names = self.categories[d]
+            for name in names:
+                child = getattr(node, 'feature_' + str(name), None)
+                if child is None:
+                    children.append(i)
+                else:
+                    children.append(len(nodes))
+                    nodes.append(child)
+                    depths.append(depths[i] + 1)
+            i += 1
+        self.depth = max(depths)
+        self.split_feature = np.array(split_feature, dtype=np.intp)
+        self.split_threshold = np.array(split_threshold, dtype=np.float64)
+        self.split_numerical = np.array(split_numerical)
+        self.child_offset = np.array(child_offset, dtype=np.intp)
+        self.node_label = np.array(node_label, dtype=np.intp)
+        self.children = np.array(children, dtype=np.intp)
+        # features routed on their category code.
+        self.categorical_features = np.unique(self.split_feature[~self.split_numerical])
+
+    def _encode_batch(self, X):
+        """
+        Values of X the compiled tree routes on: raw values, and category codes (-1 for categories unseen in
+        training) for the features of categorical splits. X itself when it's already a float64 array and no
+        feature needs codes.
+        :return: shape = X.shape, float64.
+        """
+        if self.categorical_features.size == 0 and X.dtype == np.float64:
+            return X
+        values = np.zeros(shape=X.shape, dtype=np.float64)
+        for d in np.unique(self.split_feature):
+            feature = X[:, d]
+            if d not in self.categorical_features:
+                values[:, d] = feature
+                continue
+            categories = self.categories[d]
+            if d in self.thresholds:
+                # interval index -> category code.
+                table = np.full(len(self.thresholds[d]) + 1, -1)
+                table[categories] = np.arange(len(categories))
+                values[:, d] = table[np.searchsorted(self.thresholds[d], feature.astype(np.float64), side='right')]
+                continue
+            codes = np.minimum(np.searchsorted(categories, feature), len(categories) - 1)
+            values[:, d] = np.where(categories[codes] == feature, codes, -1)
+        return values
+
+    def predict_batch(self, X):
+        """
+        Predict all the rows of X with the compiled tree: all the rows go down one level per iteration, with gathers
+        of their node's split feature, threshold and child. X is not modified.
+        A row with a category unseen in training at some node gets the majority class of that node. A nan value
+        goes to the child of the largest values, as it does when encoding the training set.
+        :param X: shape = (N, D)
+        :return: predicted labels, shape = (N,)
+        """
+        values = np.ascontiguousarray(self._encode_batch(X))
+        # flat index of the first value of each row.
+        row_start = np.arange(X.shape[0]) * values.shape[1]
+        values = values.ravel()
+        node = np.zeros(shape=X.shape[0], dtype=np.intp)
+        for _ in range(self.depth):
+            value = values[row_start + self.split_feature[node]]
+            # slot 0 is the node itself, numerical splits go to slot 1 or 2, category code c to slot c+1.
+            slot = ~(value < self.split_threshold[node]) + 1
+            if self.categorical_features.size > 0:
+                slot = np.where(self.split_numerical[node], slot, value + 1).astype(np.intp)
+            node = self.children[self.child_offset[node] + slot]
+        return self.num_class[self.node_label[node]]
 
     def predict(self, X_new):
-        # First convert numerical feature to categorical feature.
-        for key, (threshold, is_positive_negative) in self.thresholds.items():
-            X_new[key] = int(is_positive_negative) if X_new[key] < threshold else int(not is_positive_negative)
-        tree = self.tree
-        label = self._predict(X_new, tree)
-        return label
+        """
+        Predict a single row X_new, see `predict_batch`.
+        """
+        return self.predict_batch(np.asarray(X_new)[None, :])[0]
 
     def representation(self):
         print(self.tree)
     
 
-if __name__ == '__main__':
+def main():
     import pandas as pd
     from sklearn.tree import DecisionTreeClassifier
 
@@ -227,10 +556,7 @@ if __name__ == '__main__':
     df_test = pd.read_csv('data/titanic_test.csv')
     X_test = df_test.loc[:, :].drop(['Survived', 'PassengerId'], axis=1).values
     y_test = df_test.loc[:, 'Survived'].values
-    predicts = []
-    for x in X_test:
-        predicts.append(dt.predict(x))
-    predicts = np.asarray(predicts)
+    predicts = dt.predict_batch(X_test)
     print("Accuracy:", len(predicts[predicts == y_test])/len(predicts))
 
     dt_sk = DecisionTreeClassifier(max_depth=5)
@@ -244,4 +570,227 @@ if __name__ == '__main__':
     print("Accuracy of Sk-learn:", len(y_pred[y_pred == y_test]) / len(y_pred))
 
 
+def benchmark_split(num_points=(1000, 4000, 16000)):
+    """
+    Time of the presorted threshold search against the quadratic loop it replaces, which re-masks the labels for
+    every candidate threshold, on binary data with a numerical feature. Both must find the same threshold.
+    """
+    import time
+
+    def quadratic_threshold(feature, y_train):
+        best_threshold = 0.0
+        max_exact_classification = 0.0
+        sorted_feature = sorted(np.unique(feature))
+        for i in range(len(sorted_feature)-1):
+            threshold = (sorted_feature[i] + sorted_feature[i+1]) / 2
+            left_partition = y_train[feature < threshold]
+            right_partition = y_train[feature > threshold]
+            negative_positive = ((len(left_partition[left_partition == 0]) + len(right_partition[right_partition == 1]))
+                                 / len(feature))
+            positive_negative = ((len(left_partition[left_partition == 1]) + len(right_partition[right_partition == 0]))
+                                 / len(feature))
+            choose = max(positive_negative, negative_positive)
+            if max_exact_classification < choose:
+                max_exact_classification = choose
+                best_threshold = threshold
+        return best_threshold
+
+    dt = DecisionTree()
+    for n in num_points:
+        y = np.random.randint(0, 2, size=n)
+        feature = np.round(np.random.normal(loc=y, scale=2.0), 4)
+        dt.num_class = np.unique(y)
+        start = time.perf_counter()
+        expected = quadratic_threshold(feature, y)
+        loop_time = time.perf_counter() - start
+        start = time.perf_counter()
+        thresholds = dt._find_thresholds(feature, y)
+        presorted_time = time.perf_counter() - start
+        print("N = %6d | quadratic loop: %.3fs | presorted: %.4fs" % (n, loop_time, presorted_time))
+        out = "PASS" if thresholds.tolist() == [expected] else "FAIL"
+        print("====> same threshold: " + out)
+
+    # multi-class labels and several thresholds: 3 classes on 3 intervals of the feature.
+    feature = np.random.uniform(0, 3, size=3000)
+    y = np.floor(feature).astype(int)
+    dt = DecisionTree(max_thresholds=4)
+    dt.num_class = np.unique(y)
+    thresholds = dt._find_thresholds(feature, y)
+    out = "PASS" if len(thresholds) == 2 and np.allclose(thresholds, [1, 2], atol=1e-2) else "FAIL"
+    print("====> multi-class thresholds %s: %s" % (np.round(thresholds, 3), out))
+
+
+def benchmark_gain(num_points=100000, dim=10, num_class=4):
+    """
+    Time of the contingency table information gains of all features of a node against the former loops over
+    categories x classes with boolean masks. The gains must be identical.
+    """
+    import time
+
+    def loop_gain(feature, y):
+        n = len(y)
+        node_entropy = 0
+        for i in np.unique(y):
+            v = len(y[y == i])
+            node_entropy += -((v/n) * log2(v/n))
+        entropy = 0
+        for category in np.unique(feature):
+            num_category = len(feature[feature == category])
+            for c in np.unique(y):
+                num_category_class = len(feature[np.logical_and(feature == category, y == c)])
+                if num_category_class == 0:
+                    continue
+                entropy += num_category / n * (
+                        -num_category_class / num_category * log2(num_category_class / num_category))
+        return node_entropy - entropy
+
+    X = np.random.randint(0, 8, size=(num_points, dim))
+    y = (X[:, 0] + np.random.randint(0, 3, size=num_points)) % num_class
+    start = time.perf_counter()
+    expected = [loop_gain(X[:, d], y) for d in range(dim)]
+    loop_time = time.perf_counter() - start
+
+    dt = DecisionTree()
+    dt.num_class = np.unique(y)
+    start = time.perf_counter()
+    codes, labels = dt._encode(X), np.searchsorted(dt.num_class, y)
+    node = NodeDT(0, num_points, np.bincount(labels), 'root')
+    gains = [dt._information_gain(histogram, node) for histogram in dt._histograms(codes, labels)]
+    vectorized_time = time.perf_counter() - start
+    print("N = %d, D = %d | loops: %.3fs | contingency tables: %.3fs" % (num_points, dim, loop_time, vectorized_time))
+    out = "PASS" if gains == expected else "FAIL"
+    print("====> identical gains: " + out)
+
+
+def benchmark_hist(num_train=200000, num_test=20000, dim=10):
+    """
+    Accuracy and training time of the `hist` mode against the `exact` mode, on titanic and on a large synthetic
+    dataset of numerical features.
+    """
+    import time
+    import pandas as pd
+
+    df = pd.read_csv('data/titanic_train.csv')
+    df_test = pd.read_csv('data/titanic_test.csv')
+    column_name = df.columns.drop(['Survived', 'PassengerId'])
+    titanic = (df.loc[:, column_name].values, df.loc[:, 'Survived'].values,
+               df_test.loc[:, column_name].values, df_test.loc[:, 'Survived'].values)
+
+    X = np.random.normal(size=(num_train + num_test, dim))
+    # 3 classes from interval and interaction rules on a few features, plus 5% label noise.
+    y = (X[:, 0] > 0.5).astype(int) + ((X[:, 1] > -0.5) & (X[:, 2] < 1.0))
+    noise = np.random.uniform(size=y.shape[0]) < 0.05
+    y[noise] = np.random.randint(0, 3, size=np.sum(noise))
+    synthetic = (X[:num_train], y[:num_train], X[num_train:], y[num_train:])
+
+    blank = "----------------------"
+    for name, (X_train, y_train, X_test, y_test), names in [("titanic", titanic, column_name),
+                                                            ("synthetic", synthetic, list(range(dim)))]:
+        print(blank + "%s: N = %d" % (name, X_train.shape[0]) + blank)
+        for binning in DecisionTree._binnings:
+            dt = DecisionTree(max_depth=5, binning=binning)
+            start = time.perf_counter()
+            dt.train(X_train.copy(), y_train, names)
+            train_time = time.perf_counter() - start
+            predicts = dt.predict_batch(X_test)
+            print("%-5s train: %.3fs | accuracy: %.4f" % (binning, train_time, np.mean(predicts == y_test)))
+    codes = DecisionTree(binning='hist')._encode(synthetic[0])
+    print("synthetic features: float64 %.1f MB | uint8 codes %.1f MB"
+          % (synthetic[0].nbytes / 2**20, codes.nbytes / 2**20))
+
+    # numerical features split again in hist mode: 2 features, yet the tree grows to max_depth.
+    X = np.random.uniform(size=(2000, 2))
+    y = (np.sin(8*X[:, 0]) + np.cos(7*X[:, 1]) > 0).astype(int)
+    dt = DecisionTree(max_depth=6, binning='hist')
+    dt.train(X, y, ['a', 'b'])
+    print("====> hist tree deeper than the number of features: %s" % ("PASS" if dt.depth == 6 else "FAIL"))
+
+
+def benchmark_memory(num_train=200000, dim=10):
+    """
+    Peak training memory and pickled model size, against the size of the training data.
+    """
+    import pickle
+    import tracemalloc
+
+    X = np.random.normal(size=(num_train, dim))
+    y = (X[:, 0] > 0.5).astype(int) + ((X[:, 1] > -0.5) & (X[:, 2] < 1.0))
+    print("training data: %.1f MB" % (X.nbytes / 2**20))
+    for binning in DecisionTree._binnings:
+        dt = DecisionTree(max_depth=8, binning=binning)
+        X_train = X.copy()
+        tracemalloc.start()
+        dt.train(X_train, y, list(range(dim)))
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        print("%-5s peak training memory: %.1f MB | pickled model: %.1f KB"
+              % (binning, peak / 2**20, len(pickle.dumps(dt)) / 2**10))
+
+
+def benchmark_predict(num_train=200000, num_test=1000000, num_rows=20000, dim=10):
+    """
+    Throughput of predict_batch against the former row by row recursive walk of the node objects, scoring 1M rows.
+    The row by row walk is timed on the first `num_rows` rows.
+    """
+    import time
+
+    def walk(dt, x):
+        x = x.astype(object)
+        for key, thresholds in dt.thresholds.items():
+            x[key] = int(np.searchsorted(thresholds, float(x[key]), side='right'))
+        node = dt.tree
+        while not node.is_leaf:
+            value = x[node.feature_split]
+            if node.threshold is not None:
+                value = int(not float(value) < node.threshold)
+            node = getattr(node, 'feature_' + str(value))
+        return node.label
+
+    X = np.random.normal(size=(num_train + num_test, dim))
+    y = (X[:, 0] > 0.5).astype(int) + ((X[:, 1] > -0.5) & (X[:, 2] < 1.0))
+    X_train, y_train, X_test = X[:num_train], y[:num_train], X[num_train:]
+    for binning in DecisionTree._binnings:
+        dt = DecisionTree(max_depth=8, binning=binning)
+        dt.train(X_train, y_train, list(range(dim)))
+        start = time.perf_counter()
+        expected = np.array([walk(dt, x) for x in X_test[:num_rows]])
+        loop_speed = num_rows / (time.perf_counter() - start)
+        X_copy = X_test.copy()
+        start = time.perf_counter()
+        predicts = dt.predict_batch(X_test)
+        batch_speed = num_test / (time.perf_counter() - start)
+        print("%-5s %d nodes | row by row: %.0f rows/s | predict_batch: %.0f rows/s | x%.0f"
+              % (binning, len(dt.node_label), loop_speed, batch_speed, batch_speed / loop_speed))
+        out = "PASS" if np.array_equal(predicts[:num_rows], expected) and np.array_equal(X_copy, X_test) else "FAIL"
+        print("====> same predictions, input unchanged: " + out)
+        # nan sorts after every threshold and bin edge in `_encode`: it must route like +inf.
+        X_nan = X_test[:num_rows].copy()
+        X_nan[np.random.rand(*X_nan.shape) < 0.2] = np.nan
+        X_inf = np.where(np.isnan(X_nan), np.inf, X_nan)
+        same = np.array_equal(dt.predict_batch(X_nan), dt.predict_batch(X_inf)) and \
+            np.array_equal(dt.predict_batch(X_nan), [walk(dt, x) for x in X_nan])
+        print("====> nan routed like the training encoding: " + ("PASS" if same else "FAIL"))
+
 
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description="A decision tree program.")
+    parser.add_argument("--benchmark_split", action="store_true", help="Benchmark the presorted threshold search.")
+    parser.add_argument("--benchmark_hist", action="store_true", help="Benchmark the hist mode against the exact mode.")
+    parser.add_argument("--benchmark_gain", action="store_true", help="Benchmark the vectorized information gain.")
+    parser.add_argument("--benchmark_memory", action="store_true", help="Peak training memory and model size.")
+    parser.add_argument("--benchmark_predict", action="store_true", help="Benchmark predict_batch on 1M rows.")
+    args = parser.parse_args()
+    if args.benchmark_predict:
+        benchmark_predict()
+    elif args.benchmark_memory:
+        benchmark_memory()
+    elif args.benchmark_split:
+        benchmark_split()
+    elif args.benchmark_gain:
+        benchmark_gain()
+    elif args.benchmark_hist:
+        benchmark_hist()
+    else:
+        main()
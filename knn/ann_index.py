@@ -0,0 +1,205 @@
+"""
+Locality-sensitive hashing index for approximate k-nearest neighbours queries.
+"""
+
+import numpy as np
+from scipy.spatial.distance import cdist
+
+
+class LSHIndex:
+    """
+    Each of the `num_tables` hash tables hashes a point with `num_bits` random projections:
+        - cosine: the signs of the projections of the normalized points (random hyperplanes through the mean of the
+            normalized training points, so the buckets split the data even when all points lie in a narrow cone).
+        - euclidean: the projections quantized in buckets of width `bucket_width` (p-stable LSH).
+    Close points are likely to share a bucket in at least one table. A query gathers the training points of its
+    buckets (plus `probes` neighbouring buckets per table, obtained by changing its least confident hash value)
+    and ranks these candidates by exact distance.
+
+    Tables are stored as sorted key arrays, so the index is a handful of numpy arrays: see `save` and `load`.
+
+    Knobs: more tables and more probes increase recall and latency. More bits make buckets smaller: lower latency,
+    lower recall.
+    """
+
+    _metrics = ('euclidean', 'cosine')
+
+    def __init__(self, X, metric='euclidean', num_tables=8, num_bits=12, bucket_width=None, probes=0, seed=None,
+                 build=True):
+        """
+        Parameters
+        ----------
+        X: training points. shape = (N, D)
+        metric: (string) either `euclidean` or `cosine`.
+        num_tables: (integer) number of hash tables.
+        num_bits: (integer) number of hash functions per table.
+        bucket_width: (float) euclidean bucket width. By default 4 times the median nearest neighbour distance
+            of a sample of X.
+        probes: (integer) number of extra buckets visited per table at query time.
+        seed: (integer) seed of the random projections.
+        build: (boolean) hash X. `load` builds the index from saved arrays instead.
+        """
+        assert metric in self._metrics, "LSH supports the metrics: %s" % list(self._metrics)
+        self.X = X
+        self.metric = metric
+        self.num_tables = num_tables
+        self.num_bits = num_bits
+        self.probes = probes
+        # norms of the training points, for the cosine distances of the candidates.
+        self.norms = np.linalg.norm(X, axis=1) if metric == 'cosine' else None
+        if not build:
+            return
+        random = np.random.RandomState(seed)
+        self.projections = random.normal(size=(num_tables, X.shape[1], num_bits))
+        if metric == 'euclidean':
+            self.bucket_width = bucket_width or self._default_bucket_width(random)
+            self.offsets = random.uniform(0, self.bucket_width, size=(num_tables, num_bits))
+            # a linear hash of the bucket coordinates, so a neighbour bucket's key is key +/- one multiplier.
+            self.multipliers = random.randint(1, 2**31, size=num_bits).astype(np.int64)
+        else:
+            self.bucket_width = None
+            center = np.mean(self._normalize(X), axis=0)
+            self.offsets = -np.matmul(center, self.projections)
+            self.multipliers = 2**np.arange(num_bits, dtype=np.int64)
+        keys, _, _ = self._hash(X)
+        self.order = np.argsort(keys, axis=1, kind='stable')
+        self.keys = np.take_along_axis(keys, self.order, axis=1)
+
+    def _default_bucket_width(self, random):
+        sample = self.X[random.choice(self.X.shape[0], size=min(256, self.X.shape[0]), replace=False)]
+        dist = cdist(sample, sample)
+        np.fill_diagonal(dist, np.inf)
+        return 4*np.median(np.min(dist, axis=1))
+
+    def _normalize(self, X):
+        norms = np.linalg.norm(X, axis=1, keepdims=True)
+        return X / np.where(norms > 0, norms, 1)
+
+    def _hash(self, X):
+        """
+        Returns
+        -------
+        keys: bucket keys of X in each table. shape = (num_tables, N)
+        codes: hash values. shape = (num_tables, N, num_bits)
+        confidence: distance of the projections to the bucket boundaries. shape = (num_tables, N, num_bits)
+        """
+        if self.metric == 'cosine':
+            projected = np.matmul(self._normalize(X), self.projections) + self.offsets[:, None, :]
+            codes = (projected > 0).astype(np.int64)
+            confidence = np.abs(projected)
+        else:
+            projected = np.matmul(X, self.projections)
+            position = (projected + self.offsets[:, None, :])/self.bucket_width
+            codes = np.floor(position).astype(np.int64)
+            fraction = position - codes
+            # signed: negative means the lower boundary is the closer one.
+            confidence = np.where(fraction < 0.5, -fraction, 1 - fraction)
+        keys = np.einsum("tnb,b->tn", codes, self.multipliers)
+        return keys, codes, confidence
+
+    def _probe_keys(self, X_query):
+        """
+        Keys of the buckets visited for each query: its own bucket then the `probes` buckets obtained by changing
+        its least confident hash values. shape = (num_tables, N_query, 1 + probes)
+        """
+        keys, codes, confidence = self._hash(X_query)
+        probes = min(self.probes, self.num_bits)
+        if probes == 0:
+            return keys[:, :, None]
+        least_confident = np.argsort(np.abs(confidence), axis=2)[:, :, :probes]
+        if self.metric == 'cosine':
+            # flip the bit: +2^b if it was 0, -2^b if it was 1.
+            bits = np.take_along_axis(codes, least_confident, axis=2)
+            delta = (1 - 2*bits)*self.multipliers[least_confident]
+        else:
+            # step to the bucket on the side of the closer boundary.
+            direction = np.where(np.take_along_axis(confidence, least_confident, axis=2) < 0, -1, 1)
+            delta = direction*self.multipliers[least_confident]
+        return np.concatenate([keys[:, :, None], keys[:, :, None] + delta], axis=2)
+
+    def _pair_distances(self, X_query, queries, candidates, chunk_bytes=2**20):
+        """
+        Exact distances of the (query, candidate) pairs, the same as cdist, by chunks of pairs whose gathered points
+        take about `chunk_bytes`, small enough to stay in cache.
+        :return: shape = queries.shape
+        """
+        dist = np.empty(shape=queries.shape)
+        chunk = max(1, chunk_bytes // (16*max(self.X.shape[1], 1)))
+        if self.metric == 'cosine':
+            query_norms = np.linalg.norm(X_query, axis=1)
+        for start in range(0, queries.shape[0], chunk):
+            pair_queries, pair_candidates = queries[start:start+chunk], candidates[start:start+chunk]
+            A = X_query[pair_queries].astype(np.float64, copy=False)
+            B = self.X[pair_candidates]
+            if self.metric == 'euclidean':
+                A -= B
+                dist[start:start+chunk] = np.sqrt(np.einsum("ij,ij->i", A, A))
+            else:
+                # a point of norm 0 has a nan cosine distance, as in cdist.
+                with np.errstate(invalid='ignore', divide='ignore'):
+                    dist[start:start+chunk] = 1 - np.einsum("ij,ij->i", A, B)/(query_norms[pair_queries]*
+                                                                                self.norms[pair_candidates])
+        return dist
+
+    def query(self, X_query, K):
+        """
+        Approximate K nearest neighbours of every query point.
+
+        Returns
+        -------
+        distances: shape = (N_query, K), sorted ascending, inf where less than K candidates were found.
+        indices: indices into X of the neighbours, shape = (N_query, K), -1 where less than K candidates were found.
+        """
+        num_query = X_query.shape[0]
+        keys = self._probe_keys(X_query)
+        num_probes = keys.shape[2]
+        # [low, high) range of each probed bucket in the sorted keys of its table.
+        tables = np.repeat(np.arange(self.num_tables), num_query*num_probes)
+        keys = keys.reshape(self.num_tables, -1)
+        low = np.concatenate([np.searchsorted(self.keys[t], keys[t], side='left') for t in range(self.num_tables)])
+        high = np.concatenate([np.searchsorted(self.keys[t], keys[t], side='right') for t in range(self.num_tables)])
+        counts = high - low
+        # flatten the buckets into (query, candidate) pairs.
+        queries = np.repeat(np.tile(np.repeat(np.arange(num_query), num_probes), self.num_tables), counts)
+        starts = np.repeat(np.cumsum(counts) - counts, counts)
+        positions = np.repeat(low, counts) + np.arange(np.sum(counts)) - starts
+        candidates = self.order[np.repeat(tables, counts), positions]
+        pairs = np.unique(queries*self.X.shape[0] + candidates)
+        queries, candidates = pairs // self.X.shape[0], pairs % self.X.shape[0]
+
+        dist = self._pair_distances(X_query, queries, candidates)
+        # rank the candidates of each query by distance (then index), keep the first K.
+        rank = np.lexsort((candidates, dist, queries))
+        queries, candidates, dist = queries[rank], candidates[rank], dist[rank]
+        group_start = np.searchsorted(queries, queries, side='left')
+        position = np.arange(queries.shape[0]) - group_start
+        keep = position < K
+        distances = np.full((num_query, K), np.inf)
+        indices = np.full((num_query, K), -1)
+        distances[queries[keep], position[keep]] = dist[keep]
+        indices[queries[keep], position[keep]] = candidates[keep]
+        return distances, indices
+
+    def save(self, path):
+        """
+        Save the index (without the training points) to a .npz file.
+        """
+        np.savez(path, metric=self.metric, num_tables=self.num_tables, num_bits=self.num_bits, probes=self.probes,
+                 bucket_width=np.nan if self.bucket_width is None else self.bucket_width,
+                 projections=self.projections, offsets=self.offsets, multipliers=self.multipliers,
+                 order=self.order, keys=self.keys)
+
+    @classmethod
+    def load(cls, path, X):
+        """
+        Load an index saved by `save`, over the same training points X.
+        """
+        saved = np.load(path)
+        index = cls(X, metric=str(saved["metric"]), num_tables=int(saved["num_tables"]),
+                    num_bits=int(saved["num_bits"]), probes=int(saved["probes"]), build=False)
+        bucket_width = float(saved["bucket_width"])
+        index.bucket_width = None if np.isnan(bucket_width) else bucket_width
+        for name in ["projections", "offsets", "multipliers", "order", "keys"]:
+            setattr(index, name, saved[name])
+        assert index.order.shape[1] == X.shape[0], "The index was built over another training set."
+        return index
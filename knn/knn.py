@@ -5,8 +5,9 @@ Author: Giang Tran.
 import numpy as np
 import pandas as pd
 from scipy.spatial.distance import cdist
-from scipy.stats import itemfreq
 from sklearn.neighbors import KNeighborsClassifier
+from tree_index import KDTree, BallTree, _cdist_metrics
+from ann_index import LSHIndex
 
 
 class KNN:
@@ -27,82 +28,313 @@ class KNN:
 
     """
     _metrics = {'euclidean': '_l2_distance', 'manhattan': '_l1_distance', 'cosine': '_cosine_similarity'}
+    # metrics with a GEMM form: a score that ranks the training points like the distance, from one matrix product.
+    _gemm_scores = {'euclidean': '_l2_score', 'cosine': '_cosine_score'}
+    _weights = {'uniform': '_uniform_weights', 'distance': '_distance_weights'}
+    _indexes = {'kd_tree': KDTree, 'ball_tree': BallTree}
+    # index='tree' uses a KD-tree up to this dimension, a ball tree above.
+    _kd_tree_max_dim = 16
 
-    def __init__(self, K, X, y, metric='euclidean'):
+    def __init__(self, K, X, y, metric='euclidean', index='brute', leaf_size=64, memory_budget=2**26,
+                 weights='uniform'):
+        """
+        Parameters
+        ----------
+        K: (integer) number of nearest neighbours that vote.
+        X: training points. shape = (N, D)
+        y: training labels. shape = (N,)
+        metric: (string) either `euclidean`, `manhattan` or `cosine`.
+        index: (string) `brute` compares each query to all training points. `kd_tree`, `ball_tree` or `tree`
+            (KD-tree in low dimension, ball tree otherwise) build a tree once here and answer exact queries by pruning.
+            `lsh` builds an approximate `LSHIndex` with default knobs, or pass an `LSHIndex` (e.g. from
+            `LSHIndex.load`) to choose them. Queries with less than K approximate candidates are answered exactly.
+        leaf_size: (integer) maximum number of training points in a leaf of the tree indexes.
+        memory_budget: (integer) bytes of the distance tiles of the brute-force path, which processes the test points
+            by blocks of rows so its peak memory doesn't grow with the test set size.
+        weights: (string) `uniform`: each neighbour has one vote, `distance`: votes weighted by inverse distance.
+        """
         self.K = K
         assert type(X) is np.ndarray, "X must be a numpy array"
         assert type(y) is np.ndarray, "y must be a numpy array"
         self.X = X
         self.y = y
-        self.classes = np.unique(y)
+        self.classes, self.class_indices = np.unique(y, return_inverse=True)
+        assert weights in self._weights, "Unknown weights: " + str(weights)
+        self.weights = weights
         self.metric = metric
+        if index == 'tree':
+            index = 'kd_tree' if X.shape[1] <= self._kd_tree_max_dim else 'ball_tree'
+        self.ann = None
+        if index == 'lsh':
+            index = LSHIndex(X, metric=metric)
+        if isinstance(index, LSHIndex):
+            assert index.metric == metric and index.X.shape == X.shape, "The LSH index doesn't match X and metric."
+            self.ann = index
+            index = 'lsh'
+        assert index in ['brute', 'lsh'] or index in self._indexes, "Unknown index: " + str(index)
+        self.index = index
+        self.memory_budget = memory_budget
+        self.tree = None
+        # training points and norms of the GEMM scores.
+        self.X_float = X.astype(np.float64, copy=False)
+        self.norms = np.linalg.norm(self.X_float, axis=1)
+        if index in self._indexes:
+            # cosine distance ranks like the euclidean distance between the normalized vectors. Points of norm 0
+            # (nan cosine) stay out of the tree and rank last, as in the brute-force path.
+            self.tree_rows = np.flatnonzero(self.norms > 0) if metric == 'cosine' else np.arange(X.shape[0])
+            X_tree = self._normalize(X[self.tree_rows]) if metric == 'cosine' else X
+            if X_tree.shape[0] > 0:
+                self.tree = self._indexes[index](X_tree, 'euclidean' if metric == 'cosine' else metric, leaf_size)
+
+    def _normalize(self, X):
+        norms = np.linalg.norm(X, axis=1, keepdims=True)
+        return X / np.where(norms > 0, norms, 1)
 
-    def _l1_distance(self, X_new):
+    def _l1_distance(self, X_new, indices=None):
         """
         l1 = abs(x_1 - x_2) + abs(y_1 - y_2)
         :param X_new:
+        :param indices: training points to compare to, all by default.
         :return: ndarray manhattan distance of X_new versus all other points X.
         """
-        return cdist(X_new, self.X, 'cityblock')
+        return cdist(X_new, self.X if indices is None else self.X[indices], 'cityblock')
 
-    def _l2_distance(self, X_new):
+    def _l2_distance(self, X_new, indices=None):
         """
         l2 = sqrt((x_1 - x_2)**2 + (y_1 - y_2)**2)
         :param X_new:
+        :param indices: training points to compare to, all by default.
         :return: ndarray euclidean distance of X_new versus all other points X.
         """
-        return cdist(X_new, self.X, 'euclidean')
+        return cdist(X_new, self.X if indices is None else self.X[indices], 'euclidean')
 
-    def _cosine_similarity(self, X_new):
+    def _cosine_similarity(self, X_new, indices=None):
         """
         similarity = cos(alpha) = dot(A, B) / (len(A)*len(B))
         :param X_new:
+        :param indices: training points to compare to, all by default.
         :return: ndarray cosine similarity of X_new versus all other points X.
         """
-        return cdist(X_new, self.X, 'cosine')
+        return cdist(X_new, self.X if indices is None else self.X[indices], 'cosine')
 
-    def predict(self, X_new):
+    def _l2_score(self, X_new):
+        """
+        ||x||^2 - 2x.y + ||y||^2 without ||x||^2, constant along a row.
+        :return: scores and the bound of their rounding error, per row.
+        """
+        # in place: the GEMM product is the only (N_new, N) array.
+        score = X_new.dot(self.X_float.T)
+        score *= -2
+        score += self.norms**2
+        eps = 4*X_new.shape[1]*np.finfo(np.float64).eps
+        tol = eps*(np.linalg.norm(X_new, axis=1) + np.max(self.norms, initial=0))**2
+        return score, tol
+
+    def _cosine_score(self, X_new):
+        """
+        -x.y / ||y|| without 1/||x||, constant along a row. Points of norm 0 (nan cosine) rank last.
+        :return: scores and the bound of their rounding error, per row.
+        """
+        inverse_norms = np.divide(1, self.norms, out=np.zeros_like(self.norms), where=self.norms > 0)
+        score = X_new.dot(self.X_float.T)
+        score *= -inverse_norms
+        new_norms = np.linalg.norm(X_new, axis=1)
+        # a query of norm 0 has a nan cosine to every point: they all tie, rank them by index instead of making
+        # every training point a candidate.
+        score[new_norms == 0] = np.arange(self.X.shape[0])
+        score[:, self.norms == 0] = np.inf
+        tol = 4*X_new.shape[1]*np.finfo(np.float64).eps*new_norms
+        return score, tol
+
+    def _k_nearest_tile(self, X_new, K):
+        """
+        Exact K nearest neighbours (distances, indices) of a block of test points, in the order of a stable argsort
+        of the distances
+        (ties broken by training index).
+        The K best candidates come from np.argpartition on the GEMM scores, widened by their rounding error so no
+        tie can be missed, then the exact distances of the candidates decide the final order.
+        """
+        distance = getattr(self, self._metrics[self.metric])
+        gemm = self.metric in self._gemm_scores
+        if gemm:
+            score, tol = getattr(self, self._gemm_scores[self.metric])(X_new.astype(np.float64, copy=False))
+        else:
+            score, tol = distance(X_new), np.zeros(X_new.shape[0])
+        # copies of the first columns, so the full partitioned arrays are freed right away.
+        kth = np.partition(score, K-1, axis=1)[:, K-1].copy()
+        num_candidates = np.max(np.sum(score <= (kth + 2*tol)[:, None], axis=1))
+        candidates = np.argpartition(score, num_candidates-1, axis=1)[:, :num_candidates].copy()
+        if gemm:
+            del score
+            # exact distances of the candidates, with the same function as the full matrix.
+            unique, position = np.unique(candidates, return_inverse=True)
+            dist = np.take_along_axis(distance(X_new, unique), position.reshape(candidates.shape), axis=1)
+        else:
+            dist = np.take_along_axis(score, candidates, axis=1)
+        rank = np.lexsort((candidates, dist), axis=1)[:, :K]
+        return np.take_along_axis(dist, rank, axis=1), np.take_along_axis(candidates, rank, axis=1)
+
+    def _k_nearest_brute(self, X_new):
+        """
+        Brute-force K nearest neighbours, by blocks of test points sized to `memory_budget`.
+        """
+        K = min(self.K, self.X.shape[0])
+        # bytes per test point and training point of a block: the float64 scores, at most one other float64/int64
+        # array of the same shape alive with them (partition copy, argpartition indices, distances of the
+        # candidates), and the bool mask of the candidate count.
+        rows = max(1, int(self.memory_budget // (self.X.shape[0]*(8 + 8 + 1))))
+        distances = np.empty(shape=(X_new.shape[0], K))
+        k_nearest = np.empty(shape=(X_new.shape[0], K), dtype=np.int64)
+        for start in range(0, X_new.shape[0], rows):
+            distances[start:start+rows], k_nearest[start:start+rows] = self._k_nearest_tile(X_new[start:start+rows], K)
+        return distances, k_nearest
+
+    def _k_nearest(self, X_new):
+        """
+        Distances and indices of the K nearest training points of each row of X_new. shape = (N_new, K)
+        """
+        if self.tree is not None:
+            if self.metric != 'cosine':
+                return self.tree.query(X_new, self.K)
+            K = min(self.K, self.X.shape[0])
+            distances = np.full((X_new.shape[0], K), np.nan)
+            k_nearest = np.empty((X_new.shape[0], K), dtype=np.int64)
+            num_tree = min(K, self.tree_rows.shape[0])
+            # a query of norm 0 has a nan cosine to every point: they all tie and come by index.
+            zero = np.linalg.norm(X_new, axis=1) == 0
+            k_nearest[zero, :num_tree] = self.tree_rows[:num_tree]
+            if num_tree > 0 and not np.all(zero):
+                tree_distances, tree_nearest = self.tree.query(self._normalize(X_new[~zero]), num_tree)
+                # 1 - cos(a, b) = ||a - b||^2 / 2 for unit vectors.
+                distances[~zero, :num_tree] = tree_distances**2/2
+                k_nearest[~zero, :num_tree] = self.tree_rows[tree_nearest]
+            # then the points of norm 0, by index.
+            k_nearest[:, num_tree:] = np.flatnonzero(self.norms == 0)[:K - num_tree]
+            return distances, k_nearest
+        if self.ann is not None:
+            distances, k_nearest = self.ann.query(X_new, min(self.K, self.X.shape[0]))
+            missing = np.any(k_nearest < 0, axis=1)
+            if np.any(missing):
+                distances[missing], k_nearest[missing] = self._k_nearest_brute(X_new[missing])
+            return distances, k_nearest
+        return self._k_nearest_brute(X_new)
+
+    def _uniform_weights(self, distances):
+        return np.ones(shape=distances.shape)
+
+    def _distance_weights(self, distances):
+        """
+        Inverse distance weights. Training points at distance 0 of a test point get all its votes. Points at a nan
+        (cosine) distance, of norm 0, don't vote, unless none of the neighbours of a test point has a distance: they
+        then have one vote each.
+        """
+        with np.errstate(divide='ignore'):
+            weights = 1/distances
+        exact = np.isinf(weights)
+        rows = np.any(exact, axis=1)
+        weights[rows] = exact[rows]
+        undefined = np.isnan(weights)
+        weights[undefined] = 0
+        weights[np.all(undefined, axis=1)] = 1
+        return weights
+
+    def _votes(self, X_new):
+        """
+        Weighted votes of the K nearest neighbours for each class of self.classes. shape = (N_new, num_classes)
+        """
         assert type(X_new) is np.ndarray, "Use numpy array instead."
         assert X_new.shape[1] == self.X.shape[1], "Mismatch shape."
         if self.metric not in self._metrics.keys():
             self.metric = 'euclidean'
-        func = getattr(self, self._metrics[self.metric])
-        dist = func(X_new)
-        dist = np.argsort(dist, axis=1)
-        k_nearest = dist[:, :self.K]
-        labels = self.y[k_nearest]
-        res = []
-        for label in labels:
-            label, count = np.unique(label, return_counts=True)
-            res.append(label[np.argmax(count)])
-        return np.array(res)
+        return self._vote(*self._k_nearest(X_new))
+
+    def _vote(self, distances, k_nearest):
+        """
+        Weighted votes of given neighbours (sorted ascending, shape = (N_new, k) for any k) for each class.
+        """
+        weights = getattr(self, self._weights[self.weights])(distances)
+        num_classes = self.classes.shape[0]
+        num_rows = k_nearest.shape[0]
+        # one bincount over (row, class) pairs counts the votes of all rows at once.
+        bins = np.arange(num_rows)[:, None]*num_classes + self.class_indices[k_nearest]
+        votes = np.bincount(bins.ravel(), weights=weights.ravel(), minlength=num_rows*num_classes)
+        return votes.reshape((num_rows, num_classes))
+
+    def predict(self, X_new):
+        # ties go to the smallest class.
+        return self.classes[np.argmax(self._votes(X_new), axis=1)]
+
+    def predict_proba(self, X_new):
+        """
+        Class scores of each row of X_new, columns ordered as self.classes. shape = (N_new, num_classes)
+        """
+        votes = self._votes(X_new)
+        return votes / np.sum(votes, axis=1, keepdims=True)
+
+
+def _sweep_metric(args):
+    """
+    Accuracy of every K of `ks` for one metric, from a single ranking of the max(ks) nearest neighbours:
+    the k nearest neighbours are the first k columns of the ranking (ties are broken by training index).
+    """
+    X, y, X_test, y_test, ks, metric, kwargs = args
+    knn = KNN(max(ks), X, y, metric=metric, **kwargs)
+    distances, k_nearest = knn._k_nearest(X_test)
+    accuracies = []
+    for k in ks:
+        y_pred = knn.classes[np.argmax(knn._vote(distances[:, :k], k_nearest[:, :k]), axis=1)]
+        accuracies.append(np.mean(y_pred == y_test))
+    return accuracies
+
+
+def sweep(X, y, X_test, y_test, ks, metrics, workers=None, **kwargs):
+    """
+    Test accuracy of KNN for every (K, metric) pair, with one nearest neighbours search per metric.
+
+    Parameters
+    ----------
+    X, y: training points and labels.
+    X_test, y_test: test points and labels.
+    ks: (list) values of K.
+    metrics: (list) metric names.
+    workers: (integer) number of processes the metrics are spread over. By default one per metric,
+        1 runs them in this process.
+    kwargs: other KNN parameters (index, weights, memory_budget...).
+
+    Returns
+    -------
+    Accuracy table, pandas DataFrame indexed by K with one column per metric.
+    """
+    import multiprocessing as mp
+
+    tasks = [(X, y, X_test, y_test, list(ks), metric, kwargs) for metric in metrics]
+    workers = min(workers or len(metrics), len(metrics))
+    if workers == 1:
+        results = list(map(_sweep_metric, tasks))
+    else:
+        context = mp.get_context("fork" if "fork" in mp.get_all_start_methods() else "spawn")
+        with context.Pool(workers) as pool:
+            results = pool.map(_sweep_metric, tasks)
+    return pd.DataFrame(np.array(results).T, index=pd.Index(list(ks), name="K"), columns=list(metrics))
 
 
 def experiment(X, y, X_test, y_test):
     print("--- Experiment ---")
     ks = [1, 3, 5, 7, 9, 11]
     metrics = ['manhattan', 'euclidean', 'cosine']
-    for metric in metrics:
-        for k in ks:
-            knn = KNN(k, X, y, metric=metric)
-
-            y_pred = knn.predict(X_test)
-
-            print("KNN with K = %d and metric = %s | Accuracy: %f" % (k, metric, len(y_test[y_pred == y_test]) / len(y_test)))
-
-        print("-"*50)
+    print(sweep(X, y, X_test, y_test, ks, metrics))
 
 def main():
     df = pd.read_csv("./data/train.csv")
     X = df.loc[:, :].values
-    y = pd.read_csv("./data/trainDirection.csv").iloc[:, 0].values
+    y = pd.read_csv("./data/trainDirection.csv").iloc[:, 0].to_numpy()
 
     print("X shape:", X.shape)
     print("y shape:", y.shape)
 
     df_test = pd.read_csv("./data/testing.csv")
     X_test = df_test.drop('Direction', axis=1).iloc[:, 1:].values
-    y_test = df_test.loc[:, 'Direction'].values
+    y_test = df_test.loc[:, 'Direction'].to_numpy()
 
     print("X test shape:", X_test.shape)
     print("y test shape:", y_test.shape)
@@ -130,5 +362,208 @@ def main():
     print("Sk-learn KNN accuracy:", len(y_test[y_sk == y_test]) / len(y_test))
 
 
+def benchmark(num_train=50000, num_test=500, K=5):
+    """
+    Index build and query times of the tree indexes against the brute-force path, on random clustered data.
+    """
+    import time
+
+    blank = "----------------------"
+    for dim in [3, 8, 32]:
+        centers = np.random.normal(scale=5, size=(20, dim))
+        X = centers[np.random.randint(0, 20, size=num_train)] + np.random.normal(size=(num_train, dim))
+        X_test = centers[np.random.randint(0, 20, size=num_test)] + np.random.normal(size=(num_test, dim))
+        y = np.random.randint(0, 3, size=num_train)
+        for metric in ['euclidean', 'manhattan']:
+            print(blank + "D = %d, metric = %s" % (dim, metric) + blank)
+            neighbours = {}
+            for index in ['brute', 'kd_tree', 'ball_tree']:
+                start = time.perf_counter()
+                knn = KNN(K, X, y, metric=metric, index=index)
+                build_time = time.perf_counter() - start
+                start = time.perf_counter()
+                neighbours[index] = knn._k_nearest(X_test)[1]
+                query_time = time.perf_counter() - start
+                print("%-10s build: %.3fs | query: %.3fs" % (index, build_time, query_time))
+            dist = cdist(X_test, X, _cdist_metrics[metric])
+            for index in ['kd_tree', 'ball_tree']:
+                result = np.allclose(np.take_along_axis(dist, neighbours['brute'], axis=1),
+                                     np.take_along_axis(dist, neighbours[index], axis=1))
+                print("====> %s neighbours match brute force: %s" % (index, "PASS" if result else "FAIL"))
+
+    # cosine with points of norm 0 in the training and test points: they rank like in the brute-force path.
+    X = np.random.normal(size=(3000, 8))
+    X_test = np.random.normal(size=(200, 8))
+    X[np.random.choice(3000, size=5, replace=False)] = 0
+    X_test[:3] = 0
+    y = np.random.randint(0, 3, size=3000)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        neighbours = KNN(K, X, y, metric='cosine')._k_nearest(X_test)[1]
+        for index in ['kd_tree', 'ball_tree']:
+            result = np.array_equal(neighbours, KNN(K, X, y, metric='cosine', index=index)._k_nearest(X_test)[1])
+            print("====> %s cosine neighbours with zero vectors match brute force: %s"
+                  % (index, "PASS" if result else "FAIL"))
+
+
+def benchmark_brute(num_train=20000, dim=32, K=5):
+    """
+    Time and peak memory of the blocked brute-force path against the full distance matrix + argsort,
+    for growing test sets. The peak of the blocked path must stay within `memory_budget`.
+    """
+    import time
+    import tracemalloc
+
+    X = np.random.normal(size=(num_train, dim))
+    y = np.random.randint(0, 3, size=num_train)
+    for metric, cdist_metric in [('euclidean', 'euclidean'), ('manhattan', 'cityblock'), ('cosine', 'cosine')]:
+        knn = KNN(K, X, y, metric=metric)
+        for num_test in [500, 1000, 2000]:
+            X_test = np.random.normal(size=(num_test, dim))
+            results, peaks = [], []
+            for name, func in [("full argsort", lambda: np.argsort(cdist(X_test, X, cdist_metric), axis=1,
+                                                                   kind='stable')[:, :K]),
+                               ("blocked", lambda: knn._k_nearest(X_test)[1])]:
+                tracemalloc.start()
+                start = time.perf_counter()
+                results.append(func())
+                elapsed = time.perf_counter() - start
+                peak = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+                peaks.append(peak)
+                print("%-10s N_test = %5d %-13s %.3fs | peak %.1f MB" % (metric, num_test, name, elapsed, peak/2**20))
+            out = "PASS" if np.array_equal(results[0], results[1]) else "FAIL"
+            print("====> identical neighbours: " + out)
+            out = "PASS" if peaks[1] <= knn.memory_budget else "FAIL"
+            print("====> blocked peak within memory_budget: " + out)
+
+
+def benchmark_vote(num_test=100000, num_train=5000, K=11):
+    """
+    Time of the vectorized vote against the per-row np.unique loop, on random neighbours of 100k test points.
+    """
+    import time
+
+    X = np.random.normal(size=(num_train, 2))
+    y = np.random.choice(np.array([-1, 3, 7]), size=num_train)
+    knn = KNN(K, X, y)
+    k_nearest = np.random.randint(0, num_train, size=(num_test, K))
+    distances = np.random.uniform(size=(num_test, K))
+    knn._k_nearest = lambda X_new: (distances, k_nearest)
+    X_test = np.zeros(shape=(num_test, 2))
+
+    start = time.perf_counter()
+    res = []
+    for label in y[k_nearest]:
+        label, count = np.unique(label, return_counts=True)
+        res.append(label[np.argmax(count)])
+    loop_time = time.perf_counter() - start
+    start = time.perf_counter()
+    pred = knn.predict(X_test)
+    vectorized_time = time.perf_counter() - start
+    print("np.unique loop: %.3fs | vectorized: %.3fs" % (loop_time, vectorized_time))
+    out = "PASS" if np.array_equal(np.array(res), pred) else "FAIL"
+    print("====> identical predictions: " + out)
+    proba = knn.predict_proba(X_test)
+    out = "PASS" if np.allclose(np.sum(proba, axis=1), 1) and np.array_equal(knn.classes[np.argmax(proba, axis=1)], pred) else "FAIL"
+    print("====> predict_proba consistent with predict: " + out)
+    # a test point of norm 0 has a nan cosine distance to all the training points: its neighbours have one vote each.
+    X_zero = np.vstack([np.zeros(shape=(1, 2)), X[:10]])
+    proba = KNN(K, X, y, metric='cosine', weights='distance').predict_proba(X_zero)
+    uniform = KNN(K, X, y, metric='cosine').predict_proba(X_zero[:1])
+    out = "PASS" if np.all(np.isfinite(proba)) and np.allclose(proba[0], uniform[0]) else "FAIL"
+    print("====> distance weighted cosine votes of a zero test point: " + out)
+
+
+def benchmark_ann(num_train=20000, num_test=500, dim=784, K=10):
+    """
+    Recall@K and query time of the LSH index for several operating points, against the exact brute-force path,
+    on random clustered 784-D data (flattened MNIST size).
+    """
+    import tempfile
+    import time
+
+    centers = np.random.uniform(0, 3, size=(50, dim))
+    X = centers[np.random.randint(0, 50, size=num_train)] + np.random.normal(scale=0.3, size=(num_train, dim))
+    X_test = centers[np.random.randint(0, 50, size=num_test)] + np.random.normal(scale=0.3, size=(num_test, dim))
+    y = np.random.randint(0, 10, size=num_train)
+    blank = "----------------------"
+    for metric in ['euclidean', 'cosine']:
+        print(blank + "metric = %s" % metric + blank)
+        exact = KNN(K, X, y, metric=metric)
+        start = time.perf_counter()
+        expected = exact._k_nearest(X_test)[1]
+        print("exact brute force                  query: %.3fs" % (time.perf_counter() - start))
+        for num_tables, num_bits in [(4, 16), (8, 16), (16, 16)]:
+            start = time.perf_counter()
+            index = LSHIndex(X, metric=metric, num_tables=num_tables, num_bits=num_bits, seed=0)
+            build_time = time.perf_counter() - start
+            for probes in [0, 2, 8]:
+                index.probes = probes
+                start = time.perf_counter()
+                found = index.query(X_test, K)[1]
+                query_time = time.perf_counter() - start
+                recall = np.mean([np.intersect1d(f, e).size/K for f, e in zip(found, expected)])
+                print("tables = %2d, bits = %d, probes = %d | build: %.3fs | query: %.3fs | recall@%d: %.3f"
+                      % (num_tables, num_bits, probes, build_time, query_time, K, recall))
+        distances, found = index.query(X_test, K)
+        valid = found >= 0
+        exact_dist = np.concatenate([cdist(X_test[i:i+1], X[found[i][valid[i]]], metric)[0] for i in range(num_test)])
+        out = "PASS" if np.allclose(distances[valid], exact_dist, rtol=1e-12, atol=1e-12) else "FAIL"
+        print("====> batched candidate distances match cdist: " + out)
+        with tempfile.TemporaryDirectory() as folder:
+            index.save(folder + "/index.npz")
+            loaded = LSHIndex.load(folder + "/index.npz", X)
+            out = "PASS" if np.array_equal(loaded.query(X_test, K)[1], index.query(X_test, K)[1]) else "FAIL"
+        print("====> saved index answers the same queries: " + out)
+
+
+def benchmark_sweep(num_train=20000, num_test=2000, dim=32):
+    """
+    Time of the sweep against one KNN per (K, metric) pair, on random clustered data.
+    """
+    import time
+
+    centers = np.random.normal(scale=3, size=(10, dim))
+    labels = np.random.randint(0, 10, size=num_train + num_test)
+    points = centers[labels] + np.random.normal(size=(num_train + num_test, dim))
+    X, y, X_test, y_test = points[:num_train], labels[:num_train], points[num_train:], labels[num_train:]
+    ks = [1, 3, 5, 7, 9, 11]
+    metrics = ['manhattan', 'euclidean', 'cosine']
+
+    start = time.perf_counter()
+    expected = pd.DataFrame([[np.mean(KNN(k, X, y, metric=metric).predict(X_test) == y_test) for metric in metrics]
+                             for k in ks], index=pd.Index(ks, name="K"), columns=metrics)
+    loop_time = time.perf_counter() - start
+    times = []
+    for workers in [1, None]:
+        start = time.perf_counter()
+        table = sweep(X, y, X_test, y_test, ks, metrics, workers=workers)
+        times.append(time.perf_counter() - start)
+    print(table)
+    print("one KNN per pair: %.3fs | sweep: %.3fs | parallel sweep: %.3fs" % (loop_time, times[0], times[1]))
+    out = "PASS" if table.equals(expected) else "FAIL"
+    print("====> identical accuracy table: " + out)
+
+
 if __name__ == '__main__':
-    main()
+    import argparse
+
+    parser = argparse.ArgumentParser(description="A KNN program.")
+    parser.add_argument("--benchmark", action="store_true", help="Benchmark the tree indexes against brute force.")
+    parser.add_argument("--benchmark_brute", action="store_true", help="Benchmark the blocked brute-force path.")
+    parser.add_argument("--benchmark_vote", action="store_true", help="Benchmark the vectorized vote.")
+    parser.add_argument("--benchmark_ann", action="store_true", help="Recall and latency of the approximate index.")
+    parser.add_argument("--benchmark_sweep", action="store_true", help="Benchmark the multi-K, multi-metric sweep.")
+    args = parser.parse_args()
+    if args.benchmark:
+        benchmark()
+    elif args.benchmark_brute:
+        benchmark_brute()
+    elif args.benchmark_vote:
+        benchmark_vote()
+    elif args.benchmark_ann:
+        benchmark_ann()
+    elif args.benchmark_sweep:
+        benchmark_sweep()
+    else:
+        main()
@@ -0,0 +1,161 @@
+"""
+Space partitioning indexes for exact k-nearest neighbours queries.
+"""
+
+import numpy as np
+from scipy.spatial.distance import cdist
+
+# KNN metric name -> scipy cdist metric name.
+_cdist_metrics = {'euclidean': 'euclidean', 'manhattan': 'cityblock'}
+
+
+class _TreeIndex:
+    """
+    Binary tree over the training points, stored as flat arrays. Each node owns the range [start, end) of `self.order`,
+    the permutation of the training points grouped by leaf.
+
+    A query visits the nodes depth first for a whole batch of query points at once: at each node, only the queries
+    whose lower bound distance to the node is not larger than their current K-th nearest distance go on, the others
+    are pruned. Leaves are compared to the remaining queries with one cdist call.
+    """
+
+    def __init__(self, X, metric='euclidean', leaf_size=64):
+        assert metric in _cdist_metrics, "Tree indexes support the metrics: %s" % list(_cdist_metrics.keys())
+        assert leaf_size > 0, "leaf_size must be positive."
+        self.X = X
+        self.metric = metric
+        self.leaf_size = leaf_size
+        self._build()
+
+    def _build(self):
+        self.order = np.arange(self.X.shape[0])
+        starts, ends, lefts, rights, bounds = [], [], [], [], []
+        stack = [(0, self.X.shape[0], -1, False)]
+        while stack:
+            start, end, parent, is_right = stack.pop()
+            node = len(starts)
+            if parent >= 0:
+                (rights if is_right else lefts)[parent] = node
+            points = self.X[self.order[start:end]]
+            starts.append(start)
+            ends.append(end)
+            lefts.append(-1)
+            rights.append(-1)
+            bounds.append(self._bounds(points))
+            if end - start <= self.leaf_size:
+                continue
+            left_mask = self._split(points)
+            if left_mask.all() or not left_mask.any():
+                # duplicated points can't be separated, keep them in a leaf.
+                continue
+            self.order[start:end] = np.concatenate([self.order[start:end][left_mask],
+                                                    self.order[start:end][~left_mask]])
+            middle = start + int(np.sum(left_mask))
+            stack.append((middle, end, node, True))
+            stack.append((start, middle, node, False))
+        self.starts = np.array(starts)
+        self.ends = np.array(ends)
+        self.lefts = np.array(lefts)
+        self.rights = np.array(rights)
+        self.bounds = [np.array(bound) for bound in zip(*bounds)]
+
+    def _split(self, points):
+        raise NotImplementedError("Child class must implement _split() function")
+
+    def _bounds(self, points):
+        raise NotImplementedError("Child class must implement _bounds() function")
+
+    def _lower_bound(self, node, X_query):
+        raise NotImplementedError("Child class must implement _lower_bound() function")
+
+    def query(self, X_query, K):
+        """
+        Exact K nearest neighbours of every query point. Ties are broken by training index.
+
+        Returns
+        -------
+        distances: shape = (N_query, K), sorted ascending.
+        indices: indices into X of the neighbours, shape = (N_query, K).
+        """
+        K = min(K, self.X.shape[0])
+        num_query = X_query.shape[0]
+        best_dist = np.full((num_query, K), np.inf)
+        best_idx = np.full((num_query, K), self.X.shape[0])
+        stack = [(0, np.arange(num_query))]
+        while stack:
+            node, queries = stack.pop()
+            lower = self._lower_bound(node, X_query[queries])
+            keep = lower <= best_dist[queries, -1]
+            queries = queries[keep]
+            if queries.size == 0:
+                continue
+            if self.lefts[node] < 0:
+                members = self.order[self.starts[node]:self.ends[node]]
+                dist = cdist(X_query[queries], self.X[members], _cdist_metrics[self.metric])
+                cand_dist = np.concatenate([best_dist[queries], dist], axis=1)
+                cand_idx = np.concatenate([best_idx[queries], np.broadcast_to(members, dist.shape)], axis=1)
+                # sort by distance, then by training index.
+                rank = np.lexsort((cand_idx, cand_dist), axis=1)[:, :K]
+                best_dist[queries] = np.take_along_axis(cand_dist, rank, axis=1)
+                best_idx[queries] = np.take_along_axis(cand_idx, rank, axis=1)
+                continue
+            # visit the child nearer to the queries (on average) first, its results prune more of the other one.
+            left, right = self.lefts[node], self.rights[node]
+            if np.mean(self._lower_bound(left, X_query[queries])) <= np.mean(self._lower_bound(right, X_query[queries])):
+                stack.extend([(right, queries), (left, queries)])
+            else:
+                stack.extend([(left, queries), (right, queries)])
+        return best_dist, best_idx
+
+
+class KDTree(_TreeIndex):
+    """
+    KD-tree: nodes are axis-aligned bounding boxes split at the median of their widest dimension.
+    Efficient for low dimensional data.
+    """
+
+    def _split(self, points):
+        spread = np.max(points, axis=0) - np.min(points, axis=0)
+        dim = np.argmax(spread)
+        median = np.partition(points[:, dim], points.shape[0]//2)[points.shape[0]//2]
+        left_mask = points[:, dim] < median
+        if not left_mask.any():
+            left_mask = points[:, dim] <= median
+        return left_mask
+
+    def _bounds(self, points):
+        return np.min(points, axis=0), np.max(points, axis=0)
+
+    def _lower_bound(self, node, X_query):
+        low, high = self.bounds[0][node], self.bounds[1][node]
+        gap = np.maximum(np.maximum(low - X_query, X_query - high), 0)
+        if self.metric == 'manhattan':
+            return np.sum(gap, axis=1)
+        return np.sqrt(np.sum(gap**2, axis=1))
+
+
+class BallTree(_TreeIndex):
+    """
+    Ball tree: nodes are balls (center, radius) split along the direction joining two far apart points.
+    Bounds only rely on the triangle inequality, so it scales to higher dimensions than the KD-tree.
+    """
+
+    def _split(self, points):
+        metric = _cdist_metrics[self.metric]
+        first = points[np.argmax(cdist(points[:1], points, metric)[0])]
+        second = points[np.argmax(cdist(first[None], points, metric)[0])]
+        projection = points.dot(second - first)
+        median = np.partition(projection, points.shape[0]//2)[points.shape[0]//2]
+        left_mask = projection < median
+        if not left_mask.any():
+            left_mask = projection <= median
+        return left_mask
+
+    def _bounds(self, points):
+        center = np.mean(points, axis=0)
+        return center, np.max(cdist(center[None], points, _cdist_metrics[self.metric]))
+
+    def _lower_bound(self, node, X_query):
+        center, radius = self.bounds[0][node], self.bounds[1][node]
+        dist = cdist(X_query, center[None], _cdist_metrics[self.metric])[:, 0]
+        return np.maximum(dist - radius, 0)
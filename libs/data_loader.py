@@ -0,0 +1,129 @@
+import queue
+import threading
+import numpy as np
+
+_end_of_epoch = object()
+
+
+class DataLoader:
+
+    def __init__(self, X, y, batch_size, shuffle=False, transforms=None, prefetch=2, seed=None):
+        """
+        Mini-batch iterator over a dataset. Each epoch (each `for` loop over the loader) optionally shuffles the data
+        through an index permutation, applies the transforms to each batch and, with `prefetch` > 0, prepares the
+        batches in a background thread so batch N+1 is ready while batch N trains.
+
+        Parameters
+        ----------
+        X: dataset X (numpy array or memory-mapped array), indexed along the first axis.
+        y: labels, same first dimension as X.
+        batch_size: (integer) number of data points per batch.
+        shuffle: (boolean) whether to draw a new permutation of the data at each epoch.
+        transforms: (list) callables `transform(X_batch, y_batch) -> (X_batch, y_batch)` applied in order to
+            each batch, e.g. `normalize`, `one_hot`, `random_flip`.
+        prefetch: (integer) maximum number of batches prepared ahead. 0 prepares them synchronously.
+        seed: (integer) seed of the shuffling permutations.
+        """
+        assert X.shape[0] == y.shape[0], "X and y must have the same data points."
+        assert batch_size > 0, "batch_size must be positive."
+        self.X = X
+        self.y = y
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.transforms = transforms or []
+        self.prefetch = prefetch
+        self.random = np.random.RandomState(seed)
+
+    def __len__(self):
+        return (self.X.shape[0] + self.batch_size - 1) // self.batch_size
+
+    def _batch(self, indices, start):
+        """
+        Gather and transform the batch starting at position `start` of the epoch.
+        """
+        end = start + self.batch_size
+        if indices is None:
+            X_batch, y_batch = self.X[start:end], self.y[start:end]
+        else:
+            X_batch, y_batch = self.X[indices[start:end]], self.y[indices[start:end]]
+        for transform in self.transforms:
+            X_batch, y_batch = transform(X_batch, y_batch)
+        return X_batch, y_batch
+
+    def __iter__(self):
+        indices = self.random.permutation(self.X.shape[0]) if self.shuffle else None
+        starts = range(0, self.X.shape[0], self.batch_size)
+        if self.prefetch == 0:
+            for start in starts:
+                yield self._batch(indices, start)
+            return
+
+        batches = queue.Queue(maxsize=self.prefetch)
+        stop = threading.Event()
+
+        def put(item):
+            # give up when the consumer stopped iterating, instead of blocking on a full queue forever.
+            while not stop.is_set():
+                try:
+                    batches.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    continue
+            return False
+
+        def produce():
+            try:
+                for start in starts:
+                    if not put(self._batch(indices, start)):
+                        return
+                put(_end_of_epoch)
+            except Exception as e:
+                put(e)
+
+        thread = threading.Thread(target=produce, daemon=True)
+        thread.start()
+        try:
+            while True:
+                batch = batches.get()
+                if batch is _end_of_epoch:
+                    break
+                if isinstance(batch, Exception):
+                    raise batch
+                yield batch
+        finally:
+            stop.set()
+            thread.join()
+
+
+def normalize(scale=255.0, dtype=np.float32):
+    """
+    Transform: cast X to `dtype` and divide it by `scale`.
+    """
+    def transform(X, y):
+        X = X.astype(dtype)
+        X /= scale
+        return X, y
+    return transform
+
+
+def one_hot(num_classes, dtype=np.float32):
+    """
+    Transform: one-hot encode the integer labels y.
+    """
+    def transform(X, y):
+        return X, np.eye(num_classes, dtype=dtype)[np.ravel(y).astype(int)]
+    return transform
+
+
+def random_flip(axis=2, probability=0.5, seed=None):
+    """
+    Transform (augmentation): flip each image of X along `axis` (the width of NHWC images) with `probability`.
+    """
+    random = np.random.RandomState(seed)
+
+    def transform(X, y):
+        flip = random.uniform(size=X.shape[0]) < probability
+        X = np.array(X)
+        X[flip] = np.flip(X[flip], axis=axis)
+        return X, y
+    return transform
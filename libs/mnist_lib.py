@@ -112,8 +112,8 @@ class MNIST(object):
         return self._return_type
 
     def load_testing(self):
-        ims, labels = self.load(os.path.join(self.path, self.test_img_fname),
-                                os.path.join(self.path, self.test_lbl_fname))
+        ims, labels = self._load_flat(os.path.join(self.path, self.test_img_fname),
+                                      os.path.join(self.path, self.test_lbl_fname))
 
         self.test_images = self.process_images(ims)
         self.test_labels = self.process_labels(labels)
@@ -121,8 +121,8 @@ class MNIST(object):
         return self.test_images, self.test_labels
 
     def load_training(self):
-        ims, labels = self.load(os.path.join(self.path, self.train_img_fname),
-                                os.path.join(self.path, self.train_lbl_fname))
+        ims, labels = self._load_flat(os.path.join(self.path, self.train_img_fname),
+                                      os.path.join(self.path, self.train_lbl_fname))
 
         self.train_images = self.process_images(ims)
         self.train_labels = self.process_labels(labels)
@@ -132,29 +132,23 @@ class MNIST(object):
     def load_training_in_batches(self, batch_size):
         if type(batch_size) is not int:
             raise ValueError('batch_size must be a int number')
-        batch_sp = 0
-        last = False
-        self._get_dataset_size(os.path.join(self.path, self.train_img_fname),
-                               os.path.join(self.path, self.train_lbl_fname))
+        # the files are read (or mapped) once, batches are slices of them.
+        ims, labels = self._load_flat(os.path.join(self.path, self.train_img_fname),
+                                      os.path.join(self.path, self.train_lbl_fname))
+        self.dataset_size = len(labels)
 
-        while True:
-            ims, labels = self.load(
-                os.path.join(self.path, self.train_img_fname),
-                os.path.join(self.path, self.train_lbl_fname),
-                batch=[batch_sp, batch_size])
-
-            self.train_images = self.process_images(ims)
-            self.train_labels = self.process_labels(labels)
+        for batch_sp in range(0, self.dataset_size, batch_size):
+            self.train_images = self.process_images(ims[batch_sp:batch_sp + batch_size])
+            self.train_labels = self.process_labels(labels[batch_sp:batch_sp + batch_size])
 
             yield self.train_images, self.train_labels
 
-            if last:
-                break
-
-            batch_sp += batch_size
-            if batch_sp + batch_size > self.dataset_size:
-                last = True
-                batch_size = self.dataset_size - batch_sp
+    def _load_flat(self, path_img, path_lbl):
+        # one flattened image per row, as the lists path returns them.
+        if self.return_type == 'numpy':
+            ims, labels = self.load_numpy(path_img, path_lbl)
+            return ims.reshape(ims.shape[0], -1), labels
+        return self.load(path_img, path_lbl)
 
     def _get_dataset_size(self, path_img, path_lbl):
         with self.opener(path_lbl, 'rb') as file:
@@ -187,14 +181,14 @@ class MNIST(object):
             return labels
         elif self.return_type is 'numpy':
             _np = _import_numpy()
-            return _np.array(labels)
+            return _np.asarray(labels)
         else:
             raise MNISTException("unknown return_type '{}'".format(self.return_type))
 
     def process_images_to_numpy(self,images):
         _np = _import_numpy()
 
-        images_np = _np.array(images)
+        images_np = _np.asarray(images)
 
         if self.mode == 'vanilla':
             pass # no processing, return them vanilla
@@ -287,6 +281,47 @@ class MNIST(object):
 
         return images, labels
 
+    def load_numpy(self, path_img, path_lbl):
+        '''
+        Zero-copy load of the IDX files: the uint8 payloads are memory-mapped
+        (or wrapped with np.frombuffer for gzipped files) instead of being
+        parsed into lists.
+        Returns images of shape (size, rows, cols) and labels of shape (size,).
+        '''
+        _np = _import_numpy()
+
+        with self.opener(path_lbl, 'rb') as file:
+            magic, lb_size = struct.unpack(">II", file.read(8))
+            if magic != 2049:
+                raise ValueError('Magic number mismatch, expected 2049,'
+                                 'got {}'.format(magic))
+
+        with self.opener(path_img, 'rb') as file:
+            magic, size, rows, cols = struct.unpack(">IIII", file.read(16))
+            if magic != 2051:
+                raise ValueError('Magic number mismatch, expected 2051,'
+                                 'got {}'.format(magic))
+
+        labels = self._map_payload(path_lbl, 8, (lb_size,))
+        images = self._map_payload(path_img, 16, (size, rows, cols))
+
+        # for some reason EMNIST is mirrored and rotated: a transpose of each image fixes both
+        if self.emnistRotate:
+            images = images.transpose(0, 2, 1)
+
+        return images, labels
+
+    def _map_payload(self, path_fn, offset, shape):
+        _np = _import_numpy()
+        if self.gz:
+            with self.opener(path_fn, 'rb') as file:
+                data = file.read()
+            return _np.frombuffer(data, dtype=_np.uint8, count=int(_np.prod(shape)),
+                                  offset=offset).reshape(shape)
+        # copy-on-write: the arrays are writable without touching the file
+        return _np.memmap(path_fn, dtype=_np.uint8, mode='c', offset=offset,
+                          shape=shape)
+
     @classmethod
     def display(cls, img, width=28, threshold=200):
         render = ''
@@ -297,4 +332,53 @@ class MNIST(object):
                 render += '@'
             else:
                 render += '.'
-        return render
\ No newline at end of file
+        return render
+
+def benchmark(path=None, size=60000):
+    '''
+    Compare the list parsing path with the memory-mapped numpy path.
+    Without `path`, random IDX files of `size` images are written to a temporary folder.
+    '''
+    import tempfile
+    import time
+    import tracemalloc
+    import numpy as _np
+
+    folder = None
+    if path is None:
+        folder = tempfile.TemporaryDirectory()
+        path = folder.name
+        images = _np.random.randint(0, 256, size=(size, 28, 28), dtype=_np.uint8)
+        labels = _np.random.randint(0, 10, size=size, dtype=_np.uint8)
+        with open(os.path.join(path, 'train-images-idx3-ubyte'), 'wb') as f:
+            f.write(struct.pack(">IIII", 2051, size, 28, 28) + images.tobytes())
+        with open(os.path.join(path, 'train-labels-idx1-ubyte'), 'wb') as f:
+            f.write(struct.pack(">II", 2049, size) + labels.tobytes())
+
+    results = {}
+    for return_type in _allowed_return_types:
+        for rotate in [False, True]:
+            mndata = MNIST(path, return_type=return_type)
+            mndata.emnistRotate = rotate
+            tracemalloc.start()
+            start = time.perf_counter()
+            ims, labels = mndata.load_training()
+            ims = _np.asarray(ims)
+            load_time = time.perf_counter() - start
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            start = time.perf_counter()
+            num_batches = sum(1 for _ in mndata.load_training_in_batches(1000))
+            batch_time = time.perf_counter() - start
+            results[(return_type, rotate)] = ims
+            print("%-6s emnistRotate=%-5s load: %.3fs (peak %.1f MB) | %d batches: %.3fs"
+                  % (return_type, rotate, load_time, peak/2**20, num_batches, batch_time))
+    for rotate in [False, True]:
+        result = _np.array_equal(results[('lists', rotate)], results[('numpy', rotate)])
+        print("====> numpy path matches lists path (emnistRotate=%s): %s" % (rotate, "PASS" if result else "FAIL"))
+    if folder is not None:
+        folder.cleanup()
+
+
+if __name__ == "__main__":
+    benchmark()
@@ -47,19 +47,19 @@ def plot_image(image):
     plt.show()
 
 
-def one_hot_encoding(y):
+def one_hot_encoding(y, dtype=np.float64):
     one_hot = OneHotEncoder()
     y = y.reshape((-1, 1))
-    return one_hot.fit_transform(y).toarray()
+    return one_hot.fit_transform(y).toarray().astype(dtype, copy=False)
 
 
-def preprocess_data(X, y, nn=False, test=False):
-    X = np.array(X)
-    X = X/255
+def preprocess_data(X, y, nn=False, test=False, dtype=np.float32):
+    X = np.asarray(X).astype(dtype)
+    X /= 255
     y = np.array(y)
 
     if nn:
         X = X.reshape((-1, 28, 28, 1))
     if not test:
-        y = one_hot_encoding(y)
+        y = one_hot_encoding(y, dtype=dtype)
     return X, y
\ No newline at end of file
@@ -5,6 +5,7 @@ Docs: https://giangtranml.github.io/ml/machine-learning/linear-regression
 """
 import sys
 sys.path.append("..")
+import copy
 import numpy as np
 from sklearn.model_selection import train_test_split
 from optimizations_algorithms.optimizers import SGD
@@ -15,6 +16,7 @@ class LinearRegression:
         self.epochs = epochs
         self.lambda_ = lambda_
         self.optimizer = optimizer
+        self.bias_optimizer = copy.copy(optimizer)
 
     def _hypothesis(self, X):
         return np.dot(X, self.w) + self.b
@@ -42,12 +44,12 @@ class LinearRegression:
                 break
 
     def _update_params(self, w_grad, b_grad):
-        self.w -= self.optimizer.minimize(w_grad)
-        self.b -= self.optimizer.minimize(b_grad)
+        self.optimizer.step(self.w, w_grad)
+        self.bias_optimizer.step(self.b, b_grad)
 
     def train(self, X_train, y_train):
         self.w = np.random.normal(size=(X_train.shape[1], 1))
-        self.b = np.mean(y_train)
+        self.b = np.array(np.mean(y_train))
         self._train(X_train, y_train)
 
     def predict(self, X_test):
@@ -11,6 +11,7 @@ from sklearn.model_selection import train_test_split
 import sys
 sys.path.append("..")
 from optimizations_algorithms.optimizers import SGD
+from libs.data_loader import DataLoader
 
 
 class LogisticRegression:
@@ -61,33 +62,38 @@ class LogisticRegression:
         m = X.shape[0]
         return (X.T.dot(y_pred - y_true))/m
 
-    def _train(self, X_train, y_train):
+    def _train(self, batches):
         """
         Main training function. 
         """
         for e in range(self.epochs):
             batch_loss = 0
             num_batches = 0
-            it = 0
-            while it < X_train.shape[0]:
-                y_hat = self._sigmoid(X_train[it:it+self.batch_size])
-                loss = self._cross_entropy_loss(y_train[it:it+self.batch_size], y_hat)
+            for X_batch, y_batch in batches:
+                y_batch = y_batch.reshape((-1, 1))
+                if self.w is None:
+                    self.w = np.random.normal(size=(X_batch.shape[1], 1))
+                y_hat = self._sigmoid(X_batch)
+                loss = self._cross_entropy_loss(y_batch, y_hat)
                 batch_loss += loss
-                grad = self._gradient(X_train[it:it+self.batch_size], y_train[it:it+self.batch_size], y_hat)
-                self.w -= self.optimizer.minimize(grad)
-                it += self.batch_size
+                grad = self._gradient(X_batch, y_batch, y_hat)
+                self.optimizer.step(self.w, grad)
                 num_batches += 1
             print("Loss at epoch %s: %f" % (e + 1 , batch_loss / num_batches))
 
-    def train(self, train_X, train_y):
+    def train(self, train_X, train_y=None):
         """
         Wrapper training function, check the prior condition first.
+        `train_X` can also be a `DataLoader` serving (X, y) batches.
         """
-        assert type(train_X) is np.ndarray, "Expected train X is numpy array but got %s" % type(train_X)
-        assert type(train_y) is np.ndarray, "Expected train y is numpy array but got %s" % type(train_y)
-        train_y = train_y.reshape((-1, 1))
-        self.w = np.random.normal(size=(train_X.shape[1], 1))
-        self._train(train_X, train_y)
+        if isinstance(train_X, DataLoader):
+            batches = train_X
+        else:
+            assert type(train_X) is np.ndarray, "Expected train X is numpy array but got %s" % type(train_X)
+            assert type(train_y) is np.ndarray, "Expected train y is numpy array but got %s" % type(train_y)
+            batches = DataLoader(train_X, train_y.reshape((-1, 1)), self.batch_size, prefetch=0)
+        self.w = None
+        self._train(batches)
 
     def predict(self, test_X):
         """
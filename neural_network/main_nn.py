@@ -1,42 +1,290 @@
 import sys
 sys.path.append("..")
 import os
+import numpy as np
 from optimizations_algorithms.optimizers import SGD, SGDMomentum, RMSProp, Adam
 from neural_network import NeuralNetwork
 from libs.utils import load_dataset_mnist, preprocess_data
 from libs.mnist_lib import MNIST
 
 
-load_dataset_mnist("../libs")
-mndata = MNIST('../libs/data_mnist')
-weight_path = "nn_weights.pickle"
-training_phase = weight_path not in os.listdir(".")
-if training_phase:
-    images, labels = mndata.load_training()
-    images, labels = preprocess_data(images, labels)
-    epochs = 10
-    batch_size = 64
-    learning_rate = 0.01
+def main(dtype="float32", workers=1, micro_batches=1):
+    load_dataset_mnist("../libs")
+    mndata = MNIST('../libs/data_mnist', return_type='numpy')
+    weight_path = "nn_weights.pickle"
+    training_phase = weight_path not in os.listdir(".")
+    if training_phase:
+        images, labels = mndata.load_training()
+        images, labels = preprocess_data(images, labels)
+        epochs = 10
+        batch_size = 64
+        learning_rate = 0.01
 
-    optimizer = Adam(learning_rate)
-    archs = [
-        {"num_neurons": 100, "weight_init": "he_normal", "activation": "relu", "drop_out": 0.8},
-        {"num_neurons": 125, "weight_init": "he_normal", "activation": "relu", "drop_out": 0.8},
-        {"num_neurons": 50, "weight_init": "he_normal", "activation": "sigmoid", "batch_norm": None},
-        {"num_neurons": labels.shape[1], "weight_init": "he_normal", "activation": "softmax"}]
-    nn = NeuralNetwork(epochs, batch_size, optimizer, archs)
-    nn.train(images, labels)
-    nn.save(weight_path)
-else:
+        optimizer = Adam(learning_rate)
+        archs = [
+            {"num_neurons": 100, "weight_init": "he_normal", "activation": "relu", "drop_out": 0.8},
+            {"num_neurons": 125, "weight_init": "he_normal", "activation": "relu", "drop_out": 0.8},
+            {"num_neurons": 50, "weight_init": "he_normal", "activation": "sigmoid", "batch_norm": None},
+            {"num_neurons": labels.shape[1], "weight_init": "he_normal", "activation": "softmax"}]
+        nn = NeuralNetwork(epochs, batch_size, optimizer, archs, dtype=dtype)
+        nn.train(images, labels, workers=workers, micro_batches=micro_batches)
+        nn.save(weight_path)
+    else:
+        import pickle
+        images_test, labels_test = mndata.load_testing()
+        images_test, labels_test = preprocess_data(images_test, labels_test, test=True)
+        with open(weight_path, "rb") as f:
+            nn = pickle.load(f)
+        pred = nn.predict(images_test)
+
+        print("Accuracy:", len(pred[labels_test == pred]) / len(pred))
+        from sklearn.metrics.classification import confusion_matrix
+
+        print("Confusion matrix: ")
+        print(confusion_matrix(labels_test, pred))
+
+
+def test_dtype():
+    """
+    Train a small network under every dtype policy on random MNIST-like data and check that weights,
+    activations and optimizer state keep the policy dtypes end-to-end, without any upcast to float64.
+    """
+    from nn_components.layers import FCLayer, BatchNormLayer
+
+    blank = "----------------------"
+    print(blank + "TEST DTYPE POLICY" + blank)
+    images = np.random.randint(0, 256, size=(256, 784))
+    labels = np.random.randint(0, 10, size=256)
+    for dtype in ["float64", "float32", "mixed_float16"]:
+        archs = [
+            {"num_neurons": 32, "weight_init": "he_normal", "activation": "relu", "drop_out": 0.8},
+            {"num_neurons": 16, "weight_init": "he_normal", "activation": "sigmoid", "batch_norm": None},
+            {"num_neurons": 10, "weight_init": "he_normal", "activation": "softmax"}]
+        nn = NeuralNetwork(epochs=2, batch_size=64, optimizer=Adam(0.01), nn_structure=archs, dtype=dtype)
+        X, Y = preprocess_data(images, labels, dtype=nn.policy.storage_dtype)
+        nn.train(X, Y)
+        storage, compute = nn.policy.storage_dtype, nn.policy.compute_dtype
+        result = X.dtype == storage and Y.dtype == storage
+        result &= nn.registry.params.dtype == storage and nn.registry.grads.dtype == compute
+        result &= nn.registry.optimizer.v.dtype == compute and nn.registry.optimizer.s.dtype == compute
+        for layer in nn.layers:
+            result &= layer.output.dtype == storage
+            if isinstance(layer, FCLayer):
+                result &= layer.W.dtype == storage
+            if isinstance(layer, BatchNormLayer):
+                result &= layer.gamma.dtype == storage and layer.beta.dtype == storage
+                result &= layer.mu_moving_average.dtype == compute and layer.sigma_moving_average.dtype == compute
+        result &= nn._forward(X, prediction=True).dtype == storage
+        out = "PASS" if result else "FAIL"
+        print("====> %s: %s" % (dtype, out))
+
+
+def test_registry():
+    """
+    Check that the layer parameters are views of the flat parameter buffer, also after pickling,
+    and that a weights checkpoint round-trips, batch norm statistics included.
+    """
     import pickle
-    images_test, labels_test = mndata.load_testing()
-    images_test, labels_test = preprocess_data(images_test, labels_test, test=True)
-    with open(weight_path, "rb") as f:
-        nn = pickle.load(f)
-    pred = nn.predict(images_test)
+    import tempfile
+    from nn_components.layers import FCLayer
+
+    blank = "----------------------"
+    print(blank + "TEST PARAMETER REGISTRY" + blank)
+    images = np.random.randint(0, 256, size=(128, 784))
+    labels = np.random.randint(0, 10, size=128)
+    X, Y = preprocess_data(images, labels)
+    archs = [
+        {"num_neurons": 32, "weight_init": "he_normal", "activation": "relu"},
+        {"num_neurons": 16, "weight_init": "he_normal", "activation": "sigmoid", "batch_norm": None},
+        {"num_neurons": 10, "weight_init": "he_normal", "activation": "softmax"}]
+    nn = NeuralNetwork(epochs=1, batch_size=64, optimizer=Adam(0.01), nn_structure=archs)
+    nn.train(X, Y)
+    layers = nn._trainable_layers()
+    result = all(np.shares_memory(getattr(layer, name), nn.registry.params)
+                 for layer in layers for name in layer.trainable_params)
+    result &= nn.registry.params.size == sum(getattr(layer, name).size for layer in layers for name in layer.trainable_params)
+    print("====> parameters are views of the flat buffer: " + ("PASS" if result else "FAIL"))
+
+    nn_copy = pickle.loads(pickle.dumps(nn))
+    result = all(np.shares_memory(getattr(layer, name), nn_copy.registry.params)
+                 for layer in nn_copy._trainable_layers() for name in layer.trainable_params)
+    result &= np.array_equal(nn.predict(X), nn_copy.predict(X))
+    print("====> views rebound after pickling: " + ("PASS" if result else "FAIL"))
+
+    with tempfile.TemporaryDirectory() as folder:
+        path = folder + "/weights.npz"
+        nn.save_weights(path)
+        fc_layers = [layer for layer in layers if isinstance(layer, FCLayer)]
+        expected = [layer.W.copy() for layer in fc_layers]
+        expected_pred = nn.predict(X)
+        nn.train(X, Y)
+        nn.load_weights(path)
+        result = all(np.array_equal(W, layer.W) for W, layer in zip(expected, fc_layers))
+        result &= np.array_equal(expected_pred, nn.predict(X))
+        # into another model of the same architecture, trained separately so its batch norm statistics differ.
+        nn_other = NeuralNetwork(epochs=1, batch_size=64, optimizer=Adam(0.01), nn_structure=archs)
+        nn_other.train(X, Y)
+        nn_other.load_weights(path)
+        result &= np.array_equal(nn.registry.buffers, nn_other.registry.buffers)
+        result &= np.array_equal(expected_pred, nn_other.predict(X))
+    print("====> weights checkpoint round-trip: " + ("PASS" if result else "FAIL"))
+
+
+def test_micro_batches():
+    """
+    Check that accumulating gradients over micro-batches gives the same update as the whole mini-batch.
+    """
+    blank = "----------------------"
+    print(blank + "TEST GRADIENT ACCUMULATION" + blank)
+    X = np.random.randn(200, 64)
+    Y = np.eye(10)[np.random.randint(0, 10, size=200)]
+    archs = [
+        {"num_neurons": 32, "weight_init": "he_normal", "activation": "relu"},
+        {"num_neurons": 10, "weight_init": "he_normal", "activation": "softmax"}]
+    params = []
+    for micro_batches in [1, 3]:
+        nn = NeuralNetwork(epochs=2, batch_size=64, optimizer=Adam(0.01), nn_structure=archs, dtype="float64")
+        nn.train(X, Y, seed=0, micro_batches=micro_batches)
+        params.append(nn.registry.params)
+    result = np.allclose(params[0], params[1], atol=1e-10)
+    print("====> micro-batches match the whole mini-batch: " + ("PASS" if result else "FAIL"))
+
+
+def test_data_loader():
+    """
+    Check that background prefetching serves exactly the batches of the synchronous loader, and that breaking out of
+    an epoch stops the prefetch thread.
+    """
+    import threading
+    from libs.data_loader import DataLoader, normalize, one_hot
+
+    blank = "----------------------"
+    print(blank + "TEST DATA LOADER" + blank)
+    images = np.random.randint(0, 256, size=(1000, 784)).astype(np.uint8)
+    labels = np.random.randint(0, 10, size=1000)
+    loaders = [DataLoader(images, labels, 64, shuffle=True, transforms=[normalize(), one_hot(10)], prefetch=prefetch,
+                          seed=0) for prefetch in [0, 2]]
+    result = True
+    for _ in range(2):
+        batches = [list(loader) for loader in loaders]
+        result &= len(batches[0]) == len(loaders[0]) and all(
+            np.array_equal(X, X_pre) and np.array_equal(Y, Y_pre) for (X, Y), (X_pre, Y_pre) in zip(*batches))
+    X = np.concatenate([X for X, _ in batches[1]])
+    result &= np.array_equal(np.sort(X*255, axis=0), np.sort(images.astype(np.float32), axis=0))
+    print("====> prefetched shuffled batches match: " + ("PASS" if result else "FAIL"))
+
+    # break out of an epoch: closing the iteration must stop and join the producer thread.
+    before = set(threading.enumerate())
+    producers = set()
+    for step, _ in enumerate(loaders[1]):
+        producers = set(threading.enumerate()) - before
+        if step == 2:
+            break
+    for thread in producers:
+        thread.join(timeout=5)
+    result = len(producers) == 1 and not any(thread.is_alive() for thread in producers)
+    result &= threading.active_count() == len(before)
+    print("====> early stop releases the prefetch thread: " + ("PASS" if result else "FAIL"))
+
+
+def test_data_parallel():
+    """
+    Check that data-parallel training matches serial training and is deterministic given a seed.
+    """
+    blank = "----------------------"
+    print(blank + "TEST DATA PARALLEL" + blank)
+    X = np.random.randn(256, 64)
+    Y = np.eye(10)[np.random.randint(0, 10, size=256)]
+    archs = [
+        {"num_neurons": 32, "weight_init": "he_normal", "activation": "relu"},
+        {"num_neurons": 10, "weight_init": "he_normal", "activation": "softmax"}]
+    # batch norm normalizes each shard with its own statistics, so it only matches serial training in expectation.
+    archs_bn = [dict(archs[0], batch_norm=None), archs[1]]
+
+    def fit(archs, workers, seed=0):
+        nn = NeuralNetwork(epochs=2, batch_size=50, optimizer=Adam(0.01), nn_structure=archs, dtype="float64")
+        nn.train(X, Y, workers=workers, seed=seed)
+        return nn.registry
+
+    result = np.allclose(fit(archs, 1).params, fit(archs, 3).params, atol=1e-10)
+    print("====> data parallel matches serial training: " + ("PASS" if result else "FAIL"))
+    first, second = fit(archs_bn, 3), fit(archs_bn, 3)
+    result = np.array_equal(first.params, second.params) and np.array_equal(first.buffers, second.buffers)
+    print("====> data parallel is deterministic: " + ("PASS" if result else "FAIL"))
+    # labels of the wrong width make every worker fail in backward: training must raise, not hang.
+    nn = NeuralNetwork(epochs=1, batch_size=50, optimizer=Adam(0.01), nn_structure=archs, dtype="float64")
+    try:
+        nn.train(X, Y[:, :5], workers=3, seed=0)
+        result = False
+    except RuntimeError as error:
+        result = "failed" in str(error)
+    print("====> data parallel raises worker errors: " + ("PASS" if result else "FAIL"))
+
+
+def benchmark_workers(num_data=8192, batch_size=512):
+    """
+    Training throughput (samples/s) of one epoch with 1, 2, 4 and 8 worker processes.
+    """
+    import time
+
+    X = np.random.randn(num_data, 784)
+    Y = np.eye(10)[np.random.randint(0, 10, size=num_data)]
+    archs = [
+        {"num_neurons": 512, "weight_init": "he_normal", "activation": "relu"},
+        {"num_neurons": 256, "weight_init": "he_normal", "activation": "relu", "batch_norm": None},
+        {"num_neurons": 10, "weight_init": "he_normal", "activation": "softmax"}]
+    print("CPU count: %d" % os.cpu_count())
+    for workers in [1, 2, 4, 8]:
+        nn = NeuralNetwork(epochs=1, batch_size=batch_size, optimizer=Adam(0.01), nn_structure=archs)
+        start = time.perf_counter()
+        nn.train(X, Y, workers=workers, seed=0)
+        elapsed = time.perf_counter() - start
+        print("workers=%d: %.0f samples/s" % (workers, num_data/elapsed))
+
+
+def benchmark_loader(num_data=16384, batch_size=256):
+    """
+    Training throughput (samples/s) of one epoch on uint8 MNIST-like data normalized and one-hot encoded on the fly,
+    with synchronous batch preparation and with background prefetching.
+    """
+    import time
+    from libs.data_loader import DataLoader, normalize, one_hot
+
+    images = np.random.randint(0, 256, size=(num_data, 784)).astype(np.uint8)
+    labels = np.random.randint(0, 10, size=num_data)
+    archs = [
+        {"num_neurons": 256, "weight_init": "he_normal", "activation": "relu"},
+        {"num_neurons": 10, "weight_init": "he_normal", "activation": "softmax"}]
+    for prefetch in [0, 2]:
+        loader = DataLoader(images, labels, batch_size, shuffle=True, transforms=[normalize(), one_hot(10)],
+                            prefetch=prefetch, seed=0)
+        nn = NeuralNetwork(epochs=1, batch_size=batch_size, optimizer=Adam(0.01), nn_structure=archs)
+        start = time.perf_counter()
+        nn.train(loader, seed=0)
+        elapsed = time.perf_counter() - start
+        print("prefetch=%d: %.0f samples/s" % (prefetch, num_data/elapsed))
+
 
-    print("Accuracy:", len(pred[labels_test == pred]) / len(pred))
-    from sklearn.metrics.classification import confusion_matrix
+if __name__ == "__main__":
+    import argparse
 
-    print("Confusion matrix: ")
-    print(confusion_matrix(labels_test, pred))
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="A NN program.")
+    parser.add_argument("--dtype", default="float32", help="dtype policy: float32, float64 or mixed_float16.")
+    parser.add_argument("--workers", type=int, default=1, help="Number of data-parallel training processes.")
+    parser.add_argument("--micro_batches", type=int, default=1, help="Number of micro-batches to accumulate gradients over.")
+    parser.add_argument("--test", action="store_true", help="Run the test cases.")
+    parser.add_argument("--benchmark_workers", action="store_true", help="Benchmark data-parallel training throughput.")
+    parser.add_argument("--benchmark_loader", action="store_true", help="Benchmark training with and without prefetching.")
+    args = parser.parse_args()
+    if args.test:
+        test_dtype()
+        test_registry()
+        test_micro_batches()
+        test_data_loader()
+        test_data_parallel()
+    elif args.benchmark_workers:
+        benchmark_workers()
+    elif args.benchmark_loader:
+        benchmark_loader()
+    else:
+        main(dtype=args.dtype, workers=args.workers, micro_batches=args.micro_batches)
@@ -6,11 +6,15 @@ Docs: https://giangtranml.github.io/ml/machine-learning/neural-network
 
 import numpy as np
 from nn_components.layers import FCLayer, ActivationLayer, BatchNormLayer, DropoutLayer
+from nn_components.precision import Policy
+from nn_components.parameters import ParameterRegistry
+from nn_components.data_parallel import DataParallel
+from libs.data_loader import DataLoader
 from tqdm import tqdm
 
 class NeuralNetwork:
 
-    def __init__(self, epochs, batch_size, optimizer, nn_structure):
+    def __init__(self, epochs, batch_size, optimizer, nn_structure, dtype="float32"):
         """
         Deep neural network architecture.
 
@@ -21,11 +25,15 @@ class NeuralNetwork:
         optimizer: (object) optimizer object uses to optimize the loss.
         nn_structure: A list of 2-element tuple (num_neuron, activation)
                  represents neural network architecture.
+        dtype: (string) dtype policy of the model, either `float32`, `float64` or `mixed_float16`
+                 (float16 weights/activations, float32 gradients/optimizer state).
         """
         self.epochs = epochs
         self.batch_size = batch_size
         self.optimizer = optimizer
+        self.policy = Policy(dtype)
         self.layers = self._structure(nn_structure)
+        self.registry = ParameterRegistry(self.optimizer, self.policy)
 
     def _structure(self, nn_structure):
         """
@@ -48,10 +56,12 @@ class NeuralNetwork:
             weight_init = struct["weight_init"]
             fc = FCLayer(num_neurons=num_neurons, weight_init=weight_init)
             fc.initialize_optimizer(self.optimizer)
+            fc.initialize_policy(self.policy)
             layers.append(fc)
             if "batch_norm" in struct:
                 bn_layer = BatchNormLayer()
                 bn_layer.initialize_optimizer(self.optimizer)
+                bn_layer.initialize_policy(self.policy)
                 layers.append(bn_layer)
             if "activation" in struct:
                 activation = struct["activation"]
@@ -104,20 +114,20 @@ class NeuralNetwork:
         output = inputs
         return output
 
-    def _backward_last(self, Y, Y_hat):
+    def _backward_last(self, Y, Y_hat, scale=1.0):
         """
         Special formula of backpropagation for the last layer.
         """
         m = Y.shape[0]
-        delta = (Y_hat - Y)/m # shape = (N, C)
-        dW = self.layers[-3].output.T.dot(delta)
-        self.layers[-2].update_params(dW)
-        dA_prev = delta.dot(self.layers[-2].W.T)
+        delta = scale*(self.policy.compute(Y_hat) - self.policy.compute(Y))/m # shape = (N, C)
+        dW = self.policy.compute(self.layers[-3].output).T.dot(delta)
+        self.layers[-2]._accumulate_gradient("W", dW)
+        dA_prev = delta.dot(self.policy.compute(self.layers[-2].W).T)
         return dA_prev
 
-    def _backward(self, Y, Y_hat, X):
+    def _backward(self, Y, Y_hat, X, scale=1.0):
         """
-        NN backward propagation level. Update weights of the neural network.
+        NN backward propagation level. Accumulate the gradients of the weights, `apply_gradients` updates them.
 
         Parameters
         ----------
@@ -127,8 +137,9 @@ class NeuralNetwork:
             shape = (N, C).
         X: training dataset.
             shape = (N, D).
+        scale: (float) weight of this batch in the accumulated gradients.
         """
-        dA_prev = self._backward_last(Y, Y_hat)
+        dA_prev = self._backward_last(Y, Y_hat, scale)
         for i in range(len(self.layers)-3, 0, -1):
             if isinstance(self.layers[i], ActivationLayer):
                 dA_prev = self.layers[i].backward(dA_prev, None)
@@ -136,36 +147,118 @@ class NeuralNetwork:
             dA_prev = self.layers[i].backward(dA_prev, self.layers[i-1])
         _ = self.layers[i-1].backward(dA_prev, X)
 
-    def train(self, X_train, Y_train, *args):
+    def _trainable_layers(self):
+        """
+        Layers whose parameters are packed into the flat parameter buffer.
+        """
+        return [layer for layer in self.layers if layer.trainable_params]
+
+    def train(self, X_train, Y_train=None, workers=1, seed=None, micro_batches=1):
         """
         Training function.
 
         Parameters
         ----------
-        X_train: training dataset X.
-        Y_train: one-hot encoding label.
-        """
-        for e in range(self.epochs):
-            batch_loss = 0
-            num_batches = 0
-            pbar = tqdm(range(0, X_train.shape[0], self.batch_size), desc="Epoch " + str(e+1))
-            for it in pbar:
-                Y_hat = self._forward(X_train[it:it+self.batch_size])
-                self._backward(Y_train[it:it+self.batch_size], Y_hat, X_train[it:it+self.batch_size])
-                loss = self._loss(Y_train[it:it+self.batch_size], Y_hat)
-                batch_loss += loss
-                num_batches += 1
-                pbar.set_description("Epoch " + str(e+1) + " - Loss: %.4f" % (batch_loss/num_batches))
-            print("Loss at epoch %s: %f" % (e + 1 , batch_loss / num_batches))            
+        X_train: training dataset X, or a `DataLoader` serving (X, one-hot Y) batches (shuffling, transforms,
+            background prefetching). The loader batch size then overrides `batch_size`.
+        Y_train: one-hot encoding label. Unused with a `DataLoader`.
+        workers: (integer) number of processes each mini-batch is split over (data parallelism).
+            Gradients are all-reduced in a fixed order, so the result only depends on `seed`, not on scheduling.
+            Set the BLAS thread count (e.g. OMP_NUM_THREADS) to about cores/workers to avoid oversubscription.
+        seed: (integer) seed of the random generators (weight init, dropout), for reproducible training.
+        micro_batches: (integer) number of slices each mini-batch (or worker shard) is forwarded and backwarded in.
+            Gradients are accumulated over the slices before a single update, so `batch_size` can be larger than
+            what fits in memory at once.
+        """
+        if seed is not None:
+            np.random.seed(seed)
+        if isinstance(X_train, DataLoader):
+            assert workers == 1, "Data-parallel workers slice the training arrays themselves, pass arrays instead."
+            loader = X_train
+        else:
+            loader = DataLoader(X_train, Y_train, self.batch_size, prefetch=0)
+        if workers > 1 and not self.registry.built:
+            # initialize the weights in the main process so every worker shares them.
+            self._forward(self.policy.cast(X_train[:self.batch_size]))
+            self.registry.build(self._trainable_layers())
+        parallel = DataParallel(self, X_train, Y_train, workers, seed, micro_batches) if workers > 1 else None
+        try:
+            for e in range(self.epochs):
+                batch_loss = 0
+                num_batches = 0
+                batches = range(0, X_train.shape[0], self.batch_size) if parallel is not None else loader
+                pbar = tqdm(batches, desc="Epoch " + str(e+1))
+                for batch in pbar:
+                    if parallel is not None:
+                        loss = parallel.step(batch)
+                    else:
+                        loss = self._compute_gradients(*batch, micro_batches=micro_batches)
+                        self.apply_gradients()
+                    batch_loss += loss
+                    num_batches += 1
+                    pbar.set_description("Epoch " + str(e+1) + " - Loss: %.4f" % (batch_loss/num_batches))
+                print("Loss at epoch %s: %f" % (e + 1 , batch_loss / num_batches))
+        finally:
+            if parallel is not None:
+                parallel.close()
+
+    def _compute_gradients(self, X_batch, Y_batch, micro_batches=1):
+        """
+        Forward and backward one mini-batch, split in `micro_batches` slices, accumulating the gradients
+        of every slice weighted by its share of the mini-batch. The weights are not updated.
+
+        Returns
+        -------
+        Loss of the mini-batch.
+        """
+        loss = 0
+        for X_micro, Y_micro in zip(np.array_split(X_batch, micro_batches), np.array_split(Y_batch, micro_batches)):
+            if X_micro.shape[0] == 0:
+                continue
+            scale = X_micro.shape[0]/X_batch.shape[0]
+            X_micro = self.policy.cast(X_micro)
+            Y_micro = self.policy.cast(Y_micro)
+            Y_hat = self._forward(X_micro)
+            if not self.registry.built:
+                self.registry.build(self._trainable_layers())
+            self._backward(Y_micro, Y_hat, X_micro, scale)
+            loss += scale*self._loss(Y_micro, self.policy.compute(Y_hat))
+        return loss
+
+    def apply_gradients(self):
+        """
+        Update all weights with the accumulated gradients in one optimizer step and reset the gradients.
+        """
+        self.registry.step()
 
     def predict(self, test_X):
         """
         Predict function.
         """
-        y_hat = self._forward(test_X, prediction=True)
+        y_hat = self._forward(self.policy.cast(test_X), prediction=True)
         return np.argmax(y_hat, axis=1)
 
     def save(self, name):
         import pickle
         with open(name, "wb") as f:
-            pickle.dump(self, f, pickle.HIGHEST_PROTOCOL)
\ No newline at end of file
+            pickle.dump(self, f, pickle.HIGHEST_PROTOCOL)
+
+    def save_weights(self, path):
+        """
+        Checkpoint all weights and buffers (batch norm statistics) of the model in a single .npz write.
+        """
+        assert self.registry.built, "Model must be trained before saving weights."
+        self.registry.save(path)
+
+    def load_weights(self, path):
+        """
+        Load weights saved by `save_weights` into a model of the same architecture.
+        """
+        assert self.registry.built, "Model parameters must be initialized (by a forward pass) before loading weights."
+        self.registry.load(path)
+
+    def __setstate__(self, state):
+        # pickle stores the views of the flat buffer as separate arrays, point them back to the buffer.
+        self.__dict__.update(state)
+        if "registry" in state and self.registry.built:
+            self.registry.bind()
\ No newline at end of file
@@ -49,4 +49,4 @@ def relu_grad(z):
         g'(z) = 0 if g(z) <= 0
         g'(z) = 1 if g(z) > 0
     """
-    return 1*(z > 0)
\ No newline at end of file
+    return (z > 0).astype(z.dtype)
\ No newline at end of file
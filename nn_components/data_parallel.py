@@ -0,0 +1,168 @@
+import multiprocessing as mp
+from multiprocessing import shared_memory
+import queue
+import traceback
+import numpy as np
+
+
+def _shard(it, batch_size, num_data, workers, rank):
+    """
+    Range [start, end) of the mini-batch starting at `it` that worker `rank` computes.
+    """
+    end = min(it + batch_size, num_data)
+    sizes = np.full(workers, (end - it) // workers)
+    sizes[:(end - it) % workers] += 1
+    start = it + int(np.sum(sizes[:rank]))
+    return start, start + int(sizes[rank])
+
+
+def _attach(names, shapes, dtypes):
+    """
+    Attach to shared memory blocks by name and view them as numpy arrays.
+    """
+    blocks = [shared_memory.SharedMemory(name=name) for name in names]
+    arrays = [np.ndarray(shape, dtype=dtype, buffer=block.buf) for block, shape, dtype in zip(blocks, shapes, dtypes)]
+    return blocks, arrays
+
+
+def _worker(rank, model, X_train, Y_train, workers, seed, micro_batches, names, shapes, dtypes, commands, results):
+    """
+    Worker process: forward and backward its shard of every mini-batch with the shared weights,
+    write the gradients to its own row of the shared gradient buffer.
+    An exception is sent to the main process as (rank, None, traceback) and stops the worker.
+    """
+    blocks, (params, grads, buffers) = _attach(names, shapes, dtypes)
+    registry = model.registry
+    registry.params, registry.grads, registry.buffers = params, grads[rank], buffers[rank]
+    registry.bind()
+    # forked workers inherit the generator state of the main process: without a seed, reseed from the OS
+    # so the workers don't draw the same dropout masks.
+    np.random.seed(None if seed is None else seed + rank + 1)
+    try:
+        while True:
+            it = commands.get()
+            if it is None:
+                break
+            start, end = _shard(it, model.batch_size, X_train.shape[0], workers, rank)
+            if start == end:
+                results.put((rank, 0, 0.0))
+                continue
+            registry.zero_grad()
+            loss = model._compute_gradients(X_train[start:end], Y_train[start:end], micro_batches)
+            results.put((rank, end - start, loss))
+    except Exception:
+        results.put((rank, None, traceback.format_exc()))
+    finally:
+        for block in blocks:
+            block.close()
+
+
+class DataParallel:
+
+    def __init__(self, model, X_train, Y_train, workers, seed=None, micro_batches=1):
+        """
+        Data-parallel training of a NeuralNetwork/CNN with a pool of worker processes.
+        The weights live in shared memory. At each step, every worker computes the gradients of its shard of
+        the mini-batch, the gradients are all-reduced (in a fixed order, so training is deterministic given a seed)
+        and a single optimizer step updates the shared weights. Batch norm moving averages are averaged over
+        the workers after each step.
+
+        Parameters
+        ----------
+        model: (object) NeuralNetwork with its parameter registry already built.
+        X_train: training dataset X.
+        Y_train: one-hot encoding label.
+        workers: (integer) number of worker processes.
+        seed: (integer) seed of the workers random generators (dropout).
+        micro_batches: (integer) number of slices each worker accumulates its shard gradients over.
+        """
+        assert model.registry.built, "Model parameters must be initialized before data-parallel training."
+        self.model = model
+        self.workers = workers
+        registry = model.registry
+        shapes = [registry.params.shape, (workers,) + registry.grads.shape, (workers,) + registry.buffers.shape]
+        dtypes = [registry.params.dtype, registry.grads.dtype, registry.buffers.dtype]
+        self.blocks = [shared_memory.SharedMemory(create=True, size=max(int(np.prod(shape))*np.dtype(dtype).itemsize, 1))
+                       for shape, dtype in zip(shapes, dtypes)]
+        names = [block.name for block in self.blocks]
+        params, self.worker_grads, self.worker_buffers = [np.ndarray(shape, dtype=dtype, buffer=block.buf) for block, shape, dtype
+                                                          in zip(self.blocks, shapes, dtypes)]
+        params[...] = registry.params
+        self.worker_buffers[...] = registry.buffers
+        registry.params = params
+        registry.bind()
+
+        context = mp.get_context("fork" if "fork" in mp.get_all_start_methods() else "spawn")
+        self.commands = [context.Queue() for _ in range(workers)]
+        self.results = context.Queue()
+        self.processes = [context.Process(target=_worker, args=(rank, model, X_train, Y_train, workers, seed, micro_batches,
+                                                                names, shapes, dtypes, self.commands[rank], self.results),
+                                          daemon=True)
+                          for rank in range(workers)]
+        for process in self.processes:
+            process.start()
+
+    def step(self, it):
+        """
+        Train on the mini-batch starting at index `it`.
+
+        Returns
+        -------
+        Loss of the mini-batch.
+        """
+        for commands in self.commands:
+            commands.put(it)
+        sizes = np.zeros(self.workers)
+        losses = np.zeros(self.workers)
+        for _ in range(self.workers):
+            rank, size, loss = self._result()
+            sizes[rank], losses[rank] = size, loss
+        # all-reduce: each worker gradient is the mean over its shard, weight it by its share of the mini-batch.
+        registry = self.model.registry
+        weights = sizes / np.sum(sizes)
+        registry.grads[...] = 0
+        active = [rank for rank in range(self.workers) if sizes[rank] > 0]
+        for rank in active:
+            registry.grads += weights[rank]*self.worker_grads[rank]
+        registry.step()
+        registry.buffers[...] = np.mean(self.worker_buffers[active], axis=0)
+        self.worker_buffers[...] = registry.buffers
+        return np.sum(weights*losses)
+
+    def _result(self, poll=1.0):
+        """
+        Next worker result. Waits `poll` seconds at a time and checks between waits that the workers are alive,
+        so a failed or killed worker raises instead of blocking the training forever.
+        """
+        while True:
+            try:
+                rank, size, loss = self.results.get(timeout=poll)
+            except queue.Empty:
+                dead = [(rank, process.exitcode) for rank, process in enumerate(self.processes)
+                        if not process.is_alive()]
+                if dead:
+                    raise RuntimeError("Data-parallel worker %d exited with code %s." % dead[0])
+                continue
+            if size is None:
+                raise RuntimeError("Data-parallel worker %d failed:\n%s" % (rank, loss))
+            return rank, size, loss
+
+    def close(self, timeout=10):
+        """
+        Stop the workers and move the weights out of shared memory. Workers still running after `timeout`
+        seconds are terminated.
+        """
+        for commands in self.commands:
+            commands.put(None)
+        for process in self.processes:
+            process.join(timeout)
+            if process.is_alive():
+                process.terminate()
+                process.join()
+        registry = self.model.registry
+        registry.params = registry.params.copy()
+        registry.bind()
+        self.worker_grads = self.worker_buffers = None
+        for block in self.blocks:
+            block.close()
+            block.unlink()
@@ -1,6 +1,7 @@
 import numpy as np
 from nn_components.initializers import he_normal, xavier_normal, standard_normal, he_uniform, xavier_uniform
 from nn_components.activations import relu, sigmoid, tanh, softmax, relu_grad, sigmoid_grad, tanh_grad
+from nn_components.precision import Policy
 import copy
 initialization_mapping = {"he_normal": he_normal, "xavier_normal": xavier_normal, "std": standard_normal,
                           "he_uniform": he_uniform, "xavier_uniform": xavier_uniform}
@@ -8,11 +9,24 @@ initialization_mapping = {"he_normal": he_normal, "xavier_normal": xavier_normal
 
 class Layer:
 
+    policy = Policy("float64")
+    # names of the trainable parameters and of the non-trainable state arrays of the layer.
+    trainable_params = ()
+    buffers = ()
+    # gradient views into a model's flat gradient buffer, see `ParameterRegistry`.
+    grads = None
+
     def initialize_optimizer(self, optimizer):
         """
-        optimizer: (object) optimizer uses to optimize the loss function.
+        optimizer: (object) optimizer uses to optimize the loss function. Each trainable parameter gets its own copy.
+        """
+        self.optimizers = {name: copy.copy(optimizer) for name in self.trainable_params}
+
+    def initialize_policy(self, policy):
+        """
+        policy: (object) dtype policy of weights/activations (storage) and gradients/optimizer state (compute).
         """
-        self.optimizer = copy.copy(optimizer)
+        self.policy = policy
 
     def forward(self, X):
         raise NotImplementedError("Child class must implement forward() function")
@@ -20,6 +34,28 @@ class Layer:
     def backward(self):
         raise NotImplementedError("Child class must implement backward() function")
 
+    def _accumulate_gradient(self, name, grad):
+        """
+        Add `grad` to the gradient of parameter `name`. Backward passes only accumulate gradients,
+        the parameters are updated by `apply_gradients` (or by the model's `ParameterRegistry`).
+        """
+        if self.grads is None:
+            self.grads = {}
+        if name not in self.grads:
+            self.grads[name] = np.zeros(shape=getattr(self, name).shape, dtype=self.policy.compute_dtype)
+        self.grads[name] += grad
+
+    def apply_gradients(self):
+        """
+        Update each trainable parameter by its own optimizer with its accumulated gradient, then reset the gradient.
+        Not needed for layers bound to a `ParameterRegistry`, the registry updates all parameters at once.
+        """
+        for name in self.trainable_params:
+            if self.grads is None or name not in self.grads:
+                continue
+            self.optimizers[name].step(getattr(self, name), self.grads[name])
+            self.grads[name][...] = 0
+
 
 class CNNLayer(Layer):
 
@@ -42,6 +78,8 @@ class CNNLayer(Layer):
 
 class FCLayer(Layer):
 
+    trainable_params = ("W",)
+
     def __init__(self, num_neurons, weight_init="std"):
         """
         The fully connected layer.
@@ -71,13 +109,15 @@ class FCLayer(Layer):
         output: Output value LINEAR of the current layer.
         """
         if self.W is None:
-            self.W = initialization_mapping[self.weight_init](weight_shape=(inputs.shape[1], self.num_neurons))
-        self.output = inputs.dot(self.W)
+            self.W = initialization_mapping[self.weight_init](weight_shape=(inputs.shape[1], self.num_neurons),
+                                                              dtype=self.policy.storage_dtype)
+        output = self.policy.compute(inputs).dot(self.policy.compute(self.W))
+        self.output = self.policy.cast(output)
         return self.output
 
     def backward(self, d_prev, prev_layer):
         """
-        Layer backward level. Compute gradient respect to W and update it.
+        Layer backward level. Compute gradient respect to W and accumulate it.
         Also compute gradient respect to X for computing gradient of previous
         layers as the forward direction [l-1].
 
@@ -90,23 +130,43 @@ class FCLayer(Layer):
         -------
         d_prev: gradient of J respect to A[l] at the current layer.
         """
+        d_prev = self.policy.compute(d_prev)
         if type(prev_layer) is np.ndarray:
-            grad = prev_layer.T.dot(d_prev)
-            self.update_params(grad)
+            grad = self.policy.compute(prev_layer).T.dot(d_prev)
+            self._accumulate_gradient("W", grad)
             return None
-        grad = prev_layer.output.T.dot(d_prev)
-        self.update_params(grad)
-        d_prev = d_prev.dot(self.W.T)
+        grad = self.policy.compute(prev_layer.output).T.dot(d_prev)
+        self._accumulate_gradient("W", grad)
+        d_prev = d_prev.dot(self.policy.compute(self.W).T)
         return d_prev
 
-    def update_params(self, grad):
-        updated_grad = self.optimizer.minimize(grad)
-        self.W -= updated_grad
+class ConvLayer(CNNLayer):
 
+    trainable_params = ("W",)
 
-class ConvLayer(CNNLayer):
+    _backends = {"einsum": ("_conv_op_einsum", "_conv_op_backward_einsum"),
+                 "gemm": ("_conv_op_gemm", "_conv_op_backward_gemm")}
+
+    _algorithms = {"direct": ("_forward_direct", "_backward_direct"),
+                   "fft": ("_forward_fft", "_backward_fft"),
+                   "winograd": ("_forward_winograd", "_backward_winograd")}
 
-    def __init__(self, filter_size, filters, padding='SAME', stride=1, weight_init="std"):
+    # Heuristic table of `algorithm='auto'`, the first matching row wins:
+    #   (filter size or None for any, minimum filter area, minimum in_filters, maximum stride, algorithm)
+    # Winograd only pays off its transforms with enough channels, FFT with large filters.
+    _auto_table = [((3, 3), 9, 64, 1, "winograd"),
+                   (None, 49, 1, 1, "fft"),
+                   (None, 0, 1, float("inf"), "direct")]
+    # Choice of `algorithm='auto'` per (padded input shape, filter shape, stride).
+    _auto_cache = {}
+
+    # Winograd F(2x2, 3x3) transforms: Y = A^T [(G g G^T) * (B^T d B)] A
+    _winograd_BT = np.array([[1, 0, -1, 0], [0, 1, 1, 0], [0, -1, 1, 0], [0, 1, 0, -1]], dtype=np.float64)
+    _winograd_G = np.array([[1, 0, 0], [0.5, 0.5, 0.5], [0.5, -0.5, 0.5], [0, 0, 1]], dtype=np.float64)
+    _winograd_AT = np.array([[1, 1, 1, 0], [0, 1, -1, -1]], dtype=np.float64)
+
+    def __init__(self, filter_size, filters, padding='SAME', stride=1, weight_init="std", backend="gemm",
+                 algorithm="direct"):
         """
         The convolutional layer.
 
@@ -118,15 +178,25 @@ class ConvLayer(CNNLayer):
                     either 'SAME' or 'VALID'.
         stride: stride of the filters.
         weight_init: (string) either `he_normal`, `xavier_normal`, `he_uniform`, `xavier_uniform` or standard normal distribution.
+        backend: (string) how the convolution is computed, either `gemm` (im2col + one matrix multiplication)
+                    or `einsum` (contraction over the strided view). Used by the `direct` algorithm.
+        algorithm: (string) convolution algorithm, either `direct`, `fft` (numpy.fft, suits large filters),
+                    `winograd` (F(2x2, 3x3), only 3x3 filters with stride 1) or `auto` (choose by input and filter shape).
         """
         assert len(filter_size) == 2, "Filter size must be a 2-elements tuple (width, height)."
         assert weight_init in ["std", "he_normal", "xavier_normal", "he_uniform", "xavier_uniform"],\
                      "Unknow weight initialization type."
+        assert backend in self._backends, "Unknown convolution backend: " + str(backend)
+        assert algorithm in list(self._algorithms.keys()) + ["auto"], "Unknown convolution algorithm: " + str(algorithm)
+        assert algorithm != "winograd" or (tuple(filter_size) == (3, 3) and stride == 1),\
+                     "Winograd algorithm only supports 3x3 filters with stride 1."
         self.filter_size = filter_size
         self.filters = filters
         self.padding = padding
         self.stride = stride
         self.weight_init = weight_init
+        self.backend = backend
+        self.algorithm = algorithm
         self.W = None
 
     def _conv_op(self, input_, kernel):
@@ -142,7 +212,7 @@ class ConvLayer(CNNLayer):
         -------
         Output shape = (m, oH, oW, out_filters)
         """
-        return np.einsum("bwhijk,ijkl->bwhl", input_, kernel)
+        return getattr(self, self._backends[self.backend][0])(input_, kernel)
 
     def _conv_op_backward(self, input_, d_prev, update_params=True):
         """
@@ -163,18 +233,249 @@ class ConvLayer(CNNLayer):
         else:
             Derivative with respect to X, shape = (m, oH, oW, fH, fW, in_filters)
         """
+        return getattr(self, self._backends[self.backend][1])(input_, d_prev, update_params)
+
+    def _conv_op_einsum(self, input_, kernel):
+        """
+        Convolution as an einsum contraction over the strided view.
+        """
+        return np.einsum("bwhijk,ijkl->bwhl", input_, kernel)
+
+    def _conv_op_backward_einsum(self, input_, d_prev, update_params=True):
+        """
+        Convolutional backward operation as an einsum contraction.
+        """
         operation = "bwhijk,bwhl->ijkl" if update_params else "ijkl,bwhl->bwhijk"
         return np.einsum(operation, input_, d_prev)
 
-    def _pad_input(self, inp):
+    def _im2col(self, input_):
         """
-        Pad the input when using padding mode 'SAME'.
+        Lower the strided view into a contiguous matrix, each row is one receptive field.
+
+        Parameters
+        ----------
+        input_: Input, shape = (m, oH, oW, fH, fW, in_filters)
+
+        Returns
+        -------
+        Patch matrix, shape = (m*oH*oW, fH*fW*in_filters)
+        """
+        m, oH, oW, fH, fW, iC = input_.shape
+        return np.reshape(input_, (m*oH*oW, fH*fW*iC))
+
+    def _conv_op_gemm(self, input_, kernel):
+        """
+        Convolution as im2col followed by a single matrix multiplication:
+            (m*oH*oW, fH*fW*iC) x (fH*fW*iC, oC)
+        """
+        m, oH, oW, _, _, _ = input_.shape
+        fH, fW, iC, oC = kernel.shape
+        output = self._im2col(input_).dot(np.reshape(kernel, (fH*fW*iC, oC)))
+        return np.reshape(output, (m, oH, oW, oC))
+
+    def _conv_op_backward_gemm(self, input_, d_prev, update_params=True):
+        """
+        Convolutional backward operation as a single matrix multiplication.
+            dW = cols.T x d_prev                => (fH*fW*iC, m*oH*oW) x (m*oH*oW, oC)
+            dX = d_prev x W.T                   => (m*oH*oW, oC) x (oC, fH*fW*iC)
+        """
+        m, oH, oW, oC = d_prev.shape
+        d_prev = np.reshape(d_prev, (m*oH*oW, oC))
+        if update_params:
+            fH, fW, iC = input_.shape[3:]
+            dW = self._im2col(input_).T.dot(d_prev)
+            return np.reshape(dW, (fH, fW, iC, oC))
+        fH, fW, iC, _ = input_.shape
+        dX = d_prev.dot(np.reshape(input_, (fH*fW*iC, oC)).T)
+        return np.reshape(dX, (m, oH, oW, fH, fW, iC))
+
+    def _col2im(self, d_cols, input_shape):
+        """
+        Scatter-add the gradient of every receptive field back to the input, the inverse of `_split_X`.
+        Loop over the fH*fW kernel offsets, each offset adds one strided slice for all output pixels at once.
+
+        Parameters
+        ----------
+        d_cols: Derivative with respect to the strided view, shape = (m, oH, oW, fH, fW, in_filters)
+        input_shape: shape of the (padded) input, (m, iH, iW, in_filters)
+
+        Returns
+        -------
+        Derivative with respect to the input, shape = input_shape
+        """
+        _, oH, oW, fH, fW, _ = d_cols.shape
+        dA = np.zeros(shape=input_shape, dtype=d_cols.dtype)
+        h_end = (oH - 1)*self.stride + 1
+        w_end = (oW - 1)*self.stride + 1
+        for i in range(fH):
+            for j in range(fW):
+                dA[:, i:i+h_end:self.stride, j:j+w_end:self.stride, :] += d_cols[:, :, :, i, j, :]
+        return dA
+
+    def _get_algorithm(self, input_shape):
+        """
+        Resolve the convolution algorithm. In `auto` mode, look up `_auto_table` once per shape and cache the choice.
+
+        Parameters
+        ----------
+        input_shape: shape of the (padded) input, (m, iH, iW, in_filters)
+        """
+        if self.algorithm != "auto":
+            return self.algorithm
+        fH, fW = self.filter_size
+        key = (input_shape[1:], (fH, fW, self.filters), self.stride)
+        if key not in self._auto_cache:
+            for filter_size, min_area, min_channels, max_stride, algorithm in self._auto_table:
+                if (filter_size is None or filter_size == (fH, fW)) and fH*fW >= min_area and \
+                        input_shape[-1] >= min_channels and self.stride <= max_stride:
+                    self._auto_cache[key] = algorithm
+                    break
+        return self._auto_cache[key]
+
+    def _forward_direct(self, X, W):
+        """
+        Direct convolution over the strided view of the (padded) input X, shape = (m, iH, iW, in_filters).
+        """
+        return self._conv_op(self._split_X(X), W)
+
+    def _backward_direct(self, X, W, d_prev):
+        """
+        Direct convolution backward.
+
+        Parameters
+        ----------
+        X: the (padded) input of the layer, shape = (m, iH, iW, in_filters)
+        W: the filters, shape = (fH, fW, in_filters, out_filters)
+        d_prev: Derivative of previous layer. shape = (m, oH, oW, out_filters)
+
+        Returns
+        -------
+        Derivative with respect to X, shape = (m, iH, iW, in_filters)
+        Derivative with respect to W, shape = (fH, fW, in_filters, out_filters)
+        """
+        dW = self._conv_op_backward(self._split_X(X), d_prev, update_params=True)
+        d_cols = self._conv_op_backward(W, d_prev, update_params=False)
+        return self._col2im(d_cols, X.shape), dW
+
+    def _dilate(self, d_prev, oH, oW):
+        """
+        Spread `d_prev` over the stride-1 output grid (oH, oW) with zeros between strided positions.
+        """
+        if self.stride == 1:
+            return d_prev
+        m, _, _, oC = d_prev.shape
+        d_dilated = np.zeros(shape=(m, oH, oW, oC), dtype=d_prev.dtype)
+        d_dilated[:, ::self.stride, ::self.stride, :] = d_prev
+        return d_dilated
+
+    def _forward_fft(self, X, W):
+        """
+        Convolution (cross-correlation) in the frequency domain. With the FFT size equal to the input size (iH, iW),
+        the circular correlation doesn't wrap around for the valid output positions:
+            Y_f = X_f x conj(W_f)               => a (m, iC) x (iC, oC) product at every frequency
+        Strided output is the stride-1 output subsampled.
+        """
+        _, iH, iW, _ = X.shape
+        fH, fW = self.filter_size
+        X_f = np.fft.rfft2(X, s=(iH, iW), axes=(1, 2))
+        W_f = np.fft.rfft2(W, s=(iH, iW), axes=(0, 1))
+        Y_f = np.matmul(X_f.transpose(1, 2, 0, 3), np.conj(W_f)).transpose(2, 0, 1, 3)
+        Y = np.fft.irfft2(Y_f, s=(iH, iW), axes=(1, 2))
+        return Y[:, :iH-fH+1:self.stride, :iW-fW+1:self.stride, :].astype(X.dtype)
+
+    def _backward_fft(self, X, W, d_prev):
+        """
+        Convolution backward in the frequency domain, d_prev is dilated back to the stride-1 output grid first.
+            dW_f = X_f x conj(dY_f)             => a (iC, m) x (m, oC) product at every frequency
+            dX_f = dY_f x W_f                   => a (m, oC) x (oC, iC) product at every frequency
+        """
+        _, iH, iW, _ = X.shape
+        fH, fW = self.filter_size
+        d_prev = self._dilate(d_prev, iH-fH+1, iW-fW+1)
+        X_f = np.fft.rfft2(X, s=(iH, iW), axes=(1, 2))
+        W_f = np.fft.rfft2(W, s=(iH, iW), axes=(0, 1))
+        dY_f = np.fft.rfft2(d_prev, s=(iH, iW), axes=(1, 2)).transpose(1, 2, 0, 3)
+        dW_f = np.matmul(X_f.transpose(1, 2, 3, 0), np.conj(dY_f))
+        dW = np.fft.irfft2(dW_f, s=(iH, iW), axes=(0, 1))[:fH, :fW]
+        dX_f = np.matmul(dY_f, W_f.transpose(0, 1, 3, 2)).transpose(2, 0, 1, 3)
+        dX = np.fft.irfft2(dX_f, s=(iH, iW), axes=(1, 2))
+        return dX.astype(d_prev.dtype), dW.astype(d_prev.dtype)
+
+    def _winograd_tiles(self, X):
+        """
+        Split the (padded) input into overlapping 4x4 tiles with step 2, one tile per 2x2 output block.
+
+        Returns
+        -------
+        Tiles, shape = (m, nH, nW, 4, 4, in_filters)
+        """
+        m, iH, iW, iC = X.shape
+        nH, nW = (iH - 1)//2, (iW - 1)//2
+        X = np.pad(X, ((0, 0), (0, 2*nH + 2 - iH), (0, 2*nW + 2 - iW), (0, 0)), 'constant')
+        batch_strides, height_strides, width_strides, channel_strides = X.strides
+        return np.lib.stride_tricks.as_strided(X, shape=(m, nH, nW, 4, 4, iC),
+                                               strides=(batch_strides, 2*height_strides, 2*width_strides,
+                                                        height_strides, width_strides, channel_strides),
+                                               writeable=False)
+
+    def _forward_winograd(self, X, W):
+        """
+        Winograd F(2x2, 3x3) convolution. Each 4x4 input tile and the filter are transformed, multiplied as
+        16 independent (tiles, iC) x (iC, oC) products, then transformed back to a 2x2 output block.
+        """
+        BT, G, AT = [T.astype(X.dtype) for T in (self._winograd_BT, self._winograd_G, self._winograd_AT)]
+        m, iH, iW, iC = X.shape
+        oC = self.filters
+        tiles = self._winograd_tiles(X)
+        _, nH, nW, _, _, _ = tiles.shape
+        V = np.einsum("ik,bhwklc,jl->ijbhwc", BT, tiles, BT, optimize=True).reshape((16, m*nH*nW, iC))
+        U = np.einsum("ik,klco,jl->ijco", G, W, G, optimize=True).reshape((16, iC, oC))
+        M = np.matmul(V, U).reshape((4, 4, m, nH, nW, oC))
+        Y = np.einsum("ik,klbhwo,jl->bhiwjo", AT, M, AT, optimize=True).reshape((m, 2*nH, 2*nW, oC))
+        return Y[:, :iH-2, :iW-2, :]
+
+    def _backward_winograd(self, X, W, d_prev):
+        """
+        Winograd F(2x2, 3x3) convolution backward, the adjoint of every step of `_forward_winograd`:
+            dM = A dY A^T,  dU = V^T x dM,  dV = dM x U^T,  dW = G^T dU G,  d_tiles = B dV B^T
+        then the overlapping tiles are scatter-added back to the input.
+        """
+        BT, G, AT = [T.astype(X.dtype) for T in (self._winograd_BT, self._winograd_G, self._winograd_AT)]
+        m, iH, iW, iC = X.shape
+        oC = self.filters
+        tiles = self._winograd_tiles(X)
+        _, nH, nW, _, _, _ = tiles.shape
+        V = np.einsum("ik,bhwklc,jl->ijbhwc", BT, tiles, BT, optimize=True).reshape((16, m*nH*nW, iC))
+        U = np.einsum("ik,klco,jl->ijco", G, W, G, optimize=True).reshape((16, iC, oC))
+        dY = np.pad(d_prev, ((0, 0), (0, 2*nH - (iH-2)), (0, 2*nW - (iW-2)), (0, 0)), 'constant')
+        dY = dY.reshape((m, nH, 2, nW, 2, oC))
+        dM = np.einsum("ki,bhkwlo,lj->ijbhwo", AT, dY, AT, optimize=True).reshape((16, m*nH*nW, oC))
+        dU = np.matmul(V.transpose(0, 2, 1), dM).reshape((4, 4, iC, oC))
+        dW = np.einsum("ki,klco,lj->ijco", G, dU, G, optimize=True)
+        dV = np.matmul(dM, U.transpose(0, 2, 1)).reshape((4, 4, m, nH, nW, iC))
+        d_tiles = np.einsum("ki,klbhwc,lj->bhwijc", BT, dV, BT, optimize=True)
+        dX = np.zeros(shape=(m, 2*nH + 2, 2*nW + 2, iC), dtype=d_tiles.dtype)
+        for i in range(4):
+            for j in range(4):
+                dX[:, i:i+2*nH:2, j:j+2*nW:2, :] += d_tiles[:, :, :, i, j, :]
+        return dX[:, :iH, :iW, :], dW
+
+    def _padding_size(self, iH, iW):
+        """
+        Number of zeros `_pad_input` adds before (pH) and after (pW) each spatial axis in padding mode 'SAME'.
         """
-        m, iH, iW, iC = inp.shape
         fH, fW = self.filter_size
         oH, oW = iH, iW
         pH = int(((oH - 1)*self.stride + fH - iH)/2)
         pW = int(((oW - 1)*self.stride + fW - iW)/2)
+        return pH, pW
+
+    def _pad_input(self, inp):
+        """
+        Pad the input when using padding mode 'SAME'.
+        """
+        m, iH, iW, iC = inp.shape
+        pH, pW = self._padding_size(iH, iW)
         X = np.pad(inp, ((0, 0), (pH, pW), (pH, pW), (0, 0)), 'constant')
         return X
 
@@ -196,11 +497,13 @@ class ConvLayer(CNNLayer):
         """
         assert len(X.shape) == 4, "The shape of input image must be a 4-elements tuple (batch_size, height, width, channel)."
         if self.W is None:
-            self.W = initialization_mapping[self.weight_init](weight_shape=self.filter_size + (X.shape[-1], self.filters))
+            self.W = initialization_mapping[self.weight_init](weight_shape=self.filter_size + (X.shape[-1], self.filters),
+                                                              dtype=self.policy.storage_dtype)
+        X = self.policy.compute(X)
         if self.padding == "SAME":
             X = self._pad_input(X)
-        X = self._split_X(X)
-        self.output = self._conv_op(X, self.W)
+        forward_op = self._algorithms[self._get_algorithm(X.shape)][0]
+        self.output = self.policy.cast(getattr(self, forward_op)(X, self.policy.compute(self.W)))
         return self.output
 
     def backward(self, d_prev, prev_layer):
@@ -214,33 +517,20 @@ class ConvLayer(CNNLayer):
         
         """
         X = prev_layer.output if type(prev_layer) is not np.ndarray else prev_layer
+        X = self.policy.compute(X)
+        _, iH, iW, _ = X.shape
         if self.padding == "SAME":
             X = self._pad_input(X)
-        _, iH, iW, _ = X.shape
-        m, oH, oW, oC = d_prev.shape
-        fH, fW = self.filter_size
-        dA = np.zeros(shape=(X.shape))
-        X = self._split_X(X)
-        dW = self._conv_op_backward(X, d_prev, update_params=True)
-        dA_temp = self._conv_op_backward(self.W, d_prev, update_params=False)
-        for h in range(oH):
-            for w in range(oW):
-                h_step = h*self.stride
-                w_step = w*self.stride
-                dA[:,  h_step:h_step+fH, w_step:w_step+fW, :] += dA_temp[:, h, w, :, :, :]
+        backward_op = self._algorithms[self._get_algorithm(X.shape)][1]
+        dA, dW = getattr(self, backward_op)(X, self.policy.compute(self.W), self.policy.compute(d_prev))
         if self.padding == "SAME":
-            offset_h = (iH - oH)//2
-            offset_w = (iW - oW)//2 
-            dA = dA[:, offset_h:-offset_h, offset_w:-offset_w, :]
+            pH, _ = self._padding_size(iH, iW)
+            dA = dA[:, pH:pH+iH, pH:pH+iW, :]
         if hasattr(self, "debug"):
             return dA, dW
-        self.update_params(dW)
+        self._accumulate_gradient("W", dW)
         return dA
 
-    def update_params(self, grad):
-        updated_grad = self.optimizer.minimize(grad)
-        self.W -= updated_grad
-
 
 class PoolingLayer(CNNLayer):
 
@@ -435,6 +725,9 @@ class DropoutLayer(Layer):
 
 class BatchNormLayer(Layer):
 
+    trainable_params = ("gamma", "beta")
+    buffers = ("mu_moving_average", "sigma_moving_average")
+
     def __init__(self, momentum=0.99, epsilon=1e-9):
         self.momentum = momentum
         self.epsilon = epsilon
@@ -449,20 +742,24 @@ class BatchNormLayer(Layer):
         Output values of batch normalization.
         """
         if not hasattr(self, "gamma") and not hasattr(self, "beta"):
-            self.gamma = np.ones(((1,) + X.shape[1:]))
-            self.beta = np.zeros(((1,) + X.shape[1:]))
-            self.mu_moving_average = np.zeros(shape=self.beta.shape)
-            self.sigma_moving_average = np.zeros(shape=self.gamma.shape)
+            self.gamma = np.ones(((1,) + X.shape[1:]), dtype=self.policy.storage_dtype)
+            self.beta = np.zeros(((1,) + X.shape[1:]), dtype=self.policy.storage_dtype)
+            self.mu_moving_average = np.zeros(shape=self.beta.shape, dtype=self.policy.compute_dtype)
+            self.sigma_moving_average = np.zeros(shape=self.gamma.shape, dtype=self.policy.compute_dtype)
+        X = self.policy.compute(X)
         if not prediction:
             self.mu = np.mean(X, axis=0, keepdims=True)
             self.sigma = np.std(X, axis=0, keepdims=True)
-            self.mu_moving_average = self.momentum*(self.mu_moving_average) + (1-self.momentum)*self.mu
-            self.sigma_moving_average = self.momentum*(self.sigma_moving_average) + (1-self.momentum)*self.sigma
+            # in place, the moving averages may be views of a model's flat buffer.
+            self.mu_moving_average *= self.momentum
+            self.mu_moving_average += (1-self.momentum)*self.mu
+            self.sigma_moving_average *= self.momentum
+            self.sigma_moving_average += (1-self.momentum)*self.sigma
         else:
             self.mu = self.mu_moving_average
             self.sigma = self.sigma_moving_average    
         self.Xnorm = (X - self.mu)/np.sqrt(self.sigma + self.epsilon)
-        self.output = self.gamma*self.Xnorm + self.beta
+        self.output = self.policy.cast(self.policy.compute(self.gamma)*self.Xnorm + self.policy.compute(self.beta))
         return self.output
 
     def backward(self, d_prev, prev_layer):
@@ -481,20 +778,17 @@ class BatchNormLayer(Layer):
         dZ: Gradient w.r.t LINEAR function Z.
         """
         m = prev_layer.output.shape[0]
-        dXnorm = d_prev * self.gamma
+        X = self.policy.compute(prev_layer.output)
+        d_prev = self.policy.compute(d_prev)
+        dXnorm = d_prev * self.policy.compute(self.gamma)
         gamma_grad = np.sum(d_prev * self.Xnorm, axis=0, keepdims=True)
         beta_grad = np.sum(d_prev, axis=0, keepdims=True)
-        self.update_params(gamma_grad, beta_grad)
-        dSigma = np.sum(dXnorm * (-((prev_layer.output - self.mu)*(self.sigma+self.epsilon)**(-3/2))/2),
+        self._accumulate_gradient("gamma", gamma_grad)
+        self._accumulate_gradient("beta", beta_grad)
+        dSigma = np.sum(dXnorm * (-((X - self.mu)*(self.sigma+self.epsilon)**(-3/2))/2),
                        axis=0, keepdims=True)
         dMu = np.sum(dXnorm*(-1/np.sqrt(self.sigma+self.epsilon)), axis=0, keepdims=True) +\
-                dSigma*((-2/m)*np.sum(prev_layer.output - self.mu, axis=0, keepdims=True))
+                dSigma*((-2/m)*np.sum(X - self.mu, axis=0, keepdims=True))
         d_prev = dXnorm*(1/np.sqrt(self.sigma+self.epsilon)) + dMu/m +\
-                dSigma*((2/m)*np.sum(prev_layer.output - self.mu, axis=0, keepdims=True))
+                dSigma*((2/m)*np.sum(X - self.mu, axis=0, keepdims=True))
         return d_prev
-
-    def update_params(self, gamma_grad, beta_grad):
-        updated_gamma_grad = self.optimizer.minimize(gamma_grad)
-        updated_beta_grad = self.optimizer.minimize(beta_grad)
-        self.gamma -= updated_gamma_grad
-        self.beta -= updated_beta_grad
\ No newline at end of file
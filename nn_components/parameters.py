@@ -0,0 +1,96 @@
+import copy
+import numpy as np
+
+
+class ParameterRegistry:
+
+    def __init__(self, optimizer, policy):
+        """
+        Registry that packs every trainable tensor of a model into one contiguous flat buffer.
+        Each layer parameter (`W`, `gamma`, `beta`, ...) becomes a view into `params` and its gradient
+        a view into `grads`, so the whole model is updated by a single optimizer step.
+        Non-trainable state (e.g. batch norm moving averages) is packed the same way into `buffers`.
+
+        Parameters
+        ----------
+        optimizer: (object) optimizer uses to optimize the loss function.
+        policy: (object) dtype policy, `params` has the storage dtype and `grads` the compute dtype.
+        """
+        self.optimizer = copy.copy(optimizer)
+        self.policy = policy
+        self.entries = []
+        self.buffer_entries = []
+        self.params = None
+        self.grads = None
+        self.buffers = None
+
+    @property
+    def built(self):
+        return self.params is not None
+
+    def build(self, layers):
+        """
+        Copy the (already initialized) parameters and buffers of `layers` into the flat buffers and bind the layers
+        to views of them.
+        """
+        self.params = self._pack(layers, "trainable_params", self.entries, self.policy.storage_dtype)
+        self.grads = np.zeros(shape=self.params.shape, dtype=self.policy.compute_dtype)
+        self.buffers = self._pack(layers, "buffers", self.buffer_entries, self.policy.compute_dtype)
+        self.bind()
+
+    def _pack(self, layers, kind, entries, dtype):
+        """
+        Copy the arrays listed in attribute `kind` of each layer into a new flat array.
+        Each entry appended to `entries` is a tuple (layer, name, offset, shape).
+        """
+        offset = 0
+        for layer in layers:
+            for name in getattr(layer, kind):
+                array = getattr(layer, name)
+                assert array is not None, "Parameters must be initialized (by a forward pass) before building the registry."
+                entries.append((layer, name, offset, array.shape))
+                offset += array.size
+        flat = np.empty(shape=(offset,), dtype=dtype)
+        for layer, name, offset, shape in entries:
+            flat[offset:offset+int(np.prod(shape))] = np.ravel(getattr(layer, name))
+        return flat
+
+    def bind(self):
+        """
+        Point every registered layer parameter, gradient and buffer to its view in the flat buffers.
+        """
+        for layer, name, offset, shape in self.entries:
+            size = int(np.prod(shape))
+            setattr(layer, name, self.params[offset:offset+size].reshape(shape))
+            if layer.grads is None:
+                layer.grads = {}
+            layer.grads[name] = self.grads[offset:offset+size].reshape(shape)
+        for layer, name, offset, shape in self.buffer_entries:
+            size = int(np.prod(shape))
+            setattr(layer, name, self.buffers[offset:offset+size].reshape(shape))
+
+    def step(self):
+        """
+        One vectorized optimizer update of the whole model with the accumulated gradients, then reset them.
+        """
+        self.optimizer.step(self.params, self.grads)
+        self.zero_grad()
+
+    def zero_grad(self):
+        self.grads[...] = 0
+
+    def save(self, path):
+        """
+        Checkpoint all parameters and buffers (e.g. batch norm moving averages) of the model as two arrays of one
+        .npz file, written at `path` as is.
+        """
+        with open(path, "wb") as f:
+            np.savez(f, params=self.params, buffers=self.buffers)
+
+    def load(self, path):
+        with np.load(path) as checkpoint:
+            params, buffers = checkpoint["params"], checkpoint["buffers"]
+        assert params.shape == self.params.shape and buffers.shape == self.buffers.shape, \
+            "Checkpoint doesn't match the model parameters."
+        self.params[...] = params
+        self.buffers[...] = buffers
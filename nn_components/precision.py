@@ -0,0 +1,36 @@
+import numpy as np
+
+# name: (storage dtype of weights/activations, compute dtype of matmuls/gradients/optimizer state)
+_policies = {"float64": (np.float64, np.float64),
+             "float32": (np.float32, np.float32),
+             "mixed_float16": (np.float16, np.float32)}
+
+
+class Policy:
+
+    def __init__(self, name="float32"):
+        """
+        Floating point policy of a model.
+
+        Parameters
+        ----------
+        name: (string) either `float64`, `float32` or `mixed_float16` (float16 storage, float32 accumulate).
+        """
+        assert name in _policies, "Unknown dtype policy: " + str(name)
+        self.name = name
+        self.storage_dtype, self.compute_dtype = _policies[name]
+
+    def cast(self, X):
+        """
+        Cast X to the storage dtype, without copy if it already is.
+        """
+        return X.astype(self.storage_dtype, copy=False)
+
+    def compute(self, X):
+        """
+        Cast X to the compute dtype, without copy if it already is.
+        """
+        return X.astype(self.compute_dtype, copy=False)
+
+    def __repr__(self):
+        return "Policy(%s)" % self.name
@@ -13,27 +13,62 @@ class _Optimizers:
     def minimize(self, grad):
         raise NotImplementedError("Child class must implement minimize() function")
 
+    def step(self, param, grad):
+        """
+        Update `param` in place with `grad`. Child classes fuse the update with `out=` ufuncs
+        into preallocated buffers, so a step doesn't allocate any array.
+        """
+        param -= self.minimize(grad)
+
+    def _buffer(self, name, param, grad):
+        """
+        Get the state/scratch buffer `name`, allocated once with the shape of `param` and the dtype of `grad`.
+        """
+        buffer = getattr(self, name)
+        if buffer is None or buffer.shape != param.shape:
+            buffer = np.zeros(shape=param.shape, dtype=np.result_type(grad))
+            setattr(self, name, buffer)
+        return buffer
+
 class SGD(_Optimizers):
 
     def __init__(self, alpha=0.01):
         self.alpha = alpha
+        self.scratch = None
 
     def minimize(self, grad):
         return self.alpha*grad
 
+    def step(self, param, grad):
+        scratch = self._buffer("scratch", param, grad)
+        np.multiply(grad, self.alpha, out=scratch)
+        np.subtract(param, scratch, out=param)
+
 class SGDMomentum(_Optimizers):
 
     def __init__(self, alpha=0.01, beta=0.9):
         self.alpha = alpha
         self.beta = beta
         self.v = None
+        self.scratch = None
 
     def minimize(self, grad):
         if self.v is None:
-            self.v = np.zeros(shape=grad.shape)
+            self.v = np.zeros_like(grad)
         self.v = self.beta*self.v + (1-self.beta)*grad
         return self.alpha * self.v
 
+    def step(self, param, grad):
+        v = self._buffer("v", param, grad)
+        scratch = self._buffer("scratch", param, grad)
+        # v = beta*v + (1-beta)*grad
+        np.multiply(grad, 1-self.beta, out=scratch)
+        v *= self.beta
+        v += scratch
+        # param -= alpha*v
+        np.multiply(v, self.alpha, out=scratch)
+        np.subtract(param, scratch, out=param)
+
 class RMSProp(_Optimizers):
 
     def __init__(self, alpha=0.01, beta=0.9, epsilon=1e-9):
@@ -41,13 +76,29 @@ class RMSProp(_Optimizers):
         self.beta = beta
         self.epsilon = epsilon
         self.s = None
+        self.scratch = None
 
     def minimize(self, grad):
         if self.s is None:
-            self.s = np.zeros(shape=grad.shape)
+            self.s = np.zeros_like(grad)
         self.s = self.beta*self.s + (1-self.beta)*grad**2
         return self.alpha * (1/(np.sqrt(self.s + self.epsilon))) * grad
 
+    def step(self, param, grad):
+        s = self._buffer("s", param, grad)
+        scratch = self._buffer("scratch", param, grad)
+        # s = beta*s + (1-beta)*grad**2
+        np.square(grad, out=scratch)
+        scratch *= 1-self.beta
+        s *= self.beta
+        s += scratch
+        # param -= alpha*grad/sqrt(s + epsilon)
+        np.add(s, self.epsilon, out=scratch)
+        np.sqrt(scratch, out=scratch)
+        np.divide(grad, scratch, out=scratch)
+        scratch *= self.alpha
+        np.subtract(param, scratch, out=param)
+
 class Adam(_Optimizers):
     
     def __init__(self, alpha=0.01, beta_1=0.9, beta_2=0.99, epsilon=1e-9):
@@ -57,12 +108,72 @@ class Adam(_Optimizers):
         self.epsilon = epsilon
         self.v = None
         self.s = None
+        self.scratch = None
 
     def minimize(self, grad):
         if self.v is None and self.s is None:
-            self.v = np.zeros(shape=grad.shape)
-            self.s = np.zeros(shape=grad.shape)
+            self.v = np.zeros_like(grad)
+            self.s = np.zeros_like(grad)
         self.v = self.beta_1*self.v + (1-self.beta_1)*grad
         self.s = self.beta_2*self.s + (1-self.beta_2)*grad**2
         return self.alpha * (self.v / (np.sqrt(self.s + self.epsilon)))
-        
\ No newline at end of file
+
+    def step(self, param, grad):
+        v = self._buffer("v", param, grad)
+        s = self._buffer("s", param, grad)
+        scratch = self._buffer("scratch", param, grad)
+        # v = beta_1*v + (1-beta_1)*grad
+        np.multiply(grad, 1-self.beta_1, out=scratch)
+        v *= self.beta_1
+        v += scratch
+        # s = beta_2*s + (1-beta_2)*grad**2
+        np.square(grad, out=scratch)
+        scratch *= 1-self.beta_2
+        s *= self.beta_2
+        s += scratch
+        # param -= alpha*v/sqrt(s + epsilon)
+        np.add(s, self.epsilon, out=scratch)
+        np.sqrt(scratch, out=scratch)
+        np.divide(v, scratch, out=scratch)
+        scratch *= self.alpha
+        np.subtract(param, scratch, out=param)
+
+
+def benchmark(shape=(1024, 1024), steps=20):
+    """
+    Compare `W -= optimizer.minimize(grad)` with `optimizer.step(W, grad)`: time per step and the temporary memory
+    numpy allocates per step (traced by tracemalloc), counted in arrays of the parameter size.
+    """
+    import time
+    import tracemalloc
+
+    blank = "----------------------"
+    print(blank + "OPTIMIZER STEP %s" % str(shape) + blank)
+    for optimizer_class in [SGD, SGDMomentum, RMSProp, Adam]:
+        for mode in ["minimize", "step"]:
+            optimizer = optimizer_class()
+            W = np.random.normal(size=shape)
+            grad = np.random.normal(size=shape)
+            if mode == "minimize":
+                W -= optimizer.minimize(grad)
+            else:
+                optimizer.step(W, grad)
+            tracemalloc.start()
+            start = time.time()
+            peak = 0
+            for _ in range(steps):
+                tracemalloc.reset_peak()
+                current, _ = tracemalloc.get_traced_memory()
+                if mode == "minimize":
+                    W -= optimizer.minimize(grad)
+                else:
+                    optimizer.step(W, grad)
+                peak = max(peak, tracemalloc.get_traced_memory()[1] - current)
+            step_time = (time.time() - start)/steps
+            tracemalloc.stop()
+            print("%-12s %-9s %.4fs/step | temporaries per step: %.1f x param size"
+                  % (optimizer_class.__name__, mode, step_time, peak / W.nbytes))
+
+
+if __name__ == "__main__":
+    benchmark()
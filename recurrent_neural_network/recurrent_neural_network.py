@@ -4,15 +4,22 @@ Email: giangtran240896@gmail.com
 Docs: https://giangtranml.github.io/ml/machine-learning/recurrent-neural-network
 Note: not correctly implemented yet!
 """
-from nn_components.activations import softmax, tanh, tanh_grad
+from nn_components.activations import softmax, tanh
 from neural_network.neural_network import NeuralNetwork
+from nn_components.precision import Policy
+from nn_components.parameters import ParameterRegistry
+from libs.data_loader import DataLoader
 import numpy as np
 from tqdm import tqdm
 
 
 class RecurrentNeuralNetwork(NeuralNetwork):
 
-    def __init__(self, hidden_units, epochs, optimizer, batch_size):
+    trainable_params = ("Wy", "by", "Waa", "Wax", "ba")
+    buffers = ()
+    grads = None
+
+    def __init__(self, hidden_units, epochs, optimizer, batch_size, dtype="float32"):
         """
         Constructor for Recurrent Neural Network. 
         """
@@ -20,6 +27,8 @@ class RecurrentNeuralNetwork(NeuralNetwork):
         self.optimizer = optimizer
         self.epochs = epochs
         self.batch_size = batch_size
+        self.policy = Policy(dtype)
+        self.registry = ParameterRegistry(optimizer, self.policy)
 
     def _loss(self, Y, Y_hat):
         """
@@ -45,8 +54,8 @@ class RecurrentNeuralNetwork(NeuralNetwork):
         Y_hat: softmax output at every step, shape = (N, T, C)
         """
         m, timesteps, _ = X.shape
-        h0 = np.zeros(shape=(m, self.hidden_units))
-        self.states = np.zeros(shape=(m, timesteps, self.hidden_units))
+        h0 = np.zeros(shape=(m, self.hidden_units), dtype=self.policy.storage_dtype)
+        self.states = np.zeros(shape=(m, timesteps, self.hidden_units), dtype=self.policy.storage_dtype)
         self.states[:, 0, :] = tanh(np.dot(X[:, 0, :], self.Wax) + np.dot(h0, self.Waa) + self.ba)
         for t in range(1, timesteps):
             self.states[:, t, :] = tanh(np.dot(X[:, t, :], self.Wax) + np.dot(self.states[:, t-1, :], self.Waa) + self.ba)
@@ -54,55 +63,68 @@ class RecurrentNeuralNetwork(NeuralNetwork):
         Y_hat = softmax(Y_hat + self.by)
         return Y_hat
 
-    def _backward(self, X_train, Y_train, Y_hat):
+    def _backward(self, Y_train, Y_hat, X_train, scale=1.0):
         """
-        X_train: shape=(m, time_steps, vector_length)
+        Backpropagation through time. Accumulate the gradients of the RNN parameters, `apply_gradients` updates them.
+
         Y_train: shape=(m, time_steps, vocab_length)
         Y_hat: shape=(m, time_steps, vocab_length)
+        X_train: shape=(m, time_steps, vector_length)
+        scale: (float) weight of this batch in the accumulated gradients.
         """
         m, time_steps, vector_len = X_train.shape
-        dWaa = np.zeros(shape=self.Waa.shape)
-        dWax = np.zeros(shape=self.Wax.shape)
-        dba = np.zeros(shape=self.ba.shape)
-
-        delta = (Y_hat - Y_train)/m
-        dWy = np.einsum("ntc,nth->hc", delta, self.states)
-        dby = np.sum(delta, axis=(0, 1))
+        X_train = self.policy.compute(X_train)
+        states = self.policy.compute(self.states)
+        Waa = self.policy.compute(self.Waa)
+        dWaa = np.zeros(shape=self.Waa.shape, dtype=self.policy.compute_dtype)
+        dWax = np.zeros(shape=self.Wax.shape, dtype=self.policy.compute_dtype)
+        dba = np.zeros(shape=self.ba.shape, dtype=self.policy.compute_dtype)
 
-        delta = np.einsum("ntc,hc->nth", delta, self.Wy)
-        d_states = np.einsum("ntk,hk->nth", tanh_grad(self.states), self.Waa)
+        delta = scale*(self.policy.compute(Y_hat) - self.policy.compute(Y_train))/m
+        dWy = np.einsum("ntc,nth->hc", delta, states)
+        dby = np.sum(delta, axis=(0, 1))[None]
 
+        d_states = np.einsum("ntc,hc->nth", delta, self.policy.compute(self.Wy))
+        d_next = np.zeros(shape=(m, self.hidden_units), dtype=self.policy.compute_dtype)
         for t in reversed(range(time_steps)):
-            for i in range(0, t):
-                dWaa += delta[:, t, :] * np.prod(d_states[:, i+1:t, :], axis=1)
-        # self.update_params(dWy, dby, dWaa, dWax, dba)
+            dZ = (d_states[:, t, :] + d_next) * (1 - states[:, t, :]**2)
+            dWax += X_train[:, t, :].T.dot(dZ)
+            if t > 0:
+                dWaa += states[:, t-1, :].T.dot(dZ)
+            dba += np.sum(dZ, axis=0, keepdims=True)
+            d_next = dZ.dot(Waa.T)
+        self._accumulate_gradients(dWy, dby, dWaa, dWax, dba)
 
-    def train(self, X_train, Y_train):
+    def train(self, X_train, Y_train=None):
         """
-        X_train: shape=(m, time_steps, vector_length)
+        X_train: shape=(m, time_steps, vector_length), or a `DataLoader` serving (X, Y) batches.
         Y_train: shape=(m, time_steps, vocab_length)
         """
-        m, time_steps, vector_len = X_train.shape
-        _, _, vocab_len = Y_train.shape
-        self.Wax = np.random.normal(size=(vector_len, self.hidden_units))
-        self.Waa = np.random.normal(size=(self.hidden_units, self.hidden_units))
-        self.Wy = np.random.normal(size=(self.hidden_units, vocab_len))
-        self.ba = np.zeros(shape=(1, self.hidden_units))
-        self.by = np.zeros(shape=(1, vocab_len))
+        if isinstance(X_train, DataLoader):
+            m, time_steps, vector_len = X_train.X.shape
+            _, _, vocab_len = X_train.y.shape
+        else:
+            m, time_steps, vector_len = X_train.shape
+            _, _, vocab_len = Y_train.shape
+        self.Wax = self.policy.cast(np.random.normal(size=(vector_len, self.hidden_units)))
+        self.Waa = self.policy.cast(np.random.normal(size=(self.hidden_units, self.hidden_units)))
+        self.Wy = self.policy.cast(np.random.normal(size=(self.hidden_units, vocab_len)))
+        self.ba = np.zeros(shape=(1, self.hidden_units), dtype=self.policy.storage_dtype)
+        self.by = np.zeros(shape=(1, vocab_len), dtype=self.policy.storage_dtype)
+        # new weights: pack them into a new flat buffer (with a fresh optimizer state) at the first forward pass.
+        self.grads = None
+        self.registry = ParameterRegistry(self.optimizer, self.policy)
         super().train(X_train, Y_train)
 
-    def update_params(self, dWy, dby, dWaa, dWax, dba):
+    def _trainable_layers(self):
+        """
+        The RNN weights are held by the model itself.
+        """
+        return [self]
+
+    def _accumulate_gradients(self, dWy, dby, dWaa, dWax, dba):
         """
-        Update parameters of RNN by its gradient.
+        Accumulate the gradients of RNN parameters, the registry updates them all in one step.
         """
-        dWy = self.optimizer.minimize(dWy)
-        dby = self.optimizer.minimize(dby)
-        dWaa = self.optimizer.minimize(dWaa)
-        dWax = self.optimizer.minimize(dWax)
-        dba = self.optimizer.minimize(dba)
-
-        self.Wy -= dWy
-        self.by -= dby
-        self.Waa -= dWaa
-        self.Wax -= dWax
-        self.ba -= dba
+        for name, grad in zip(self.trainable_params, (dWy, dby, dWaa, dWax, dba)):
+            self.grads[name] += grad
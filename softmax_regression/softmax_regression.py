@@ -8,6 +8,7 @@ import sys
 sys.path.append("..")
 from libs.utils import load_dataset_mnist, preprocess_data
 from libs.mnist_lib import MNIST
+from libs.data_loader import DataLoader
 from optimizations_algorithms.optimizers import SGD
 
 
@@ -84,25 +85,33 @@ class SoftmaxRegression:
         assert y.shape == y_hat.shape, "y and y_hat must be same shape."
         return X.T.dot(y_hat - y)/X.shape[0]
 
-    def _train(self, X_train, y_train):
+    def _train(self, batches):
         for e in range(self.epochs):
             batch_loss = 0
             num_batches = 0
-            it = 0
-            while it < X_train.shape[0]:
-                y_hat = self._softmax_function(X_train[it:it+self.batch_size])
-                loss = self._cross_entropy_loss(y_train[it:it+self.batch_size], y_hat)
+            for X_batch, y_batch in batches:
+                if self.W is None:
+                    self.W = np.random.normal(size=(X_batch.shape[1], y_batch.shape[1]))
+                y_hat = self._softmax_function(X_batch)
+                loss = self._cross_entropy_loss(y_batch, y_hat)
                 batch_loss += loss
-                grad = self._gradient(X_train[it:it+self.batch_size], y_train[it:it+self.batch_size], y_hat)
-                self.W -= self.optimizer.minimize(grad)
-                it += self.batch_size
+                grad = self._gradient(X_batch, y_batch, y_hat)
+                self.optimizer.step(self.W, grad)
                 num_batches += 1
             print("Loss at epoch %s: %f" % (e + 1 , batch_loss / num_batches))
 
-    def train(self, X_train, y_train):
-        assert X_train.shape[0] == y_train.shape[0], "X and y must have the same data points."
-        self.W = np.random.normal(size=(X_train.shape[1], y_train.shape[1]))
-        self._train(X_train, y_train)
+    def train(self, X_train, y_train=None):
+        """
+        X_train: training set, or a `DataLoader` serving (X, 1-hot y) batches.
+        y_train: training label (1-hot). Unused with a `DataLoader`.
+        """
+        if isinstance(X_train, DataLoader):
+            batches = X_train
+        else:
+            assert X_train.shape[0] == y_train.shape[0], "X and y must have the same data points."
+            batches = DataLoader(X_train, y_train, self.batch_size, prefetch=0)
+        self.W = None
+        self._train(batches)
 
     def predict(self, X_test):
         return np.argmax(X_test.dot(self.W), axis=1)
@@ -110,7 +119,7 @@ class SoftmaxRegression:
 
 if __name__ == '__main__':
     load_dataset_mnist("../libs")
-    mndata = MNIST('../libs/data_mnist')
+    mndata = MNIST('../libs/data_mnist', return_type='numpy')
 
     images, labels = mndata.load_training()
     images, labels = preprocess_data(images, labels)
@@ -0,0 +1,72 @@
+"""
+Explicit feature maps z(x) whose dot products approximate a kernel, z(x).z(x') ~ k(x, x'), so a linear SVM trained
+on z(X) approximates the kernel SVM and predicts in a time independent of the number of support vectors.
+"""
+
+import numpy as np
+from kernel_cache import KernelCache
+
+
+class RandomFourierFeatures:
+    """
+    Random Fourier features (Rahimi and Recht 2007) of the rbf kernel k(x, x') = exp(-gamma*|x - x'|^2):
+        z(x) = sqrt(2/n_components)*cos(x.W + c), W ~ N(0, 2*gamma), c ~ U(0, 2*pi)
+    The error of the approximation decreases as 1/sqrt(n_components). A mapping costs O(D*n_components).
+    """
+
+    def __init__(self, svm, n_components=256, seed=None):
+        """
+        :param svm: the SVM whose kernel is approximated, rbf only.
+        :param n_components: dimension of z(x).
+        :param seed: seed of W and c.
+        """
+        assert svm.kernel == 'rbf', "Random Fourier features approximate the rbf kernel only."
+        self.svm = svm
+        self.n_components = n_components
+        self.seed = seed
+        self.W, self.offsets = None, None
+
+    def fit(self, X):
+        random = np.random.RandomState(self.seed)
+        self.W = random.normal(scale=np.sqrt(2*self.svm.gamma), size=(X.shape[1], self.n_components))
+        self.offsets = random.uniform(0, 2*np.pi, size=self.n_components)
+        return self
+
+    def transform(self, X):
+        return np.sqrt(2/self.n_components) * np.cos(X.dot(self.W) + self.offsets)
+
+
+class Nystroem:
+    """
+    Nystroem approximation (Williams and Seeger 2001) of any kernel, from `n_components` landmarks L sampled from
+    the training points:
+        z(x) = k(x, L).K_LL^(-1/2), K_LL = k(L, L)
+    exact on the span of the landmarks, so it adapts to the data and needs fewer components than random Fourier
+    features at the same accuracy. A mapping costs n_components kernel evaluations.
+    """
+
+    def __init__(self, svm, n_components=256, seed=None):
+        """
+        :param svm: the SVM whose kernel is approximated.
+        :param n_components: number of landmarks, the dimension of z(x).
+        :param seed: seed of the landmark sampling.
+        """
+        self.svm = svm
+        self.n_components = n_components
+        self.seed = seed
+        self.kernel, self.normalization = None, None
+
+    def fit(self, X):
+        random = np.random.RandomState(self.seed)
+        landmarks = X[random.choice(X.shape[0], size=min(self.n_components, X.shape[0]), replace=False)]
+        self.kernel = KernelCache(self.svm, landmarks)
+        eigenvalues, eigenvectors = np.linalg.eigh(self.kernel(landmarks))
+        # K_LL is only positive semi-definite: drop the null directions, whose inverse square roots would amplify
+        # rounding noise (a pseudo-inverse square root).
+        keep = eigenvalues > 1e-12 * np.max(eigenvalues)
+        eigenvalues, eigenvectors = eigenvalues[keep], eigenvectors[:, keep]
+        self.normalization = (eigenvectors / np.sqrt(eigenvalues)).dot(eigenvectors.T)
+        return self
+
+    def transform(self, X):
+        return self.kernel(X).dot(self.normalization)
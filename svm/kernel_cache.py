@@ -0,0 +1,105 @@
+"""
+Kernel evaluation layer of the SVM, with an LRU cache of kernel rows.
+"""
+
+from collections import OrderedDict
+import numpy as np
+
+
+class KernelCache:
+    """
+    Kernel evaluations k(A, X) against a fixed set of points X: the training points while training, the support
+    vectors after.
+        - rbf: the squared norms of X are computed once, so k(A, X) = exp(-gamma*(|a|^2 + |x|^2 - 2*a.x)) costs one
+            matrix product.
+        - the rows of k(X, X), keyed by sample index, are kept in an LRU cache of at most `cache_size` MB.
+            `hits` and `misses` count the lookups, to tune `cache_size`.
+    """
+
+    def __init__(self, svm, X, cache_size=100):
+        """
+        :param svm: the SVM whose kernel and parameters are evaluated.
+        :param X: points, shape = (N, D), float64.
+        :param cache_size: MB of cached rows.
+        """
+        self.svm = svm
+        self.X = X
+        self.sq_norms = np.einsum("ij,ij->i", X, X) if svm.kernel == 'rbf' else None
+        self.max_rows = max(2, int(cache_size * 2**20 // (max(X.shape[0], 1) * 8)))
+        self.rows = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self._diagonal = None
+
+    def __call__(self, A, A_sq_norms=None):
+        """
+        :return: k(A, X), shape = (len(A), N)
+        """
+        if self.svm.kernel == 'rbf':
+            if A_sq_norms is None:
+                A_sq_norms = np.einsum("ij,ij->i", A, A)
+            sq_dist = A_sq_norms[:, None] + self.sq_norms[None, :] - 2 * A.dot(self.X.T)
+            return np.exp(-self.svm.gamma * np.maximum(sq_dist, 0))
+        return getattr(self.svm, self.svm.kernels[self.svm.kernel])(A, self.X)
+
+    def row(self, i):
+        """
+        :return: row i of k(X, X), shape = (N,)
+        """
+        row = self.rows.get(i)
+        if row is not None:
+            self.hits += 1
+            self.rows.move_to_end(i)
+            return row
+        self.misses += 1
+        row = self(self.X[i:i+1], None if self.sq_norms is None else self.sq_norms[i:i+1])[0]
+        self.rows[i] = row
+        if len(self.rows) > self.max_rows:
+            self.rows.popitem(last=False)
+        return row
+
+    def diagonal(self):
+        """
+        :return: k(x_i, x_i) for all the points, shape = (N,)
+        """
+        if self._diagonal is None:
+            if self.svm.kernel == 'rbf':
+                self._diagonal = np.ones(self.X.shape[0])
+            else:
+                kernel = getattr(self.svm, self.svm.kernels[self.svm.kernel])
+                self._diagonal = np.concatenate([np.diag(kernel(self.X[start:start+256], self.X[start:start+256]))
+                                                 for start in range(0, self.X.shape[0], 256)] + [np.zeros(0)])
+        return self._diagonal
+
+    def hit_rate(self):
+        return self.hits / max(self.hits + self.misses, 1)
+
+
+class KernelCacheView:
+    """
+    The kernel evaluations of the subset X[indices] of the points of a KernelCache, for a sub-problem such as one
+    pair of classes of a one-vs-one SVM. Rows are computed and cached over all the points of the underlying cache,
+    so the sub-problems sharing a point (every pair with its class) share its row.
+    """
+
+    def __init__(self, cache, indices):
+        self.cache = cache
+        self.indices = indices
+        self.sq_norms = None if cache.sq_norms is None else cache.sq_norms[indices]
+
+    def __call__(self, A, A_sq_norms=None):
+        return self.cache(A, A_sq_norms)[:, self.indices]
+
+    def row(self, i):
+        return self.cache.row(self.indices[i])[self.indices]
+
+    def diagonal(self):
+        return self.cache.diagonal()[self.indices]
+
+    @property
+    def hits(self):
+        return self.cache.hits
+
+    @property
+    def misses(self):
+        return self.cache.misses
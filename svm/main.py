@@ -16,10 +16,10 @@ def linear_kernel():
 
     svm = SVM(C=C, kernel='linear', debug=True, is_saved=False)
     svm.train(X, y)
-    #
-    # W = svm.w
-    # b = svm.b
-    # plot.visualize_boundary_linear(W, b)
+
+    W = svm.w
+    b = svm.b
+    plot.visualize_boundary_linear(W, b)
 
 
 def rbf_kernel():
@@ -51,7 +51,7 @@ def spam_classification():
     y = y.astype(np.double)
     y[y == 0] = -1
     C = 0.1
-    svm = SVM(C=C, kernel='linear', debug=True, is_saved=False)
+    svm = SVM(C=C, kernel='linear', debug=True, is_saved=False, solver='smo')
     svm.train(X, y)
 
     pred_train = svm.predict(X)
@@ -74,6 +74,268 @@ def spam_classification():
     is_spam = svm.predict(x)
     print("Spam" if is_spam[0] == 1 else "No spam")
 
+
+def load_labelled(mat_file):
+    X, y = load_mat_file(mat_file)
+    y = y.reshape((-1, 1))
+    y = y.astype(np.double)
+    y[y == 0] = -1
+    return X, y
+
+
+def benchmark_solvers():
+    """
+    Training time, support vectors and training accuracy of the SMO solver against the cvxopt QP solver.
+    The QP solver takes several minutes on spamTrain.mat.
+    With a small C, every multiplier is at a bound: the QP solver leaves them ~1e-6 inside the bounds and averages b
+    over these "margin" points, so its accuracy is not a reference there. b and the accuracy of SMO are compared to
+    LIBSVM (sklearn SVC) instead.
+    """
+    import time
+    from sklearn.svm import SVC
+
+    for mat_file, C, kernel in [('ex6data1.mat', 1.0, 'linear'), ('ex6data1.mat', 0.01, 'linear'),
+                                ('ex6data2.mat', 1.0, 'rbf'), ('ex6data3.mat', 1.0, 'rbf'),
+                                ('spamTrain.mat', 0.1, 'linear')]:
+        X, y = load_labelled(mat_file)
+        support, accuracy, b = {}, {}, {}
+        for solver in ['qp', 'smo']:
+            svm = SVM(C=C, kernel=kernel, solver=solver)
+            start = time.perf_counter()
+            svm.train(X, y)
+            train_time = time.perf_counter() - start
+            support[solver] = set(svm.support_indices)
+            accuracy[solver] = np.mean(svm.predict(X) == y)
+            b[solver] = svm.b
+            print("%-13s C=%-5g %-6s %-3s train: %7.3fs | support vectors: %4d | b: %8.4f | accuracy: %.4f"
+                  % (mat_file, C, kernel, solver, train_time, len(support[solver]), b[solver], accuracy[solver]))
+        libsvm = SVC(C=C, kernel=kernel, gamma=svm.gamma).fit(X, y.reshape(-1))
+        accuracy['libsvm'] = libsvm.score(X, y.reshape(-1))
+        print("%-13s C=%-5g %-6s libsvm b: %8.4f | accuracy: %.4f"
+              % (mat_file, C, kernel, libsvm.intercept_[0], accuracy['libsvm']))
+        # the interior point solver leaves multipliers ~1e-6 above 0 that SMO sets to exactly 0.
+        out = "PASS" if (support['smo'] <= support['qp'] and np.isfinite(b['smo']) and
+                         abs(accuracy['smo'] - accuracy['libsvm']) <= 0.01) else "FAIL"
+        print("====> SMO support vectors among the QP ones (%d common), same accuracy as LIBSVM: %s"
+              % (len(support['smo'] & support['qp']), out))
+
+
+def benchmark_cache():
+    """
+    SMO training time and kernel row cache hits/misses on spamTrain.mat for several cache sizes, and prediction time
+    on spamTest.mat.
+    """
+    import time
+
+    X, y = load_labelled('spamTrain.mat')
+    X_test, y_test = load_labelled('spamTest.mat')
+    for cache_size in [2, 10, 50, 200]:
+        svm = SVM(C=0.1, kernel='linear', solver='smo', cache_size=cache_size)
+        start = time.perf_counter()
+        svm.train(X, y)
+        train_time = time.perf_counter() - start
+        start = time.perf_counter()
+        pred = svm.predict(X_test)
+        predict_time = time.perf_counter() - start
+        print("cache %3d MB | train: %.3fs | hits: %6d | misses: %5d | hit rate: %.3f | predict: %.3fs | accuracy: %.4f"
+              % (cache_size, train_time, svm.cache_hits, svm.cache_misses,
+                 svm.cache_hits / (svm.cache_hits + svm.cache_misses), predict_time, np.mean(pred == y_test)))
+
+
+def benchmark_linear():
+    """
+    Linear SVM on spamTrain.mat: prediction with the primal w against the kernel evaluation over the support vectors,
+    then the training time and test accuracy of the linear solvers (cd, pegasos) against SMO, and their scaling on
+    100k+ sparse rows resampled from spamTrain.mat.
+    """
+    import time
+    from scipy import sparse
+    from kernel_cache import KernelCache
+
+    X, y = load_labelled('spamTrain.mat')
+    X_test, y_test = load_labelled('spamTest.mat')
+    X_test = X_test.astype(np.float64)
+
+    svm = SVM(C=0.1, kernel='linear', solver='smo')
+    svm.train(X, y)
+    start = time.perf_counter()
+    kernel_decision = KernelCache(svm, svm.support_vectors)(X_test).dot(svm.dual_coef) + svm.b
+    kernel_time = time.perf_counter() - start
+    start = time.perf_counter()
+    decision = svm.decision(X_test)
+    primal_time = time.perf_counter() - start
+    print("predict %d points, %d support vectors | kernel: %.4fs | w: %.4fs"
+          % (X_test.shape[0], svm.support_vectors.shape[0], kernel_time, primal_time))
+    print("====> Same decision values with w: %s" % ("PASS" if np.allclose(decision, kernel_decision) else "FAIL"))
+
+    accuracy = {}
+    for solver in ['smo', 'cd', 'pegasos']:
+        svm = SVM(C=0.1, kernel='linear', solver=solver, seed=0)
+        start = time.perf_counter()
+        svm.train(X, y)
+        train_time = time.perf_counter() - start
+        accuracy[solver] = np.mean(svm.predict(X_test) == y_test)
+        print("%-8s train: %6.3fs | iterations: %5d | test accuracy: %.4f"
+              % (solver, train_time, svm.n_iter, accuracy[solver]))
+    out = "PASS" if all(abs(accuracy[solver] - accuracy['smo']) <= 0.01 for solver in ['cd', 'pegasos']) else "FAIL"
+    print("====> Linear solvers as accurate as SMO: %s" % out)
+
+    random = np.random.RandomState(0)
+    X_sparse = sparse.csr_matrix(X)
+    for N in [25000, 50000, 100000]:
+        rows = random.randint(X.shape[0], size=N)
+        X_large, y_large = X_sparse[rows], y[rows]
+        for solver in ['cd', 'pegasos']:
+            svm = SVM(C=0.1 * X.shape[0] / N, kernel='linear', solver=solver, seed=0)
+            start = time.perf_counter()
+            svm.train(X_large, y_large)
+            train_time = time.perf_counter() - start
+            print("%6d sparse rows | %-8s train: %7.3fs | iterations: %5d | test accuracy: %.4f"
+                  % (N, solver, train_time, svm.n_iter, np.mean(svm.predict(X_test) == y_test)))
+
+
+def load_mnist(num_train, num_test):
+    """
+    The first `num_train` training and `num_test` test images of MNIST (downloaded by libs), scaled to [0, 1].
+    """
+    import sys
+    sys.path.append("..")
+    from libs.utils import load_dataset_mnist
+    from libs.mnist_lib import MNIST
+
+    load_dataset_mnist("../libs")
+    mndata = MNIST('../libs/data_mnist', return_type='numpy')
+    images, labels = mndata.load_training()
+    images_test, labels_test = mndata.load_testing()
+    return (images[:num_train] / 255.0, labels[:num_train].astype(int),
+            images_test[:num_test] / 255.0, labels_test[:num_test].astype(int))
+
+
+def benchmark_multiclass(num_train=5000, num_test=1000):
+    """
+    Multi-class rbf SVM on a subset of MNIST:
+        - one-vs-one with the kernel cache shared by the pairs against each pair with its own cache.
+        - training wall-clock time of one-vs-rest and one-vs-one for 1 process up to one per CPU.
+    """
+    import os
+    import time
+    from multiclass_svm import MultiClassSVM
+
+    X, y, X_test, y_test = load_mnist(num_train, num_test)
+    params = dict(C=5.0, kernel='rbf', gamma=0.02, solver='smo')
+    print("MNIST: %d training images, %d test images, %d CPUs" % (X.shape[0], X_test.shape[0], os.cpu_count()))
+
+    classes = np.unique(y)
+    start = time.perf_counter()
+    for a in range(len(classes)):
+        for b in range(a + 1, len(classes)):
+            pair = (y == classes[a]) | (y == classes[b])
+            SVM(**params).train(X[pair], np.where(y[pair] == classes[a], 1.0, -1.0).reshape((-1, 1)))
+    separate_time = time.perf_counter() - start
+    svm = MultiClassSVM('ovo', workers=1, **params)
+    start = time.perf_counter()
+    svm.train(X, y)
+    shared_time = time.perf_counter() - start
+    print("ovo, 1 process | one cache per pair: %.3fs | shared cache: %.3fs" % (separate_time, shared_time))
+
+    for strategy in MultiClassSVM.strategies:
+        predictions = []
+        for workers in sorted({1, 2, 4, os.cpu_count()}):
+            svm = MultiClassSVM(strategy, workers=workers, **params)
+            start = time.perf_counter()
+            svm.train(X, y)
+            train_time = time.perf_counter() - start
+            start = time.perf_counter()
+            predictions.append(svm.predict(X_test))
+            predict_time = time.perf_counter() - start
+            print("%s | %2d processes | train: %8.3fs | predict: %.3fs | support vectors: %5d | accuracy: %.4f"
+                  % (strategy, workers, train_time, predict_time, svm.support_vectors.shape[0],
+                     np.mean(predictions[-1] == y_test)))
+        out = "PASS" if all(np.array_equal(pred, predictions[0]) for pred in predictions) else "FAIL"
+        print("====> %s: same predictions for every number of processes: %s" % (strategy, out))
+
+
+def benchmark_approximation():
+    """
+    Accuracy / latency trade-off of the approximate rbf kernels (random Fourier features, Nystroem) with the cd
+    solver against the exact rbf kernel with SMO, for several numbers of components: training time, prediction time
+    on the test set, test accuracy and mean absolute error of the approximated kernel values.
+    """
+    import time
+    from scipy import sparse
+    from kernel_cache import KernelCache
+
+    def best_time(function, repeat=3):
+        times = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            function()
+            times.append(time.perf_counter() - start)
+        return min(times)
+
+    X, y = load_labelled('ex6data2.mat')
+    order = np.random.RandomState(0).permutation(X.shape[0])
+    ex6 = (X[order[:600]], y[order[:600]], X[order[600:]], y[order[600:]])
+    X, y = load_labelled('spamTrain.mat')
+    X_test, y_test = load_labelled('spamTest.mat')
+    spam = (X, y, X_test.astype(np.float64), y_test)
+
+    for name, (X, y, X_test, y_test), C, gamma in [('ex6data2', ex6, 1.0, 50.0), ('spam', spam, 10.0, 0.005)]:
+        svm = SVM(C=C, kernel='rbf', gamma=gamma, solver='smo')
+        start = time.perf_counter()
+        svm.train(X, y)
+        train_time = time.perf_counter() - start
+        exact_accuracy = np.mean(svm.predict(X_test) == y_test)
+        print("%-8s | exact        | train: %6.3fs | predict: %.4fs | accuracy: %.4f | %d support vectors"
+              % (name, train_time, best_time(lambda: svm.predict(X_test)), exact_accuracy,
+                 svm.support_vectors.shape[0]))
+        sample = X_test[:200].astype(np.float64)
+        exact_kernel = KernelCache(svm, sample)(sample)
+        errors = {}
+        for approximation in SVM.approximations:
+            for n_components in [64, 256, 1024]:
+                svm = SVM(C=C, kernel='rbf', gamma=gamma, solver='cd', tol=0.1, approximation=approximation,
+                          n_components=n_components, seed=0)
+                start = time.perf_counter()
+                svm.train(X, y)
+                train_time = time.perf_counter() - start
+                features = svm.feature_map.transform(sample)
+                errors[approximation, n_components] = np.mean(np.abs(features.dot(features.T) - exact_kernel))
+                print("%-8s | %-8s %4d | train: %6.3fs | predict: %.4fs | accuracy: %.4f | kernel error: %.4f"
+                      % (name, approximation, n_components, train_time, best_time(lambda: svm.predict(X_test)),
+                         np.mean(svm.predict(X_test) == y_test), errors[approximation, n_components]))
+            out = "PASS" if errors[approximation, 1024] < errors[approximation, 64] else "FAIL"
+            print("====> %s: %s kernel error decreases with the number of components: %s" % (name, approximation, out))
+            try:
+                svm.decision(sparse.csr_matrix(X_test))
+                out = "FAIL"
+            except AssertionError:
+                out = "PASS"
+            print("====> %s: %s rejects sparse test points: %s" % (name, approximation, out))
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description="SVM programs.")
+    parser.add_argument("--benchmark_solvers", action="store_true", help="Benchmark the SMO solver against the QP.")
+    parser.add_argument("--benchmark_cache", action="store_true", help="Benchmark the kernel row cache sizes.")
+    parser.add_argument("--benchmark_linear", action="store_true", help="Benchmark the linear SVM fast path.")
+    parser.add_argument("--benchmark_multiclass", action="store_true", help="Benchmark the multi-class SVM on MNIST.")
+    parser.add_argument("--benchmark_approximation", action="store_true",
+                        help="Benchmark the approximate rbf kernels against the exact one.")
+    args = parser.parse_args()
+    if args.benchmark_solvers:
+        benchmark_solvers()
+    elif args.benchmark_cache:
+        benchmark_cache()
+    elif args.benchmark_linear:
+        benchmark_linear()
+    elif args.benchmark_multiclass:
+        benchmark_multiclass()
+    elif args.benchmark_approximation:
+        benchmark_approximation()
+
 # linear_kernel()
 # spam_classification()
 # rbf_kernel()
\ No newline at end of file
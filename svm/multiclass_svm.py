@@ -0,0 +1,164 @@
+"""
+Multi-class SVM: one-vs-rest or one-vs-one binary SVMs trained in a process pool.
+"""
+import multiprocessing as mp
+import numpy as np
+from scipy import sparse
+from svm import SVM
+from kernel_cache import KernelCache, KernelCacheView
+
+# state of a training process: the binary SVM parameters, the training set and its kernel cache, set once per
+# process by `_init_worker` instead of being sent with every sub-problem.
+_worker = {}
+
+
+def _init_worker(svm_params, X, y):
+    template = SVM(**svm_params)
+    _worker["svm_params"] = svm_params
+    _worker["X"] = X
+    _worker["y"] = y
+    _worker["cache"] = None
+    if template.solver in SVM.dual_solvers:
+        _worker["cache"] = KernelCache(template, X, template.cache_size)
+
+
+def _train_binary(task):
+    """
+    Train the binary SVM of one sub-problem: the points `indices` (all of them when None), labelled 1 if their class
+    is `positive`, -1 otherwise.
+
+    :return: (support vector indices into X, dual_coef, b, w), either the first two or w are None.
+    """
+    indices, positive = task
+    X, y, cache = _worker["X"], _worker["y"], _worker["cache"]
+    if indices is None:
+        indices = np.arange(X.shape[0])
+    X_sub = X[indices]
+    y_sub = np.where(y[indices] == positive, 1.0, -1.0).reshape((-1, 1))
+    svm = SVM(**_worker["svm_params"])
+    svm.train(X_sub, y_sub, kernel_cache=None if cache is None else KernelCacheView(cache, indices))
+    if svm.support_vectors is None:
+        return None, None, svm.b, svm.w
+    return indices[svm.support_indices], svm.dual_coef.reshape(-1), svm.b, svm.w
+
+
+class MultiClassSVM:
+    """
+    Multi-class SVM made of binary SVMs (see SVM):
+        - ovr (one-vs-rest): one SVM per class, the class against all the others. Predict the class of the largest
+            decision value.
+        - ovo (one-vs-one): one SVM per pair of classes (a, b), trained on the points of a and b only. Predict the
+            class with the most votes, a vote being the winner of one pair (ties go to the first class).
+    The binary SVMs are trained concurrently by `workers` processes. A process keeps one kernel cache over the whole
+    training set for all its sub-problems, and gets consecutive sub-problems (in ovo, pairs sharing a class), so
+    the kernel rows of a point are computed once for all the sub-problems of the process that contain it.
+
+    The binary SVMs share their support vectors: `support_vectors` is their union, `dual_coef` has one column per
+    binary SVM (0 for the support vectors of the others), so the decision values of all the binary SVMs are one
+    kernel evaluation between the test points and the support vectors followed by one matrix product. With the
+    linear kernel, `w` has one column per binary SVM instead. With an approximation (see SVM), the training set is
+    mapped once and the binary SVMs are linear models over the mapped features.
+    """
+
+    strategies = ("ovr", "ovo")
+
+    def __init__(self, strategy='ovr', workers=None, **svm_params):
+        """
+        strategy: `ovr` (one-vs-rest) or `ovo` (one-vs-one).
+        workers: number of training processes. By default one per CPU, 1 trains in this process.
+        svm_params: parameters of the binary SVMs (C, kernel, gamma, solver, cache_size...).
+        """
+        assert strategy in self.strategies, "strategy must be one of: %s" % list(self.strategies)
+        self.strategy = strategy
+        self.workers = workers
+        self.svm_params = svm_params
+        self.classes, self.pairs = None, None
+        self.support_vectors, self.dual_coef, self.w, self.b = None, None, None, None
+        self.kernel_cache, self.feature_map = None, None
+
+    def _tasks(self, y):
+        """
+        Sub-problems: (indices of their points or None for all, positive class) and the classes they oppose, with
+        -1 for "the others".
+        """
+        if self.strategy == 'ovr':
+            self.pairs = np.array([[k, -1] for k in range(len(self.classes))])
+            return [(None, label) for label in self.classes]
+        self.pairs = np.array([[a, b] for a in range(len(self.classes)) for b in range(a + 1, len(self.classes))])
+        return [(np.flatnonzero((y == self.classes[a]) | (y == self.classes[b])), self.classes[a])
+                for a, b in self.pairs]
+
+    def train(self, X_train, y_train):
+        svm_params = dict(self.svm_params)
+        template = SVM(**svm_params)
+        if template.solver in SVM.linear_solvers and template.approximation is None:
+            assert type(X_train) is np.ndarray or sparse.issparse(X_train), \
+                "Expect numpy array or scipy sparse matrix but got %s" % type(X_train)
+        else:
+            assert type(X_train) is np.ndarray, "Expect numpy array but got %s" % type(X_train)
+        y = np.asarray(y_train).reshape(-1)
+        assert X_train.shape[0] == y.shape[0], "X and y must have the same data points."
+        self.classes = np.unique(y)
+        assert len(self.classes) > 2, "Use SVM for binary classification."
+        X_train = X_train.astype(np.float64, copy=False)
+        if svm_params.get("gamma", "auto") == 'auto':
+            # resolved once for all the sub-problems, whose kernels are shared.
+            svm_params["gamma"] = 1/X_train.shape[1]
+            template = SVM(**svm_params)
+        if template.approximation is not None:
+            # one feature map shared by all the binary SVMs.
+            self.feature_map = template.approximations[template.approximation](template, template.n_components,
+                                                                                template.seed)
+            X_train = self.feature_map.fit(X_train).transform(X_train)
+            svm_params.update(kernel='linear', approximation=None)
+            template = SVM(**svm_params)
+
+        tasks = self._tasks(y)
+        workers = min(self.workers or mp.cpu_count(), len(tasks))
+        if workers == 1:
+            _init_worker(svm_params, X_train, y)
+            results = list(map(_train_binary, tasks))
+            _worker.clear()
+        else:
+            context = mp.get_context("fork" if "fork" in mp.get_all_start_methods() else "spawn")
+            with context.Pool(workers, initializer=_init_worker, initargs=(svm_params, X_train, y)) as pool:
+                results = pool.map(_train_binary, tasks, chunksize=-(-len(tasks) // workers))
+
+        self.b = np.array([b for _, _, b, _ in results], dtype=np.float64)
+        if template.kernel == 'linear':
+            self.w = np.hstack([w for _, _, _, w in results])
+            return
+        support = np.unique(np.concatenate([indices for indices, _, _, _ in results]))
+        self.support_vectors = X_train[support]
+        self.dual_coef = np.zeros((support.shape[0], len(results)))
+        for column, (indices, dual_coef, _, _) in enumerate(results):
+            self.dual_coef[np.searchsorted(support, indices), column] = dual_coef
+        self.kernel_cache = KernelCache(template, self.support_vectors, template.cache_size)
+
+    def decision(self, X_test):
+        """
+        :return: decision values of the binary SVMs, shape = (N_test, number of binary SVMs)
+        """
+        # sparse input like in training: linear solvers without an approximation only.
+        assert type(X_test) is np.ndarray or (self.w is not None and self.feature_map is None and
+                                              sparse.issparse(X_test)), \
+            "Expect numpy array but got %s" % (type(X_test))
+        X_test = X_test.astype(np.float64, copy=False)
+        if self.feature_map is not None:
+            X_test = self.feature_map.transform(X_test)
+        if self.w is not None:
+            return np.asarray(X_test.dot(self.w)) + self.b
+        return self.kernel_cache(X_test).dot(self.dual_coef) + self.b
+
+    def predict(self, X_test):
+        """
+        :return: predicted classes, shape = (N_test,)
+        """
+        scores = self.decision(X_test)
+        if self.strategy == 'ovr':
+            return self.classes[np.argmax(scores, axis=1)]
+        num_classes = len(self.classes)
+        winners = np.where(scores >= 0, self.pairs[:, 0], self.pairs[:, 1])
+        votes = np.bincount((np.arange(scores.shape[0])[:, None] * num_classes + winners).reshape(-1),
+                            minlength=scores.shape[0] * num_classes).reshape((scores.shape[0], num_classes))
+        return self.classes[np.argmax(votes, axis=1)]
@@ -3,15 +3,62 @@ Author: Giang Tran.
 """
 from cvxopt import matrix, solvers
 import numpy as np
+from scipy import sparse
 from scipy.spatial.distance import cdist
+from kernel_cache import KernelCache
+from kernel_approximation import RandomFourierFeatures, Nystroem
 
 
 class SVM:
 
     kernels = {"linear": "_linear_kernel", "poly": "_polynomial_kernel", "rbf": "_gaussian_kernel",
                "sigmoid": "_sigmoid_kernel"}
-
-    def __init__(self, C=1.0, kernel='linear', degree=3, gamma='auto', r=0.0,debug=False, is_saved=False):
+    dual_solvers = {"qp": "_solve_lagrange_dual_function", "smo": "_solve_smo"}
+    # linear kernel only: train w and b directly, X_train may be a scipy sparse matrix.
+    linear_solvers = {"cd": "_solve_dual_cd", "pegasos": "_solve_pegasos"}
+    approximations = {"rff": RandomFourierFeatures, "nystroem": Nystroem}
+
+    def __init__(self, C=1.0, kernel='linear', degree=3, gamma='auto', r=0.0,debug=False, is_saved=False,
+                 solver='qp', tol=1e-3, shrinking=True, cache_size=100, max_iter=None, batch_size=256, seed=None,
+                 approximation=None, n_components=256):
+        """
+        solver: `qp` solves the dual with cvxopt (dense N x N matrices), `smo` with Sequential Minimal Optimization.
+            Linear kernel only: `cd` (dual coordinate descent) and `pegasos` (primal stochastic sub-gradient) update
+            w directly, one sample or one mini-batch at a time, and accept scipy sparse X.
+        tol: (smo, cd) stopping tolerance on the maximal violation of the optimality conditions.
+        shrinking: (smo) whether to shrink the variables stuck at a bound out of the working set search.
+        cache_size: MB of the LRU cache of kernel rows (see KernelCache). After training, `cache_hits` and
+            `cache_misses` count its lookups.
+        max_iter: (smo) maximum number of iterations, no limit by default. (cd, pegasos) maximum number of epochs,
+            1000 and 50 by default.
+        batch_size: (pegasos) number of samples per sub-gradient step.
+        seed: (cd, pegasos) seed of the sample order, and of the approximation.
+        approximation: None for the exact kernel, or an explicit feature map of `n_components` dimensions
+            approximating the kernel: `rff` (random Fourier features, rbf only) or `nystroem` (see
+            kernel_approximation). The linear solver (cd, pegasos) then trains w on the mapped features, and
+            prediction costs one mapping and one matrix-vector product whatever the number of support vectors.
+
+        With the linear kernel, training keeps the primal w = sum_S(dual_coef * support_vector) and b, so prediction
+        is one matrix-vector product.
+        """
+        assert solver in self.dual_solvers or solver in self.linear_solvers, \
+            "solver must be one of: %s" % (list(self.dual_solvers.keys()) + list(self.linear_solvers.keys()))
+        assert approximation is None or approximation in self.approximations, \
+            "approximation must be None or one of: %s" % list(self.approximations.keys())
+        assert approximation is None or solver in self.linear_solvers, \
+            "approximation needs a linear solver: %s" % list(self.linear_solvers.keys())
+        assert solver not in self.linear_solvers or kernel == 'linear' or approximation is not None, \
+            "solver %s needs the linear kernel or an approximation." % solver
+        self.solver = solver
+        self.tol = tol
+        self.shrinking = shrinking
+        self.cache_size = cache_size
+        self.max_iter = max_iter
+        self.batch_size = batch_size
+        self.seed = seed
+        self.approximation = approximation
+        self.n_components = n_components
+        self.feature_map = None
         self.C = C
         if kernel not in list(self.kernels.keys()):
             self.kernel = 'linear'
@@ -22,7 +69,9 @@ class SVM:
         self.r = r
         self.debug = debug
         self.is_saved = is_saved
-        self.support_vectors, self.dual_coef = None, None
+        self.support_vectors, self.dual_coef, self.b = None, None, None
+        self.w = None
+        self.kernel_cache = None
 
     def _linear_kernel(self, x, z):
         return np.dot(x, z.T)
@@ -87,13 +136,14 @@ class SVM:
         """
         N, D = X_train.shape
 
-        X = getattr(self, self.kernels[self.kernel])(X_train, X_train)
+        X = self.kernel_cache(X_train, self.kernel_cache.sq_norms)
         y = y_train.dot(y_train.T)
-        P = matrix(X*y)  # shape = (N, N)
+        # cvxopt only reads native byte order, .mat files load explicitly little endian ('<f8').
+        P = matrix((X*y).astype(np.float64))  # shape = (N, N)
         q = matrix(-np.ones((N, 1)))
 
         G = matrix(np.concatenate((-np.eye(N), np.eye(N)), axis=0))  # shape = (2N, N)
-        h = matrix(np.array([0] * N + [self.C] * N).reshape(-1, 1))  # shape = (2N, 1)
+        h = matrix(np.array([0] * N + [self.C] * N, dtype=np.float64).reshape(-1, 1))  # shape = (2N, 1)
 
         A = matrix(y_train.T)
         b = matrix(np.zeros((1, 1)))
@@ -104,24 +154,305 @@ class SVM:
         lambda_ = np.array(sol['x'])
         return lambda_
 
+    def _solve_smo(self, X_train, y_train):
+        """
+        Solve the same dual with Sequential Minimal Optimization, as LIBSVM does:
+
+        minimize: f(z) = (1/2)*z'*Q*z - 1'*z, Q_ij = y_i*y_j*k(x_i, x_j)
+        s.t: 0 <= z <= C
+             y'*z = 0
+
+        Each iteration only optimizes 2 variables (i, j), analytically:
+            - i is the maximal violator of the KKT conditions, j maximizes the decrease of f given i
+                (second order working set selection, WSS2 of Fan, Chen and Lin 2005).
+            - the gradient G = Q*z - 1 is updated with the kernel rows of i and j only, from the LRU cache of
+                `self.kernel_cache`.
+            - stop when the maximal violation m(z) - M(z) < tol.
+        Shrinking: every min(N, 1000) iterations, the variables at a bound whose gradient says they will stay there
+        leave the working set search. The gradient of the shrunk variables is rebuilt (from G_bar, the gradient
+        contribution of the variables at C, and the free variables) before the final optimality check.
+
+        :return: lambda_, shape = (N, 1)
+        """
+        y = y_train.reshape(-1)
+        N = y.shape[0]
+        C = self.C
+        tau = 1e-12
+        cache = self.kernel_cache
+
+        def Q(i):
+            return y[i] * y * cache.row(i)
+
+        QD = cache.diagonal()
+        alpha = np.zeros(N)
+        G = -np.ones(N)
+        G_bar = np.zeros(N)
+        active = np.ones(N, dtype=bool)
+        unshrunk = False
+        counter = min(N, 1000)
+        iteration = 0
+
+        def reconstruct_gradient():
+            inactive = ~active
+            if not np.any(inactive):
+                return
+            G[inactive] = G_bar[inactive] - 1
+            for t in np.flatnonzero((alpha > 0) & (alpha < C)):
+                G[inactive] += alpha[t] * Q(t)[inactive]
+
+        def select():
+            """
+            :return: i, j, (Gmax1, Gmax2) with Gmax1 + Gmax2 = m(z) - M(z), j = -1 when there is no violating pair.
+            """
+            yG = -y * G
+            up = active & (((y > 0) & (alpha < C)) | ((y < 0) & (alpha > 0)))
+            low = active & (((y > 0) & (alpha > 0)) | ((y < 0) & (alpha < C)))
+            if not np.any(up) or not np.any(low):
+                return -1, -1, (-np.inf, -np.inf)
+            i = np.flatnonzero(up)[np.argmax(yG[up])]
+            Gmax1, Gmax2 = yG[i], -np.min(yG[low])
+            candidates = np.flatnonzero(low & (yG < Gmax1))
+            if candidates.size == 0:
+                return i, -1, (Gmax1, Gmax2)
+            b = Gmax1 - yG[candidates]
+            a = QD[i] + QD[candidates] - 2 * cache.row(i)[candidates]
+            a = np.where(a > 0, a, tau)
+            j = candidates[np.argmin(-b**2 / a)]
+            return i, j, (Gmax1, Gmax2)
+
+        def shrink(Gmax1, Gmax2):
+            nonlocal unshrunk
+            if not unshrunk and Gmax1 + Gmax2 <= self.tol * 10:
+                unshrunk = True
+                reconstruct_gradient()
+                active[:] = True
+            upper, lower = alpha >= C, alpha <= 0
+            shrunk = ((upper & (((y > 0) & (-G > Gmax1)) | ((y < 0) & (-G > Gmax2)))) |
+                      (lower & (((y > 0) & (G > Gmax2)) | ((y < 0) & (G > Gmax1)))))
+            active[shrunk] = False
+
+        while self.max_iter is None or iteration < self.max_iter:
+            if self.shrinking:
+                counter -= 1
+                if counter == 0:
+                    counter = min(N, 1000)
+                    _, _, (Gmax1, Gmax2) = select()
+                    shrink(Gmax1, Gmax2)
+            i, j, (Gmax1, Gmax2) = select()
+            if j == -1 or Gmax1 + Gmax2 < self.tol:
+                if np.all(active):
+                    break
+                # optimal on the working set: check all the variables.
+                reconstruct_gradient()
+                active[:] = True
+                i, j, (Gmax1, Gmax2) = select()
+                if j == -1 or Gmax1 + Gmax2 < self.tol:
+                    break
+                counter = 1
+            iteration += 1
+
+            Q_i, Q_j = Q(i), Q(j)
+            alpha_i, alpha_j = alpha[i], alpha[j]
+            if y[i] != y[j]:
+                quad = max(QD[i] + QD[j] + 2 * Q_i[j], tau)
+                delta = (-G[i] - G[j]) / quad
+                diff = alpha[i] - alpha[j]
+                alpha[i] += delta
+                alpha[j] += delta
+                if diff > 0:
+                    if alpha[j] < 0:
+                        alpha[j], alpha[i] = 0, diff
+                elif alpha[i] < 0:
+                    alpha[i], alpha[j] = 0, -diff
+                if diff > 0:
+                    if alpha[i] > C:
+                        alpha[i], alpha[j] = C, C - diff
+                elif alpha[j] > C:
+                    alpha[j], alpha[i] = C, C + diff
+            else:
+                quad = max(QD[i] + QD[j] - 2 * Q_i[j], tau)
+                delta = (G[i] - G[j]) / quad
+                total = alpha[i] + alpha[j]
+                alpha[i] -= delta
+                alpha[j] += delta
+                if total > C:
+                    if alpha[i] > C:
+                        alpha[i], alpha[j] = C, total - C
+                elif alpha[j] < 0:
+                    alpha[j], alpha[i] = 0, total
+                if total > C:
+                    if alpha[j] > C:
+                        alpha[j], alpha[i] = C, total - C
+                elif alpha[i] < 0:
+                    alpha[i], alpha[j] = 0, total
+
+            delta_i, delta_j = alpha[i] - alpha_i, alpha[j] - alpha_j
+            G[active] += Q_i[active] * delta_i + Q_j[active] * delta_j
+            # G_bar: gradient contribution of the variables at the upper bound.
+            for t, Q_t, old in [(i, Q_i, alpha_i), (j, Q_j, alpha_j)]:
+                if (old >= C) != (alpha[t] >= C):
+                    G_bar += C * Q_t if alpha[t] >= C else -C * Q_t
+        self.n_iter = iteration
+        # the final gradient gives b when no variable is free (see _solve_svm).
+        reconstruct_gradient()
+        self.gradient = G
+        return alpha.reshape((-1, 1))
+
+    def _solve_dual_cd(self, X_train, y_train):
+        """
+        Linear SVM with dual coordinate descent (Hsieh et al. 2008, the LIBLINEAR solver):
+
+        minimize: f(z) = (1/2)*z'*Q*z - 1'*z, Q_ij = y_i*y_j*(x_i'*x_j + 1)
+        s.t: 0 <= z <= C
+
+        The bias is a constant feature of value 1, so it is regularized and the equality constraint y'*z = 0 is gone:
+        each variable is optimized alone, in closed form, while w = sum_n(z_n*y_n*x_n) and b are kept up to date.
+        One update reads and writes the non-zero features of one sample only, O(nnz(x_i)), so an epoch costs
+        O(nnz(X)) whatever N.
+        Stop when the maximal minus the minimal projected gradient of an epoch is < tol.
+        Shrinking (as LIBLINEAR): a variable at a bound whose gradient is beyond the extreme projected gradients of
+        the previous epoch leaves the epochs, until the remaining ones converge and all the variables are checked.
+
+        :return: w, shape = (D, 1), and b.
+        """
+        X = sparse.csr_matrix(X_train)
+        y = y_train.reshape(-1)
+        N, D = X.shape
+        C = self.C
+        indptr, indices, data = X.indptr, X.indices, X.data
+        QD = np.asarray(X.multiply(X).sum(axis=1)).reshape(-1) + 1
+        alpha = np.zeros(N)
+        w = np.zeros(D)
+        b = 0.0
+        random = np.random.RandomState(self.seed)
+        active = np.arange(N)
+        PG_max_old, PG_min_old = np.inf, -np.inf
+        epoch = 0
+        while epoch < (self.max_iter or 1000):
+            epoch += 1
+            PG_max, PG_min = -np.inf, np.inf
+            active = active[random.permutation(active.size)]
+            keep = np.ones(active.size, dtype=bool)
+            for k, i in enumerate(active):
+                cols, values = indices[indptr[i]:indptr[i+1]], data[indptr[i]:indptr[i+1]]
+                G = y[i] * (values.dot(w[cols]) + b) - 1
+                # projected gradient: 0 when the bound blocks the descent direction.
+                if alpha[i] == 0:
+                    if self.shrinking and G > PG_max_old:
+                        keep[k] = False
+                        continue
+                    PG = min(G, 0)
+                elif alpha[i] == C:
+                    if self.shrinking and G < PG_min_old:
+                        keep[k] = False
+                        continue
+                    PG = max(G, 0)
+                else:
+                    PG = G
+                PG_max, PG_min = max(PG_max, PG), min(PG_min, PG)
+                if PG != 0:
+                    alpha_i = alpha[i]
+                    alpha[i] = min(max(alpha_i - G / QD[i], 0), C)
+                    step = (alpha[i] - alpha_i) * y[i]
+                    w[cols] += step * values
+                    b += step
+            active = active[keep]
+            if PG_max - PG_min < self.tol:
+                if active.size == N:
+                    break
+                # converged on the active variables: check all of them.
+                active = np.arange(N)
+                PG_max_old, PG_min_old = np.inf, -np.inf
+                continue
+            PG_max_old = PG_max if PG_max > 0 else np.inf
+            PG_min_old = PG_min if PG_min < 0 else -np.inf
+        self.n_iter = epoch
+        self.support_indices = np.flatnonzero(alpha > 0)
+        return w.reshape((-1, 1)), b
+
+    def _solve_pegasos(self, X_train, y_train):
+        """
+        Linear SVM with Pegasos (Shalev-Shwartz et al. 2007), stochastic sub-gradient descent on the primal:
+
+        minimize: (lambda/2)*(|w|^2 + b^2) + (1/N)*sum_n(max(0, 1 - y_n*(w'*x_n + b))), lambda = 1/(N*C)
+
+        the same objective as `_solve_dual_cd` (bias regularized as a constant feature). Each step t takes the
+        sub-gradient on a mini-batch of `batch_size` samples with the step size 1/(lambda*t), then projects (w, b)
+        on the ball of radius 1/sqrt(lambda) that contains the optimum. A step costs O(nnz(X_batch)).
+
+        :return: w, shape = (D, 1), and b.
+        """
+        X = X_train.tocsr() if sparse.issparse(X_train) else X_train
+        y = y_train.reshape(-1)
+        N, D = X.shape
+        lambda_ = 1 / (N * self.C)
+        radius = 1 / np.sqrt(lambda_)
+        w = np.zeros(D)
+        b = 0.0
+        random = np.random.RandomState(self.seed)
+        t = 0
+        for epoch in range(self.max_iter or 50):
+            order = random.permutation(N)
+            for start in range(0, N, self.batch_size):
+                batch = order[start:start+self.batch_size]
+                t += 1
+                eta = 1 / (lambda_ * t)
+                violated = batch[y[batch] * (X[batch].dot(w) + b) < 1]
+                w *= 1 - eta * lambda_
+                b *= 1 - eta * lambda_
+                if violated.size:
+                    w += (eta / batch.size) * X[violated].T.dot(y[violated])
+                    b += (eta / batch.size) * np.sum(y[violated])
+                norm = np.sqrt(w.dot(w) + b**2)
+                if norm > radius:
+                    w *= radius / norm
+                    b *= radius / norm
+        self.n_iter = t
+        return w.reshape((-1, 1)), b
+
     def _solve_svm(self, X, y, lambda_):
         """
         lambda_: sparse vector we found from solving lagrange dual function above.
         --------------------------------------------------------------------------------------------------------
         Let S = {n: 0 < lambda_n <= C (epsilon < lambda_n <= C)} support vectors set use for compute w.
         Let M = {m: 0 < lambda_m < C (epsilon < lambda_m < C)} points that lie exactly on margins, use for compute b.
+
+        b = (1/N_M)*sum_M(y_M - sum_S(dual_coef * kernel(support_vector, X_M))), computed once here from the
+        cached kernel rows of the margin points.
+
+        When M is empty (e.g. a small C puts every multiplier at 0 or C), b is the middle of its feasible interval, as
+        LIBSVM does: with the gradient G = Q*lambda - 1 of the dual (kept by `_solve_smo`, computed from the kernel
+        rows of S otherwise),
+            b in [max_L(-y*G), min_U(-y*G)]
+            L = {y = 1, lambda = 0} + {y = -1, lambda = C}, U = {y = 1, lambda = C} + {y = -1, lambda = 0}
         """
         epsilon = 1e-6
         S = np.where(np.logical_and(lambda_ > epsilon, lambda_ <= self.C))[0]
         M = np.where(np.logical_and(lambda_ > epsilon, lambda_ < self.C))[0]
+        self.support_indices = S
         X_S = X[S, :]
         y_S = y[S, :]
         lambda_S = lambda_[S]
-        X_M = X[M, :]
-        y_M = y[M, :]
-        return X_S, lambda_S*y_S, X_M, y_M
-
-    def _train(self, X_train, y_train):
+        dual_coef = lambda_S*y_S
+        if len(M) == 0:
+            y = y.reshape(-1)
+            G = self.gradient
+            if G is None:
+                K_SN = np.array([self.kernel_cache.row(s) for s in S]).reshape((len(S), len(y)))
+                G = y * K_SN.T.dot(dual_coef).reshape(-1) - 1
+            at_C = lambda_.reshape(-1) > epsilon
+            lower = np.logical_or(np.logical_and(y > 0, ~at_C), np.logical_and(y < 0, at_C))
+            yG = -y * G
+            b = (np.max(yG[lower], initial=-np.inf) + np.min(yG[~lower], initial=np.inf)) / 2
+            if not np.isfinite(b):
+                # one side is empty: b is only bounded on the other one.
+                b = np.max(yG[lower]) if np.any(lower) else np.min(yG[~lower])
+            return X_S, dual_coef, b
+        K_MS = np.array([self.kernel_cache.row(m)[S] for m in M]).reshape((len(M), len(S)))
+        b = np.mean(y[M, :] - K_MS.dot(dual_coef))
+        return X_S, dual_coef, b
+
+    def _train(self, X_train, y_train, kernel_cache=None):
         """
         Solve SVM by using Lagrange duality
 
@@ -141,14 +472,44 @@ class SVM:
             self.gamma = 1/X_train.shape[1]
         # elif self.gamma == 'scale':
         #     self.gamma = (1/X_train.shape[1])*np.var(X_train, axis=0)
-        lambda_ = self._solve_lagrange_dual_function(X_train, y_train)
+        self.kernel_cache = kernel_cache or KernelCache(self, X_train, self.cache_size)
+        self.gradient = None
+        lambda_ = getattr(self, self.dual_solvers[self.solver])(X_train, y_train)
         return self._solve_svm(X_train, y_train, lambda_)
 
-    def train(self, X_train, y_train):
+    def train(self, X_train, y_train, kernel_cache=None):
+        """
+        kernel_cache: (qp, smo) kernel evaluations over X_train to use instead of a new KernelCache, e.g. a
+            KernelCacheView of a cache shared with other sub-problems (see MultiClassSVM).
+        """
         assert len(np.unique(y_train)) == 2, "This SVM assumes only work for binary classification."
-        assert type(X_train) is np.ndarray and type(y_train) is np.ndarray, \
-            "Expect numpy array but got %s" % (type(X_train) if type(X_train) is not np.ndarray else type(y_train))
-        self.support_vectors, self.dual_coef, self.X_M, self.y_M = self._train(X_train, y_train)
+        assert type(y_train) is np.ndarray, "Expect numpy array but got %s" % type(y_train)
+        if self.solver in self.linear_solvers and self.approximation is None:
+            assert type(X_train) is np.ndarray or sparse.issparse(X_train), \
+                "Expect numpy array or scipy sparse matrix but got %s" % type(X_train)
+        else:
+            assert type(X_train) is np.ndarray, "Expect numpy array but got %s" % type(X_train)
+        # integer features (e.g. uint8 word counts) would overflow in the kernels.
+        X_train = X_train.astype(np.float64, copy=False)
+        if self.solver in self.linear_solvers:
+            features = X_train
+            if self.approximation is not None:
+                if self.gamma == 'auto':
+                    self.gamma = 1/X_train.shape[1]
+                # w lives in the space of the mapped features.
+                self.feature_map = self.approximations[self.approximation](self, self.n_components, self.seed)
+                features = self.feature_map.fit(X_train).transform(X_train)
+            self.w, self.b = getattr(self, self.linear_solvers[self.solver])(features, y_train)
+            self.support_vectors, self.dual_coef = None, None
+        else:
+            self.support_vectors, self.dual_coef, self.b = self._train(X_train, y_train, kernel_cache)
+            self.cache_hits, self.cache_misses = self.kernel_cache.hits, self.kernel_cache.misses
+            if self.kernel == 'linear':
+                self.w = self.support_vectors.T.dot(self.dual_coef)
+                self.kernel_cache = None
+            else:
+                # prediction evaluates the kernel against the support vectors only.
+                self.kernel_cache = KernelCache(self, self.support_vectors, self.cache_size)
         if self.debug:
             self._check_with_sklearn(X_train, y_train)
 
@@ -164,16 +525,24 @@ class SVM:
         print("-"*50)
 
     def decision(self, X_test):
-        assert type(X_test) is np.ndarray, "Expect numpy array but got %s" % (type(X_test))
-        w = self.dual_coef.T.dot(getattr(self, self.kernels[self.kernel])(self.support_vectors, X_test))
-        b = np.mean(self.y_M - self.dual_coef.T.dot(getattr(self, self.kernels[self.kernel])(self.support_vectors, self.X_M)))
-        pred = w + b
+        # sparse input like in training: linear solvers without an approximation only.
+        assert type(X_test) is np.ndarray or (self.w is not None and self.feature_map is None and
+                                              sparse.issparse(X_test)), \
+            "Expect numpy array but got %s" % (type(X_test))
+        X_test = X_test.astype(np.float64, copy=False)
+        # one row per test point, like y.
+        if self.feature_map is not None:
+            X_test = self.feature_map.transform(X_test)
+        if self.w is not None:
+            return X_test.dot(self.w) + self.b
+        pred = self.kernel_cache(X_test).dot(self.dual_coef) + self.b
         return pred
 
     def predict(self, X_test):
         """
-        w = np.dot(dual_coef, kernel(support_vector, X_test))
-        b = (1/N_M)*sum_M(y_M - sum_S(dual_coef * kernel(support_vector, X_M)))
+        linear kernel: X_test.dot(w) + b, w and b computed once by `train`.
+        approximation: z(X_test).dot(w) + b, z the feature map.
+        other kernels: np.dot(kernel(X_test, support_vector), dual_coef) + b, b computed once by `train`.
         """
         pred = self.decision(X_test)
         pred[pred >= 0] = 1